@@ -3,13 +3,18 @@
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php.
 
 """
-This module provides the ASNEntry and ASMap classes.
+This module provides the ASNEntry, ASMap and BinaryASMap classes.
 """
 
+import bisect
 import copy
 import ipaddress
+import mmap
+import os
 import random
+import tempfile
 import unittest
+from array import array
 from collections.abc import Callable, Iterable
 from enum import Enum
 from functools import total_ordering
@@ -47,6 +52,15 @@ def prefix_to_net(prefix: list[bool]) -> Union[ipaddress.IPv4Network,ipaddress.I
     # Return IPv6 range otherwise.
     return ipaddress.IPv6Network((netrange, num_bits), True)
 
+def ip_to_int(addr: Union[ipaddress.IPv4Address,ipaddress.IPv6Address]) -> int:
+    """
+    Convert an IPv4 or IPv6 address to a 128-bit integer, whose bits from the top are the
+    prefix of that address as returned by net_to_prefix.
+    """
+    if isinstance(addr, ipaddress.IPv4Address):
+        return int(addr) + 0xffff00000000
+    return int(addr)
+
 # Shortcut for (prefix, ASN) entries.
 ASNEntry = tuple[list[bool], int]
 
@@ -139,12 +153,32 @@ class _VarLenCoder:
             val += bit << (bits - 1 - i)
         return val, bitpos
 
+# Translation tables between bits as bytes 0/1 and as the characters '0'/'1'.
+_BITS_TO_CHARS = bytes.maketrans(b"\x00\x01", b"01")
+_CHARS_TO_BITS = bytes.maketrans(b"01", b"\x00\x01")
+
 # Variable-length encoders used in the binary asmap format.
 _CODER_INS = _VarLenCoder(0, [0, 0, 1])
 _CODER_ASN = _VarLenCoder(1, list(range(15, 25)))
 _CODER_MATCH = _VarLenCoder(2, list(range(1, 9)))
 _CODER_JUMP = _VarLenCoder(17, list(range(5, 31)))
 
+class _BitStream:
+    """Indexable bits of a bytes-like object, starting at the least significant bit of each byte."""
+
+    def __init__(self, data: memoryview):
+        """Construct a new _BitStream. The data is not copied."""
+        self._data = data
+        self._len = 8 * len(data)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, bitpos: int) -> int:
+        if not 0 <= bitpos < self._len:
+            raise IndexError("bit position out of range")
+        return (self._data[bitpos >> 3] >> (bitpos & 7)) & 1
+
 class _Instruction(Enum):
     """One instruction in the binary asmap format."""
     # A return instruction, encoded as [0], returns a constant ASN. It is followed by
@@ -280,11 +314,16 @@ class ASMap:
     - [int] means a subnet mapped entirely to the specified ASN.
     - [node,node] means a subnet whose lower half and upper half have different
     -             mappings, represented by new trie nodes.
+
+    For looking up individual addresses, the trie is flattened on first use into a
+    table of the sorted start addresses of all ranges and their ASNs, which is
+    searched by bisection.
     """
 
     def update(self, prefix: list[bool], asn: int) -> None:
         """Update this ASMap object to map prefix to the specified asn."""
         assert asn == 0 or _CODER_ASN.can_encode(asn)
+        self._table = None
 
         def recurse(node: list, offset: int) -> None:
             if offset == len(prefix):
@@ -331,10 +370,12 @@ class ASMap:
                     node.append(asn)
         recurse(trie)
         self._trie = trie
+        self._table = None
 
     def __init__(self, entries: Optional[Iterable[ASNEntry]] = None) -> None:
         """Construct an ASMap object from an optional list of entries."""
         self._trie = [0]
+        self._table: Optional[tuple[list[int], array]] = None
         if entries is not None:
             def entry_key(entry):
                 """Sort function that places shorter prefixes first."""
@@ -354,6 +395,48 @@ class ASMap:
             return node[0]
         return None
 
+    def _get_table(self) -> tuple[list[int], array]:
+        """Return the sorted start addresses of all ranges, and their ASNs."""
+        if self._table is None:
+            starts: list[int] = []
+            asns = array('I')
+            stack = [(self._trie, 0, 0)]
+            while stack:
+                node, start, depth = stack.pop()
+                if len(node) == 2:
+                    stack.append((node[1], start + (1 << (127 - depth)), depth + 1))
+                    stack.append((node[0], start, depth + 1))
+                elif not asns or asns[-1] != node[0]:
+                    # Adjacent ranges mapped to the same ASN are merged.
+                    starts.append(start)
+                    asns.append(node[0])
+            self._table = (starts, asns)
+        return self._table
+
+    def lookup_int(self, addr: int) -> int:
+        """Look up an address as returned by ip_to_int. Returns ASN, or 0 if unassigned."""
+        assert 0 <= addr < (1 << 128)
+        starts, asns = self._get_table()
+        return asns[bisect.bisect_right(starts, addr) - 1]
+
+    def lookup_many(self, addrs: Iterable[int]) -> list[int]:
+        """
+        Look up many addresses as returned by ip_to_int. Returns a list with the ASN
+        (or 0 if unassigned) of every address, in the same order.
+
+        The addresses are answered in sorted order, so that every search only has to
+        consider the part of the table past the range of the previous address.
+        """
+        addrs = list(addrs)
+        assert all(0 <= addr < (1 << 128) for addr in addrs)
+        starts, asns = self._get_table()
+        ret = [0] * len(addrs)
+        pos = 0
+        for idx in sorted(range(len(addrs)), key=addrs.__getitem__):
+            pos = bisect.bisect_right(starts, addrs[idx], pos) - 1
+            ret[idx] = asns[pos]
+        return ret
+
     def _to_entries_flat(self, fill: bool = False) -> list[ASNEntry]:
         """Convert an ASMap object to a list of non-overlapping (prefix, asn) objects."""
         prefix : list[bool] = []
@@ -507,33 +590,6 @@ class ASMap:
         res, _ = recurse(self._trie)
         return res[0] if 0 in res else res[None]
 
-    @staticmethod
-    def _from_binnode(binnode: _BinNode) -> "ASMap":
-        """Construct an ASMap object from a _BinNode. Internal use only."""
-        def recurse(node: _BinNode, default: int) -> list:
-            if node.ins == _Instruction.RETURN:
-                return [node.arg1]
-            if node.ins == _Instruction.JUMP:
-                return [recurse(node.arg1, default), recurse(node.arg2, default)]
-            if node.ins == _Instruction.MATCH:
-                val = node.arg1
-                sub = recurse(node.arg2, default)
-                while val >= 2:
-                    bit = val & 1
-                    val >>= 1
-                    if bit:
-                        sub = [[default], sub]
-                    else:
-                        sub = [sub, [default]]
-                return sub
-            assert node.ins == _Instruction.DEFAULT
-            return recurse(node.arg2, node.arg1)
-        ret = ASMap()
-        if binnode.ins != _Instruction.END:
-            #pylint: disable=protected-access
-            ret._set_trie(recurse(binnode, 0))
-        return ret
-
     def to_binary(self, fill: bool = False) -> bytes:
         """
         Convert this ASMap object to binary.
@@ -567,63 +623,67 @@ class ASMap:
         if binnode.ins != _Instruction.END:
             recurse(binnode)
 
-        val = 0
-        nbits = 0
-        ret = []
-        for bit in bits:
-            val += (bit << nbits)
-            nbits += 1
-            if nbits == 8:
-                ret.append(val)
-                val = 0
-                nbits = 0
-        if nbits:
-            ret.append(val)
-        return bytes(ret)
+        if not bits:
+            return b""
+        # Bits are packed starting at the least significant bit of each byte, which is the
+        # little endian encoding of the number with the bits in reverse order as digits.
+        digits = bytes(bits).translate(_BITS_TO_CHARS)[::-1]
+        return int(digits, 2).to_bytes((len(bits) + 7) // 8, 'little')
 
     @staticmethod
     def from_binary(bindata: bytes) -> Optional["ASMap"]:
         """Decode an ASMap object from the provided binary encoding."""
+        ret = ASMap()
+        if len(bindata) == 0:
+            return ret
 
-        bits: list[int] = []
-        for byte in bindata:
-            bits.extend((byte >> i) & 1 for i in range(8))
+        # One byte (0 or 1) per bit, starting at the least significant bit of each byte.
+        digits = format(int.from_bytes(bindata, 'little'), f'0{8 * len(bindata)}b')
+        bits = digits.encode()[::-1].translate(_CHARS_TO_BITS)
+        ins_return, ins_jump, ins_match = (_Instruction.RETURN.value, _Instruction.JUMP.value,
+                                           _Instruction.MATCH.value)
 
-        def recurse(bitpos: int) -> tuple[_BinNode, int]:
+        def recurse(bitpos: int, default: int) -> tuple[list, int]:
+            """Decode the program at bitpos directly into a trie node."""
             insval, bitpos = _CODER_INS.decode(bits, bitpos)
-            ins = _Instruction(insval)
-            if ins == _Instruction.RETURN:
+            if insval == ins_return:
                 asn, bitpos = _CODER_ASN.decode(bits, bitpos)
-                return _BinNode(ins, asn), bitpos
-            if ins == _Instruction.JUMP:
+                return [asn], bitpos
+            if insval == ins_jump:
                 jump, bitpos = _CODER_JUMP.decode(bits, bitpos)
-                left, bitpos1 = recurse(bitpos)
+                left, bitpos1 = recurse(bitpos, default)
                 if bitpos1 != bitpos + jump:
                     raise ValueError("Inconsistent jump")
-                right, bitpos = recurse(bitpos1)
-                return _BinNode(ins, left, right), bitpos
-            if ins == _Instruction.MATCH:
-                match, bitpos = _CODER_MATCH.decode(bits, bitpos)
-                sub, bitpos = recurse(bitpos)
-                return _BinNode(ins, match, sub), bitpos
-            assert ins == _Instruction.DEFAULT
+                right, bitpos = recurse(bitpos1, default)
+                return [left, right], bitpos
+            if insval == ins_match:
+                val, bitpos = _CODER_MATCH.decode(bits, bitpos)
+                sub, bitpos = recurse(bitpos, default)
+                # The mismatching side of every matched bit returns the default.
+                while val >= 2:
+                    bit = val & 1
+                    val >>= 1
+                    if bit:
+                        sub = [[default], sub]
+                    else:
+                        sub = [sub, [default]]
+                return sub, bitpos
+            assert insval == _Instruction.DEFAULT.value
             asn, bitpos = _CODER_ASN.decode(bits, bitpos)
-            sub, bitpos = recurse(bitpos)
-            return _BinNode(ins, asn, sub), bitpos
+            return recurse(bitpos, asn)
 
-        if len(bits) == 0:
-            binnode = _BinNode(_Instruction.END)
-        else:
-            try:
-                binnode, bitpos = recurse(0)
-            except (ValueError, IndexError):
-                return None
-            if bitpos < len(bits) - 7:
-                return None
-            if not all(bit == 0 for bit in bits[bitpos:]):
-                return None
+        try:
+            trie, bitpos = recurse(0, 0)
+        except (ValueError, IndexError):
+            return None
+        if bitpos < len(bits) - 7:
+            return None
+        if any(bits[bitpos:]):
+            return None
 
-        return ASMap._from_binnode(binnode)
+        #pylint: disable=protected-access
+        ret._set_trie(trie)
+        return ret
 
     def __lt__(self, other: "ASMap") -> bool:
         return self._trie < other._trie
@@ -685,6 +745,96 @@ class ASMap:
         return self.__copy__()
 
 
+class BinaryASMap:
+    """
+    A read-only mapping from subnets to ASNs, backed directly by data in the binary
+    asmap format.
+
+    Unlike ASMap.from_binary, constructing a BinaryASMap object does not decode or
+    validate the data. Instead, every lookup executes the encoded program for the
+    queried address, like the Interpret() function in Bitcoin Core does. The data can
+    be any bytes-like object, such as an mmap of an asmap file, and is not copied.
+
+    Every instruction is decoded when it is executed for the first time, and stored in
+    an index by its bit position. Later lookups passing through the same part of the
+    program only follow the decoded instructions and jumps in that index.
+    """
+
+    def __init__(self, data) -> None:
+        """Construct a BinaryASMap object for binary asmap data."""
+        self._bits = _BitStream(memoryview(data).cast('B'))
+        # Decoded instructions by bit position, as (instruction, argument, next bit position).
+        self._index: dict[int, tuple[int, int, int]] = {}
+
+    @staticmethod
+    def from_file(path: Union[str, os.PathLike]) -> "BinaryASMap":
+        """Construct a BinaryASMap object for the binary asmap file at path, mapped into memory."""
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files cannot be mapped.
+                return BinaryASMap(b"")
+            return BinaryASMap(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def _decode(self, bitpos: int) -> tuple[int, int, int]:
+        """Return the decoded instruction at bitpos, from the index if possible."""
+        ins = self._index.get(bitpos)
+        if ins is None:
+            try:
+                insval, pos = _CODER_INS.decode(self._bits, bitpos)
+                if insval == _Instruction.JUMP.value:
+                    arg, pos = _CODER_JUMP.decode(self._bits, pos)
+                    if pos + arg >= len(self._bits):
+                        raise ValueError("Jump past end of asmap")
+                elif insval == _Instruction.MATCH.value:
+                    arg, pos = _CODER_MATCH.decode(self._bits, pos)
+                else:
+                    arg, pos = _CODER_ASN.decode(self._bits, pos)
+            except IndexError as e:
+                raise ValueError("Unexpected end of asmap") from e
+            ins = (insval, arg, pos)
+            self._index[bitpos] = ins
+        return ins
+
+    def lookup_int(self, addr: int) -> int:
+        """Look up an address as returned by ip_to_int. Returns ASN, or 0 if unassigned."""
+        assert 0 <= addr < (1 << 128)
+        if len(self._bits) == 0:
+            return 0
+        ins_return, ins_jump, ins_match = (_Instruction.RETURN.value, _Instruction.JUMP.value,
+                                           _Instruction.MATCH.value)
+        # Number of bits of addr not consumed yet.
+        bits = 128
+        default = 0
+        bitpos = 0
+        while True:
+            insval, arg, bitpos = self._decode(bitpos)
+            if insval == ins_return:
+                return arg
+            if insval == ins_jump:
+                if bits == 0:
+                    raise ValueError("Jump without input bits left")
+                bits -= 1
+                if (addr >> bits) & 1:
+                    bitpos += arg
+            elif insval == ins_match:
+                matchlen = arg.bit_length() - 1
+                if bits < matchlen:
+                    raise ValueError("Match without enough input bits left")
+                bits -= matchlen
+                mask = (1 << matchlen) - 1
+                if (addr >> bits) & mask != arg & mask:
+                    return default
+            else:
+                default = arg
+
+    def lookup_many(self, addrs: Iterable[int]) -> list[int]:
+        """
+        Look up many addresses as returned by ip_to_int. Returns a list with the ASN
+        (or 0 if unassigned) of every address, in the same order.
+        """
+        return [self.lookup_int(addr) for addr in addrs]
+
+
 class TestASMap(unittest.TestCase):
     """Unit tests for this module."""
 
@@ -814,5 +964,60 @@ class TestASMap(unittest.TestCase):
                                 # And such a patch must exist.
                                 self.assertTrue(found)
 
+    def test_lookup_int(self) -> None:
+        """Test that lookup_int and lookup_many agree with lookup of the full prefix."""
+        for leaves in range(1, 20):
+            for pct in range(0, 101, 10):
+                asmap = ASMap.from_random(num_leaves=leaves, max_asn=100,
+                                          unassigned_prob=0.01 * pct)
+                addrs = [random.getrandbits(128) for _ in range(50)]
+                # Include the boundaries of the address space, and duplicates.
+                addrs += [0, (1 << 128) - 1, addrs[0]]
+                expected = [asmap.lookup([((addr >> (127 - i)) & 1) != 0 for i in range(128)])
+                            for addr in addrs]
+                self.assertEqual([asmap.lookup_int(addr) for addr in addrs], expected)
+                self.assertEqual(asmap.lookup_many(addrs), expected)
+                self.assertEqual(asmap.lookup_many(iter(addrs)), expected)
+                # Updating the ASMap object invalidates the table.
+                asmap.update([], 7)
+                self.assertEqual(asmap.lookup_many(addrs), [7] * len(addrs))
+
+        for net, addr in (("1.2.3.0/24", "1.2.3.4"), ("2001:db8::/32", "2001:db8::1")):
+            asmap = ASMap([(net_to_prefix(ipaddress.ip_network(net)), 42)])
+            self.assertEqual(asmap.lookup_int(ip_to_int(ipaddress.ip_address(addr))), 42)
+            self.assertEqual(asmap.lookup_int(ip_to_int(ipaddress.ip_address(addr)) ^ (1 << 127)), 0)
+
+    def test_binary_lookup(self) -> None:
+        """Test that BinaryASMap lookups agree with lookups in the decoded ASMap object."""
+        for leaves in range(1, 20):
+            for pct in range(0, 101, 10):
+                asmap = ASMap.from_random(num_leaves=leaves, max_asn=100000,
+                                          unassigned_prob=0.01 * pct)
+                addrs = [random.getrandbits(128) for _ in range(50)] + [0, (1 << 128) - 1]
+                expected = asmap.lookup_many(addrs)
+                binary = BinaryASMap(asmap.to_binary(fill=False))
+                self.assertEqual(binary.lookup_many(addrs), expected)
+                # Repeated lookups are answered from the instruction index.
+                self.assertEqual(binary.lookup_many(addrs), expected)
+                binary = BinaryASMap(asmap.to_binary(fill=True))
+                for addr, asn in zip(addrs, expected):
+                    if asn != 0:
+                        self.assertEqual(binary.lookup_int(addr), asn)
+
+        asmap = ASMap([(net_to_prefix(ipaddress.ip_network("1.2.3.0/24")), 42),
+                       (net_to_prefix(ipaddress.ip_network("2001:db8::/32")), 43)])
+        addrs = [ip_to_int(ipaddress.ip_address(addr)) for addr in ("1.2.3.4", "2001:db8::1", "::1")]
+        enc = asmap.to_binary()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "asmap.dat")
+            with open(path, 'wb') as f:
+                f.write(enc)
+            self.assertEqual(BinaryASMap.from_file(path).lookup_many(addrs), [42, 43, 0])
+            open(path, 'wb').close()
+            self.assertEqual(BinaryASMap.from_file(path).lookup_many(addrs), [0, 0, 0])
+        # Truncated data is only detected when the missing part is executed.
+        with self.assertRaises(ValueError):
+            BinaryASMap(enc[:len(enc) // 2]).lookup_many(addrs)
+
 if __name__ == '__main__':
     unittest.main()
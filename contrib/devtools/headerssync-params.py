@@ -5,8 +5,10 @@
 
 """Script to find the optimal parameters for the headerssync module through simulation."""
 
+from concurrent.futures import ProcessPoolExecutor
 from math import log, exp, sqrt
 from datetime import datetime, timedelta
+import os
 import random
 
 # Parameters:
@@ -38,6 +40,9 @@ ATTACK_FRACTION = 0.2
 # to influence the outcome. Set to False for a stronger guarantee to get the optimal result.
 ASSUME_CONVEX = True
 
+# How many candidate period values to evaluate in parallel, each in its own process. [processes]
+PARALLELISM = os.cpu_count() or 1
+
 # Explanation:
 #
 #  The headerssync module implements a DoS protection against low-difficulty header spam which does
@@ -151,6 +156,35 @@ def lambert_w(value):
     return approx
 
 
+def undetected_probability(period, headers):
+    """Compute the probability that forged headers have not been detected yet.
+
+    headers is the number of forged headers received. The result is averaged over all alignments
+    of the commitments if RANDOMIZE_OFFSET, or assumes a commitment right before the first forged
+    header if not.
+    """
+    # For a given alignment, after_good_commit = headers + offset is the number of headers after
+    # the last commitment for an honest block, where offset in [0, period) is the number of honest
+    # headers between that commitment and the first forged header. The attack is detected with
+    # probability 1/2 for every further commitment, so it survives with probability
+    # 0.5**(after_good_commit // period).
+    full_periods, remainder = divmod(headers, period)
+    if not RANDOMIZE_OFFSET:
+        # The attacker starts forging right after a commitment, so offset is 0.
+        return 0.5 ** full_periods
+    # When the alignment is randomized, every offset in [0, period) is equally likely. The
+    # period - remainder smallest ones have full_periods commitments after the honest one, the
+    # remainder largest ones one more.
+    return 0.5 ** full_periods * (1.0 - remainder / (2 * period))
+
+
+# Memoized results of attack_rate: (period, bufsize) -> (rate, honest).
+ATTACK_RATES: dict[tuple[int, int], tuple[float, int]] = {}
+# Lower bounds on the result of attack_rate for (period, bufsize) configurations whose
+# computation was stopped early because the limit was exceeded: (period, bufsize) -> rate.
+ATTACK_RATE_LOWER_BOUNDS: dict[tuple[int, int], float] = {}
+
+
 def attack_rate(period, bufsize, limit=None):
     """Compute maximal accepted headers per attack in (period, bufsize) configuration.
 
@@ -158,6 +192,11 @@ def attack_rate(period, bufsize, limit=None):
     value in limit.
     """
 
+    if (period, bufsize) in ATTACK_RATES:
+        return ATTACK_RATES[period, bufsize]
+    if limit is not None and ATTACK_RATE_LOWER_BOUNDS.get((period, bufsize), limit - 1) >= limit:
+        return ATTACK_RATE_LOWER_BOUNDS[period, bufsize], None
+
     max_rate = None
     max_honest = None
     # Let the current batch 0 being received be the first one in which the attacker starts lying.
@@ -169,48 +208,43 @@ def attack_rate(period, bufsize, limit=None):
         # This is the number being computed.
         rate = 0
 
-        # Iterate over the possible alignments of commitments w.r.t. the first batch. In case
-        # the alignments are randomized, try all values. If not, the attacker can know/choose
-        # the alignment, and will always start forging right after a commitment.
-        if RANDOMIZE_OFFSET:
-            align_choices = list(range(period))
-        else:
-            align_choices = [(honest - 1) % period]
-        # Now loop over those possible alignment values, computing the average attack rate
-        # over them by dividing each contribution by len(align_choices).
-        for align in align_choices:
-            # These state variables capture the situation after receiving the first batch.
-            # - The number of headers received after the last commitment for an honest block:
-            after_good_commit = HEADER_BATCH_COUNT - honest + ((honest - align - 1) % period)
-            # - The number of forged headers in the redownload buffer:
-            forged_in_buf = HEADER_BATCH_COUNT - honest
-
-            # Now iterate over the next batches of headers received, adding contributions to the
-            # rate variable.
-            while True:
-                # Process the first HEADER_BATCH_COUNT headers in the buffer:
-                accept_forged_headers = max(forged_in_buf - bufsize, 0)
-                forged_in_buf -= accept_forged_headers
-                if accept_forged_headers:
-                    # The probability the attack has not been detected yet at this point:
-                    prob = 0.5 ** (after_good_commit // period)
-                    # Update attack rate, divided by align_choices to average over the alignments.
-                    rate += accept_forged_headers * prob / len(align_choices)
-                    # If this means we exceed limit, bail out early (performance optimization).
-                    if limit is not None and rate >= limit:
-                        return rate, None
-                    # If the maximal term being added is negligible compared to rate, stop
-                    # iterating.
-                    if HEADER_BATCH_COUNT * prob < 1.0e-16 * rate * len(align_choices):
-                        break
-                # Update state from a new incoming batch (which is all forged)
-                after_good_commit += HEADER_BATCH_COUNT
-                forged_in_buf += HEADER_BATCH_COUNT
+        # The possible alignments of commitments w.r.t. the first batch only affect the
+        # probability that the attack has not been detected yet, which undetected_probability
+        # averages over them. These state variables capture the situation after receiving the
+        # first batch.
+        # - The number of forged headers received so far:
+        forged_received = HEADER_BATCH_COUNT - honest
+        # - The number of forged headers in the redownload buffer:
+        forged_in_buf = HEADER_BATCH_COUNT - honest
+
+        # Now iterate over the next batches of headers received, adding contributions to the
+        # rate variable.
+        while True:
+            # Process the first HEADER_BATCH_COUNT headers in the buffer:
+            accept_forged_headers = max(forged_in_buf - bufsize, 0)
+            forged_in_buf -= accept_forged_headers
+            if accept_forged_headers:
+                # The probability the attack has not been detected yet at this point:
+                prob = undetected_probability(period, forged_received)
+                # Update attack rate.
+                rate += accept_forged_headers * prob
+                # If this means we exceed limit, bail out early (performance optimization).
+                if limit is not None and rate >= limit:
+                    ATTACK_RATE_LOWER_BOUNDS[period, bufsize] = rate
+                    return rate, None
+                # If the maximal term being added is negligible compared to rate (or zero, once
+                # prob underflows), stop iterating.
+                if HEADER_BATCH_COUNT * prob <= 1.0e-16 * rate:
+                    break
+            # Update state from a new incoming batch (which is all forged)
+            forged_received += HEADER_BATCH_COUNT
+            forged_in_buf += HEADER_BATCH_COUNT
 
         if max_rate is None or rate > max_rate:
             max_rate = rate
             max_honest = honest
 
+    ATTACK_RATES[period, bufsize] = (max_rate, max_honest)
     return max_rate, max_honest
 
 
@@ -287,40 +321,57 @@ def optimize(when):
 
     # Consider all period values between 1 and MINCHAINWORK_HEADERS, except the one just tried.
     periods = [iv for iv in range(1, MINCHAINWORK_HEADERS + 1) if iv != period]
-    # Iterate, picking a random element from periods, computing its corresponding bufsize, and
-    # then using the result to shrink the period.
-    while True:
-        # Remove all periods whose memory usage for low-work long chain sync exceed the best
-        # memory usage we've found so far.
-        periods = [p for p in periods if find_max_headers(when) // p < best[2][0]]
-        # Stop if there is nothing left to try.
-        if len(periods) == 0:
-            break
-        # Pick a random remaining option for period size, and compute corresponding bufsize.
-        period = periods.pop(random.randrange(len(periods)))
-        # The buffer size (at a given attack level) cannot shrink as the period grows. Find the
-        # largest period smaller than the selected one we know the buffer size for, and use that
-        # as a lower bound to find_bufsize.
-        min_bufsize = max([(p, b) for p, b in maps if p < period] + [(0,0)])[1]
-        bufsize = find_bufsize(period, ATTACK_HEADERS, when, best[2][0], min_bufsize)
-        if bufsize is not None:
-            # We found a (period, bufsize) configuration with better memory usage than our best
-            # so far. Remember it for future lower bounds.
-            maps.append((period, bufsize))
-            mem = memory_usage(period, bufsize, when)
-            assert mem[0] <= best[2][0]
-            if ASSUME_CONVEX:
-                # Remove all periods that are on the other side of the former best as the new
-                # best.
-                periods = [p for p in periods if (p < best[0]) == (period < best[0])]
-            best = (period, bufsize, mem)
-            print(f"- New best: period={period}, buffer={bufsize}, mem={mem[0] / 8192:.3f} KiB")
-        else:
-            # The (period, bufsize) configuration we found is worse than what we already had.
-            if ASSUME_CONVEX:
-                # Remove all periods that are on the other side of the tried configuration as the
-                # best one.
-                periods = [p for p in periods if (p < period) == (best[0] < period)]
+    # Iterate, picking PARALLELISM random elements from periods, computing their corresponding
+    # bufsize in parallel, and then using the results to shrink the period.
+    with ProcessPoolExecutor(max_workers=PARALLELISM) as executor:
+        best_changed = True
+        while True:
+            if best_changed:
+                # Remove all periods whose memory usage for low-work long chain sync exceed the
+                # best memory usage we've found so far.
+                periods = [p for p in periods if find_max_headers(when) // p < best[2][0]]
+                best_changed = False
+            # Stop if there is nothing left to try.
+            if len(periods) == 0:
+                break
+            # Pick random remaining options for period size (swapping them to the end of the list
+            # first, so removing them is cheap), and compute corresponding bufsizes.
+            batch = []
+            for _ in range(min(PARALLELISM, len(periods))):
+                idx = random.randrange(len(periods))
+                periods[idx], periods[-1] = periods[-1], periods[idx]
+                batch.append(periods.pop())
+            futures = []
+            for period in batch:
+                # The buffer size (at a given attack level) cannot shrink as the period grows.
+                # Find the largest period smaller than the selected one we know the buffer size
+                # for, and use that as a lower bound to find_bufsize.
+                min_bufsize = max([(p, b) for p, b in maps if p < period] + [(0,0)])[1]
+                futures.append(executor.submit(find_bufsize, period, ATTACK_HEADERS, when,
+                                               best[2][0], min_bufsize))
+            for period, future in zip(batch, futures):
+                bufsize = future.result()
+                if bufsize is not None:
+                    # We found a (period, bufsize) configuration with better memory usage than
+                    # our best when it was submitted. Remember it for future lower bounds.
+                    maps.append((period, bufsize))
+                    mem = memory_usage(period, bufsize, when)
+                # An earlier result of the same batch may have improved the best one meanwhile.
+                if bufsize is not None and mem[0] <= best[2][0]:
+                    if ASSUME_CONVEX:
+                        # Remove all periods that are on the other side of the former best as the
+                        # new best.
+                        periods = [p for p in periods if (p < best[0]) == (period < best[0])]
+                    best = (period, bufsize, mem)
+                    best_changed = True
+                    print(f"- New best: period={period}, buffer={bufsize}, mem={mem[0] / 8192:.3f} KiB")
+                else:
+                    # The (period, bufsize) configuration we found is worse than what we already
+                    # had.
+                    if ASSUME_CONVEX:
+                        # Remove all periods that are on the other side of the tried configuration
+                        # as the best one.
+                        periods = [p for p in periods if (p < period) == (best[0] < period)]
 
     # Return the result.
     period, bufsize, _ = best
@@ -354,4 +405,5 @@ def analyze(when):
     print(f"  (where each attack costs {attack_volume / 8388608:.3f} MiB bandwidth)")
 
 
-analyze(TIME)
+if __name__ == '__main__':
+    analyze(TIME)
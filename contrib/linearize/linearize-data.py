@@ -9,6 +9,7 @@
 
 import struct
 import re
+import mmap
 import os
 import os.path
 import sys
@@ -16,7 +17,8 @@ import hashlib
 import datetime
 import time
 import glob
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 settings = {}
 
@@ -76,6 +78,84 @@ def getFirstBlockFileId(block_dir_path):
     blkId = int(firstBlkFn[3:8])
     return blkId
 
+# Number of input block files kept open (and mapped) for fetching out-of-order blocks.
+MAX_OPEN_INPUT_FILES = 16
+# Number of input block files after the current one that are read ahead in the background.
+READ_AHEAD_FILES = 2
+READ_AHEAD_CHUNK = 1 << 20
+
+def getXorKey(block_dir_path):
+    '''Return the key the block files are obfuscated with (see xor.dat in blockstorage.cpp), or None.'''
+    try:
+        with open(os.path.join(block_dir_path, "xor.dat"), "rb") as f:
+            key = f.read()
+    except FileNotFoundError:
+        return None
+    if not any(key):
+        return None
+    return key
+
+def xorAt(data, key, offset):
+    '''De-obfuscate data, which was read at the given offset of a block file.'''
+    if key is None or not data:
+        return bytes(data)
+    start = offset % len(key)
+    stream = (key[start:] + key * (len(data) // len(key) + 1))[:len(data)]
+    return (int.from_bytes(data, 'little') ^ int.from_bytes(stream, 'little')).to_bytes(len(data), 'little')
+
+class BlockFile:
+    '''A memory mapped input block file, read-only.'''
+    def __init__(self, fname, netmagic, xor_key):
+        self.fname = fname
+        self.xor_key = xor_key
+        with open(fname, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.data = b""
+        # The magic bytes look different depending on the key bytes they are obfuscated with, so
+        # search for each variant, but only accept matches at offsets where that variant applies.
+        if xor_key is None:
+            self.patterns = [(netmagic, None)]
+        else:
+            self.patterns = [(xorAt(netmagic, xor_key, r), r) for r in range(len(xor_key))]
+        # Offset of the next match of every pattern (None: not searched yet, -1: no more matches)
+        self.matches = [None] * len(self.patterns)
+
+    def findMagic(self, pos):
+        '''Return the offset of the next network magic at or after pos, or -1.'''
+        best = -1
+        for i, (pattern, residue) in enumerate(self.patterns):
+            match = self.matches[i]
+            if match is None or (match != -1 and match < pos):
+                match = self.data.find(pattern, pos)
+                while match != -1 and residue is not None and match % len(self.xor_key) != residue:
+                    match = self.data.find(pattern, match + 1)
+                self.matches[i] = match
+            if match != -1 and (best == -1 or match < best):
+                best = match
+        return best
+
+    def read(self, offset, size):
+        return xorAt(self.data[offset:offset + size], self.xor_key, offset)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+def readAhead(fname):
+    '''Get a block file into the OS page cache before it is scanned.'''
+    try:
+        with open(fname, "rb") as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                return
+            buf = bytearray(READ_AHEAD_CHUNK)
+            while f.readinto(buf):
+                pass
+    except OSError:
+        pass
+
 # Block header and extent on disk
 BlockExtent = namedtuple('BlockExtent', ['fn', 'offset', 'inhdr', 'blkhdr', 'size'])
 
@@ -89,6 +169,12 @@ class BlockDataCopier:
         # will not necessarily be 0
         self.inFn = getFirstBlockFileId(self.settings['input'])
         self.inF = None
+        self.inPos = 0
+        self.xorKey = getXorKey(self.settings['input'])
+        # Open input files, least recently used first
+        self.inFiles = OrderedDict()
+        self.readAheadPool = ThreadPoolExecutor(max_workers=READ_AHEAD_FILES)
+        self.readAheadFn = self.inFn
         self.outFn = 0
         self.outsz = 0
         self.outF = None
@@ -161,11 +247,30 @@ class BlockDataCopier:
     def inFileName(self, fn):
         return os.path.join(self.settings['input'], "blk%05d.dat" % fn)
 
+    def getInputFile(self, fn):
+        '''Return the mapped input file fn, keeping the most recently used ones open.'''
+        if fn in self.inFiles:
+            self.inFiles.move_to_end(fn)
+            return self.inFiles[fn]
+        blockFile = BlockFile(self.inFileName(fn), self.settings['netmagic'], self.xorKey)
+        self.inFiles[fn] = blockFile
+        if len(self.inFiles) > MAX_OPEN_INPUT_FILES:
+            # Close the least recently used file, unless it is the one being scanned
+            oldFn = next(f for f in self.inFiles if f != self.inFn)
+            self.inFiles.pop(oldFn).close()
+        return blockFile
+
+    def startReadAhead(self):
+        '''Read the files after the current input file ahead in the background.'''
+        while self.readAheadFn <= self.inFn + READ_AHEAD_FILES:
+            fname = self.inFileName(self.readAheadFn)
+            if os.path.exists(fname):
+                self.readAheadPool.submit(readAhead, fname)
+            self.readAheadFn += 1
+
     def fetchBlock(self, extent):
         '''Fetch block contents from disk given extents'''
-        with open(self.inFileName(extent.fn), "rb") as f:
-            f.seek(extent.offset)
-            return f.read(extent.size)
+        return self.getInputFile(extent.fn).read(extent.offset, extent.size)
 
     def copyOneBlock(self):
         '''Find the next block to be written in the input, and copy it to the output.'''
@@ -185,30 +290,29 @@ class BlockDataCopier:
                 fname = self.inFileName(self.inFn)
                 print("Input file " + fname)
                 try:
-                    self.inF = open(fname, "rb")
+                    self.inF = self.getInputFile(self.inFn)
                 except IOError:
                     print("Premature end of block data")
                     return
+                self.inPos = 0
+                self.startReadAhead()
 
-            inhdr = self.inF.read(8)
-            if (not inhdr or (inhdr[0] == "\0")):
-                self.inF.close()
+            # Find the next block, skipping any data (such as the zeros of a pre-allocated
+            # file) which does not start with the magic bytes.
+            magicPos = self.inF.findMagic(self.inPos)
+            if magicPos == -1 or magicPos + 8 + 80 > len(self.inF.data):
                 self.inF = None
                 self.inFn = self.inFn + 1
                 continue
 
-            inMagic = inhdr[:4]
-            if (inMagic != self.settings['netmagic']):
-                # Seek backwards 7 bytes (skipping the first byte in the previous search)
-                # and continue searching from the new position if the magic bytes are not
-                # found.
-                self.inF.seek(-7, os.SEEK_CUR)
-                continue
+            inhdr = self.inF.read(magicPos, 8)
             inLenLE = inhdr[4:]
             su = struct.unpack("<I", inLenLE)
             inLen = su[0] - 80 # length without header
-            blk_hdr = self.inF.read(80)
-            inExtent = BlockExtent(self.inFn, self.inF.tell(), inhdr, blk_hdr, inLen)
+            blk_hdr = self.inF.read(magicPos + 8, 80)
+            blkOffset = magicPos + 8 + 80
+            inExtent = BlockExtent(self.inFn, blkOffset, inhdr, blk_hdr, inLen)
+            self.inPos = blkOffset + inLen
 
             self.hash_str = calc_hash_str(blk_hdr)
             if not self.hash_str in blkmap:
@@ -216,7 +320,6 @@ class BlockDataCopier:
                 # may encounter blocks it doesn't know about. Treat as debug output.
                 if settings['debug_output'] == 'true':
                     print("Skipping unknown block " + self.hash_str)
-                self.inF.seek(inLen, os.SEEK_CUR)
                 continue
 
             blkHeight = self.blkmap[self.hash_str]
@@ -224,7 +327,7 @@ class BlockDataCopier:
 
             if self.blkCountOut == blkHeight:
                 # If in-order block, just copy
-                rawblock = self.inF.read(inLen)
+                rawblock = self.inF.read(blkOffset, inLen)
                 self.writeBlock(inhdr, blk_hdr, rawblock)
 
                 # See if we can catch up to prior out-of-order blocks
@@ -237,11 +340,10 @@ class BlockDataCopier:
                     # If there is space in the cache, read the data
                     # Reading the data in file sequence instead of seeking and fetching it later is preferred,
                     # but we don't want to fill up memory
-                    self.outOfOrderData[blkHeight] = self.inF.read(inLen)
+                    self.outOfOrderData[blkHeight] = self.inF.read(blkOffset, inLen)
                     self.outOfOrderSize += inLen
-                else: # If no space in cache, seek forward
-                    self.inF.seek(inLen, os.SEEK_CUR)
 
+        self.readAheadPool.shutdown(wait=False)
         print("Done (%i blocks written)" % (self.blkCountOut))
 
 if __name__ == '__main__':
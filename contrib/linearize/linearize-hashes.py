@@ -7,6 +7,8 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 #
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from http.client import HTTPConnection
 import json
 import re
@@ -14,6 +16,8 @@ import base64
 import sys
 import os
 import os.path
+import threading
+import time
 
 settings = {}
 
@@ -58,32 +62,100 @@ class BitcoinRPC:
     def response_is_error(resp_obj):
         return 'error' in resp_obj and resp_obj['error'] is not None
 
-def get_block_hashes(settings, max_blocks_per_call=10000):
+def format_hash(settings, block_hash):
+    if settings['rev_hash_bytes'] == 'true':
+        return bytes.fromhex(block_hash)[::-1].hex()
+    return block_hash
+
+def fetch_hashes_by_height(rpc, settings, height, num_blocks):
+    '''Return the hashes of num_blocks blocks from height on, fetched in one batch, or None.'''
+    batch = []
+    for x in range(num_blocks):
+        batch.append(rpc.build_request(x, 'getblockhash', [height + x]))
+
+    reply = rpc.execute(batch)
+    if reply is None:
+        return None
+
+    hashes = []
+    for x,resp_obj in enumerate(reply):
+        if rpc.response_is_error(resp_obj):
+            print('JSON-RPC: error at height', height+x, ': ', resp_obj['error'], file=sys.stderr)
+            sys.exit(1)
+        assert resp_obj['id'] == x  # assume replies are in-sequence
+        hashes.append(format_hash(settings, resp_obj['result']))
+    return hashes
+
+def get_block_hashes(settings, out, max_blocks_per_call=10000):
+    '''Fetch the hashes by height, keeping up to rpc_connections batches in flight.'''
+    local = threading.local()
+
+    def fetch(height, num_blocks):
+        # Every worker thread uses its own keep-alive connection.
+        if not hasattr(local, 'rpc'):
+            local.rpc = BitcoinRPC(settings['host'], settings['port'],
+                     settings['rpcuser'], settings['rpcpassword'])
+        return fetch_hashes_by_height(local.rpc, settings, height, num_blocks)
+
+    num_connections = settings['rpc_connections']
+    count = 0
+    with ThreadPoolExecutor(max_workers=num_connections) as executor:
+        pending = deque()
+        height = settings['min_height']
+        while height < settings['max_height']+1 or pending:
+            # Queue up batches, two per connection, so that every connection always has a
+            # request in flight while the results of the oldest batch are written.
+            while height < settings['max_height']+1 and len(pending) < 2 * num_connections:
+                num_blocks = min(settings['max_height']+1-height, max_blocks_per_call)
+                pending.append(executor.submit(fetch, height, num_blocks))
+                height += num_blocks
+
+            hashes = pending.popleft().result()
+            if hashes is None:
+                print('Cannot continue. Program will halt.')
+                for future in pending:
+                    future.cancel()
+                return None
+            out.write('\n'.join(hashes) + '\n')
+            count += len(hashes)
+    return count
+
+def walk_block_hashes(settings, out):
+    '''Fetch the hashes by walking back from the block at max_height (or the tip) via previousblockhash.
+
+    Unlike fetching by height, all hashes are guaranteed to be from one chain, even if there is a
+    reorg while they are fetched.'''
     rpc = BitcoinRPC(settings['host'], settings['port'],
              settings['rpcuser'], settings['rpcpassword'])
-
-    height = settings['min_height']
-    while height < settings['max_height']+1:
-        num_blocks = min(settings['max_height']+1-height, max_blocks_per_call)
-        batch = []
-        for x in range(num_blocks):
-            batch.append(rpc.build_request(x, 'getblockhash', [height + x]))
-
-        reply = rpc.execute(batch)
+    reply = rpc.execute(rpc.build_request(0, 'getblockcount', None))
+    if reply is None:
+        print('Cannot continue. Program will halt.')
+        return None
+    height = min(settings['max_height'], reply['result'])
+    reply = rpc.execute(rpc.build_request(0, 'getblockhash', [height]))
+    if reply is None:
+        print('Cannot continue. Program will halt.')
+        return None
+    if rpc.response_is_error(reply):
+        print('JSON-RPC: error at height', height, ': ', reply['error'], file=sys.stderr)
+        sys.exit(1)
+    block_hash = reply['result']
+    hashes = [block_hash]
+    while height > settings['min_height']:
+        reply = rpc.execute(rpc.build_request(0, 'getblockheader', [block_hash]))
         if reply is None:
             print('Cannot continue. Program will halt.')
             return None
+        if rpc.response_is_error(reply):
+            print('JSON-RPC: error at block', block_hash, ': ', reply['error'], file=sys.stderr)
+            sys.exit(1)
+        block_hash = reply['result']['previousblockhash']
+        hashes.append(block_hash)
+        height -= 1
 
-        for x,resp_obj in enumerate(reply):
-            if rpc.response_is_error(resp_obj):
-                print('JSON-RPC: error at height', height+x, ': ', resp_obj['error'], file=sys.stderr)
-                sys.exit(1)
-            assert resp_obj['id'] == x  # assume replies are in-sequence
-            if settings['rev_hash_bytes'] == 'true':
-                resp_obj['result'] = bytes.fromhex(resp_obj['result'])[::-1].hex()
-            print(resp_obj['result'])
-
-        height += num_blocks
+    hashes.reverse()
+    out.write('\n'.join(format_hash(settings, h) for h in hashes) + '\n')
+    return len(hashes)
 
 def get_rpc_cookie():
     # Open the cookie file
@@ -121,6 +193,10 @@ if __name__ == '__main__':
         settings['max_height'] = 313000
     if 'rev_hash_bytes' not in settings:
         settings['rev_hash_bytes'] = 'false'
+    if 'rpc_connections' not in settings:
+        settings['rpc_connections'] = 4
+    if 'walk_back' not in settings:
+        settings['walk_back'] = 'false'
 
     use_userpass = True
     use_datadir = False
@@ -135,6 +211,8 @@ if __name__ == '__main__':
     settings['port'] = int(settings['port'])
     settings['min_height'] = int(settings['min_height'])
     settings['max_height'] = int(settings['max_height'])
+    settings['rpc_connections'] = int(settings['rpc_connections'])
+    settings['walk_back'] = settings['walk_back'].lower()
 
     # Force hash byte format setting to be lowercase to make comparisons easier.
     settings['rev_hash_bytes'] = settings['rev_hash_bytes'].lower()
@@ -143,4 +221,14 @@ if __name__ == '__main__':
     if use_datadir:
         get_rpc_cookie()
 
-    get_block_hashes(settings)
+    out = open(settings['output_hashlist'], 'w', encoding="utf8") if 'output_hashlist' in settings else sys.stdout
+    start_time = time.time()
+    if settings['walk_back'] == 'true':
+        count = walk_block_hashes(settings, out)
+    else:
+        count = get_block_hashes(settings, out)
+    if out is not sys.stdout:
+        out.close()
+    if count is not None:
+        elapsed = time.time() - start_time
+        print('Fetched %i hashes in %.1f s (%.0f hashes/s)' % (count, elapsed, count / max(elapsed, 1e-9)), file=sys.stderr)
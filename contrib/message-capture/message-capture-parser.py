@@ -5,22 +5,35 @@
 """Parse message capture binary files.  To be used in conjunction with -capturemessages."""
 
 import argparse
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+import heapq
+import mmap
 import os
+from operator import itemgetter
 import shutil
+import struct
 import sys
-from io import BytesIO
 import json
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Iterator, NamedTuple, Optional, TextIO
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../test/functional'))
 
-from test_framework.messages import ser_uint256     # noqa: E402
+from test_framework.messages import ByteReader, ser_uint256     # noqa: E402
 from test_framework.p2p import MESSAGEMAP           # noqa: E402
 
 TIME_SIZE = 8
 LENGTH_SIZE = 4
 MSGTYPE_SIZE = 12
+# Header of every message in a capture file: time, msgtype, length
+HEADER = struct.Struct("<Q12sI")
+assert HEADER.size == TIME_SIZE + MSGTYPE_SIZE + LENGTH_SIZE
+
+# Approximate size of the parts a capture file is split into for parsing.
+CHUNK_SIZE = 1 << 20
+# Number of parsed chunks kept in flight for each capture file.
+READAHEAD = 2
 
 # The test framework classes stores hashes as large ints in many cases.
 # These are variables of type uint256 in core.
@@ -76,6 +89,9 @@ def to_jsonable(obj: Any) -> Any:
     elif hasattr(obj, "__slots__"):
         ret = {}    # type: Any
         for slot in obj.__slots__:
+            if slot.startswith("_"):
+                # Internal state such as caches, not part of the message
+                continue
             val = getattr(obj, slot, None)
             if slot in HASH_INTS and isinstance(val, int):
                 ret[slot] = ser_uint256(val).hex()
@@ -92,79 +108,189 @@ def to_jsonable(obj: Any) -> Any:
         return obj
 
 
-def process_file(path: str, messages: list[Any], recv: bool, progress_bar: Optional[ProgressBar]) -> None:
-    with open(path, 'rb') as f_in:
-        if progress_bar:
-            bytes_read = 0
+class MessageFilter(NamedTuple):
+    """Selects messages by their capture header, so that others can be skipped without decoding them."""
+    msgtypes: Optional[frozenset[bytes]] = None
+    since: Optional[int] = None
+    until: Optional[int] = None
 
-        while True:
-            if progress_bar:
-                # Update progress bar
-                diff = f_in.tell() - bytes_read - 1
-                progress_bar.update(diff)
-                bytes_read = f_in.tell() - 1
-
-            # Read the Header
-            tmp_header_raw = f_in.read(TIME_SIZE + LENGTH_SIZE + MSGTYPE_SIZE)
-            if not tmp_header_raw:
-                break
-            tmp_header = BytesIO(tmp_header_raw)
-            time = int.from_bytes(tmp_header.read(TIME_SIZE), "little")      # type: int
-            msgtype = tmp_header.read(MSGTYPE_SIZE).split(b'\x00', 1)[0]     # type: bytes
-            length = int.from_bytes(tmp_header.read(LENGTH_SIZE), "little")  # type: int
-
-            # Start converting the message to a dictionary
-            msg_dict = {}
-            msg_dict["direction"] = "recv" if recv else "sent"
-            msg_dict["time"] = time
-            msg_dict["size"] = length   # "size" is less readable here, but more readable in the output
-
-            msg_ser = BytesIO(f_in.read(length))
-
-            # Determine message type
-            if msgtype not in MESSAGEMAP:
-                # Unrecognized message type
-                try:
-                    msgtype_tmp = msgtype.decode()
-                    if not msgtype_tmp.isprintable():
-                        raise UnicodeDecodeError
-                    msg_dict["msgtype"] = msgtype_tmp
-                except UnicodeDecodeError:
-                    msg_dict["msgtype"] = "UNREADABLE"
-                msg_dict["body"] = msg_ser.read().hex()
-                msg_dict["error"] = "Unrecognized message type."
-                messages.append(msg_dict)
-                print(f"WARNING - Unrecognized message type {msgtype} in {path}", file=sys.stderr)
+    def selects(self, time: int, msgtype: bytes) -> bool:
+        if self.msgtypes is not None and msgtype not in self.msgtypes:
+            return False
+        if self.since is not None and time < self.since:
+            return False
+        if self.until is not None and time > self.until:
+            return False
+        return True
+
+
+def iter_headers(data: Any, end: int, pos: int = 0) -> Iterator[tuple[int, int, bytes, int]]:
+    """Yield (offset, time, msgtype, length) for every message header in data[pos:end].
+
+    A truncated header at the end of data is ignored."""
+    while pos + HEADER.size <= end:
+        time, msgtype, length = HEADER.unpack_from(data, pos)
+        yield pos, time, msgtype.split(b'\x00', 1)[0], length
+        pos += HEADER.size + length
+
+
+def plan_file(path: str, msg_filter: MessageFilter, chunk_size: int) -> tuple[list[tuple[int, int]], bool]:
+    """Split a capture file into chunks of whole messages of about chunk_size bytes each.
+
+    Only the headers are read. Returns the (start, end) offsets of the chunks, and whether the
+    selected messages in the file are in chronological order."""
+    chunks = []
+    ordered = True
+    size = os.path.getsize(path)
+    if size == 0:
+        return chunks, ordered
+    with open(path, 'rb') as f_in, mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        chunk_start = 0
+        pos = 0
+        last_time = None
+        for pos, time, msgtype, _ in iter_headers(data, size):
+            if not msg_filter.selects(time, msgtype):
                 continue
+            if last_time is not None and time < last_time:
+                ordered = False
+            last_time = time
+            if pos - chunk_start >= chunk_size:
+                chunks.append((chunk_start, pos))
+                chunk_start = pos
+        chunks.append((chunk_start, size))
+    return chunks, ordered
 
-            # Deserialize the message
-            msg = MESSAGEMAP[msgtype]()
-            msg_dict["msgtype"] = msgtype.decode()
 
+def parse_chunk(path: str, recv: bool, start: int, end: int, msg_filter: MessageFilter) -> list[tuple[int, str]]:
+    """Deserialize the messages selected by msg_filter in path[start:end].
+
+    Returns a list of (time, message) tuples, each message already encoded as JSON."""
+    with open(path, 'rb') as f_in:
+        f_in.seek(start)
+        data = memoryview(f_in.read(end - start))
+    messages = []
+    for pos, time, msgtype, length in iter_headers(data, len(data)):
+        if not msg_filter.selects(time, msgtype):
+            continue
+        body = data[pos + HEADER.size:pos + HEADER.size + length]
+
+        # Start converting the message to a dictionary
+        msg_dict = {}  # type: dict[str, Any]
+        msg_dict["direction"] = "recv" if recv else "sent"
+        msg_dict["time"] = time
+        msg_dict["size"] = length   # "size" is less readable here, but more readable in the output
+
+        # Determine message type
+        if msgtype not in MESSAGEMAP:
+            # Unrecognized message type
             try:
-                msg.deserialize(msg_ser)
-            except KeyboardInterrupt:
-                raise
-            except Exception:
-                # Unable to deserialize message body
-                msg_ser.seek(0, os.SEEK_SET)
-                msg_dict["body"] = msg_ser.read().hex()
-                msg_dict["error"] = "Unable to deserialize message."
-                messages.append(msg_dict)
-                print(f"WARNING - Unable to deserialize message in {path}", file=sys.stderr)
-                continue
+                msgtype_tmp = msgtype.decode()
+                if not msgtype_tmp.isprintable():
+                    raise UnicodeDecodeError
+                msg_dict["msgtype"] = msgtype_tmp
+            except UnicodeDecodeError:
+                msg_dict["msgtype"] = "UNREADABLE"
+            msg_dict["body"] = body.hex()
+            msg_dict["error"] = "Unrecognized message type."
+            messages.append((time, json.dumps(msg_dict)))
+            print(f"WARNING - Unrecognized message type {msgtype} in {path}", file=sys.stderr)
+            continue
+
+        # Deserialize the message
+        msg = MESSAGEMAP[msgtype]()
+        msg_dict["msgtype"] = msgtype.decode()
+
+        try:
+            msg.deserialize(ByteReader(body))
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            # Unable to deserialize message body
+            msg_dict["body"] = body.hex()
+            msg_dict["error"] = "Unable to deserialize message."
+            messages.append((time, json.dumps(msg_dict)))
+            print(f"WARNING - Unable to deserialize message in {path}", file=sys.stderr)
+            continue
+
+        # Convert body of message into a jsonable object
+        if length:
+            msg_dict["body"] = to_jsonable(msg)
+        messages.append((time, json.dumps(msg_dict)))
+    return messages
+
+
+class SerialExecutor(Executor):
+    """Executor which runs each task in the calling process when it is submitted."""
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()  # type: Future
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
 
-            # Convert body of message into a jsonable object
-            if length:
-                msg_dict["body"] = to_jsonable(msg)
-            messages.append(msg_dict)
 
-        if progress_bar:
-            # Update the progress bar to the end of the current file
-            # in case we exited the loop early
-            f_in.seek(0, os.SEEK_END)   # Go to end of file
-            diff = f_in.tell() - bytes_read - 1
-            progress_bar.update(diff)
+def process_file(executor: Executor, path: str, recv: bool, plan: tuple[list[tuple[int, int]], bool],
+                 msg_filter: MessageFilter, progress_bar: Optional[ProgressBar]) -> Iterator[tuple[int, str]]:
+    """Yield the selected messages of a capture file as (time, message) tuples in chronological order.
+
+    The first READAHEAD chunks are submitted to the executor right away, and one more whenever a
+    chunk has been consumed, so that all files are decoded in parallel while at most READAHEAD
+    decoded chunks per file are kept in memory."""
+    chunks, ordered = plan
+    if not ordered:
+        # The merge of all files needs each file in order, so decode and sort this one in full.
+        print(f"WARNING - Messages in {path} are not in chronological order, sorting them in memory", file=sys.stderr)
+    readahead = READAHEAD if ordered else len(chunks)
+    pending = deque()  # type: deque[tuple[Future, int]]
+    next_chunk = 0
+
+    def submit_chunks():
+        nonlocal next_chunk
+        while next_chunk < len(chunks) and len(pending) < readahead:
+            start, end = chunks[next_chunk]
+            pending.append((executor.submit(parse_chunk, path, recv, start, end, msg_filter), end - start))
+            next_chunk += 1
+
+    submit_chunks()
+
+    def messages() -> Iterator[tuple[int, str]]:
+        collected = []
+        while pending:
+            future, chunk_size = pending.popleft()
+            result = future.result()
+            submit_chunks()
+            if progress_bar:
+                progress_bar.update(chunk_size)
+            if ordered:
+                yield from result
+            else:
+                collected.extend(result)
+        collected.sort(key=itemgetter(0))
+        yield from collected
+
+    return messages()
+
+
+def write_messages(messages: Iterator[tuple[int, str]], f_out: TextIO, ndjson: bool) -> None:
+    """Write the messages, either as one JSON array or as one JSON object per line."""
+    if ndjson:
+        for _, msg in messages:
+            f_out.write(msg)
+            f_out.write("\n")
+        return
+    f_out.write("[")
+    separator = ""
+    for _, msg in messages:
+        f_out.write(separator)
+        f_out.write(msg)
+        separator = ", "
+    f_out.write("]")
+
+
+def peer_name(peer: str) -> str:
+    """Return the name of the capture directory of a peer given as ADDR:PORT or as its directory name."""
+    return peer.replace(':', '_')
 
 
 def main():
@@ -183,32 +309,69 @@ def main():
         "-n", "--no-progress-bar",
         action='store_true',
         help="disable the progress bar.  Automatically set if the output is not a terminal")
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="number of processes to parse the capture files with (default: 1, 0 for one per CPU)")
+    parser.add_argument(
+        "--ndjson",
+        action='store_true',
+        help="write one JSON object per message and line, instead of a single JSON array")
+    parser.add_argument(
+        "--msgtype",
+        action='append',
+        help="only output messages of this type.  Can be given multiple times")
+    parser.add_argument(
+        "--since",
+        type=int,
+        help="only output messages captured at or after this time, in microseconds since the epoch")
+    parser.add_argument(
+        "--until",
+        type=int,
+        help="only output messages captured at or before this time, in microseconds since the epoch")
+    parser.add_argument(
+        "--peer",
+        action='append',
+        help="only parse the capture files of this peer, given as ADDR:PORT or as the name of its\n"
+             "message_capture directory.  Can be given multiple times")
     args = parser.parse_args()
     capturepaths = [Path.cwd() / Path(capturepath) for capturepath in args.capturepaths]
+    if args.peer:
+        peers = {peer_name(peer) for peer in args.peer}
+        capturepaths = [capture for capture in capturepaths if capture.parent.name in peers]
     output = Path.cwd() / Path(args.output) if args.output else False
     use_progress_bar = (not args.no_progress_bar) and sys.stdout.isatty()
+    msg_filter = MessageFilter(
+        msgtypes=frozenset(msgtype.encode() for msgtype in args.msgtype) if args.msgtype else None,
+        since=args.since,
+        until=args.until)
 
-    messages = []   # type: list[Any]
     if use_progress_bar:
         total_size = sum(capture.stat().st_size for capture in capturepaths)
         progress_bar = ProgressBar(total_size)
     else:
         progress_bar = None
 
-    for capture in capturepaths:
-        process_file(str(capture), messages, "recv" in capture.stem, progress_bar)
+    jobs = args.jobs or os.cpu_count()
+    with (ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else SerialExecutor()) as executor:
+        plans = [executor.submit(plan_file, str(capture), msg_filter, CHUNK_SIZE) for capture in capturepaths]
+        files = [process_file(executor, str(capture), "recv" in capture.stem, plan.result(), msg_filter, progress_bar)
+                 for capture, plan in zip(capturepaths, plans)]
+        # Each file is in chronological order, so a k-way merge sorts all messages. Messages
+        # with the same time keep the order of the capture files on the command line.
+        messages = heapq.merge(*files, key=itemgetter(0))
 
-    messages.sort(key=lambda msg: msg['time'])
+        if output:
+            with open(str(output), 'w+', encoding="utf8") as f_out:
+                write_messages(messages, f_out, args.ndjson)
+        else:
+            write_messages(messages, sys.stdout, args.ndjson)
+            if not args.ndjson:
+                print()
 
     if use_progress_bar:
         progress_bar.set_progress(1)
 
-    jsonrep = json.dumps(messages)
-    if output:
-        with open(str(output), 'w+', encoding="utf8") as f_out:
-            f_out.write(jsonrep)
-    else:
-        print(jsonrep)
-
 if __name__ == "__main__":
     main()
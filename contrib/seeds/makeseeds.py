@@ -16,7 +16,7 @@ from typing import Union
 
 asmap_dir = Path(__file__).parent.parent / "asmap"
 sys.path.append(str(asmap_dir))
-from asmap import ASMap, net_to_prefix  # noqa: E402
+from asmap import BinaryASMap, ip_to_int  # noqa: E402
 
 NSEEDS=512
 
@@ -143,7 +143,7 @@ def filtermultiport(ips: list[dict]) -> list[dict]:
     return [value[0] for (key,value) in list(hist.items()) if len(value)==1]
 
 # Based on Greg Maxwell's seed_filter.py
-def filterbyasn(asmap: ASMap, ips: list[dict], max_per_asn: dict, max_per_net: int) -> list[dict]:
+def filterbyasn(asmap: BinaryASMap, ips: list[dict], max_per_asn: dict, max_per_net: int) -> list[dict]:
     """ Prunes `ips` by
     (a) trimming ips to have at most `max_per_net` ips from each net (e.g. ipv4, ipv6); and
     (b) trimming ips to have at most `max_per_asn` ips from each asn in each net.
@@ -158,12 +158,13 @@ def filterbyasn(asmap: ASMap, ips: list[dict], max_per_asn: dict, max_per_net: i
     net_count: dict[str, int] = collections.defaultdict(int)
     asn_count: dict[int, int] = collections.defaultdict(int)
 
-    for i, ip in enumerate(ips_ipv46):
+    # Look up the ASNs of all ips at once
+    asns = asmap.lookup_many(ip_to_int(ipaddress.ip_address(ip['ip'])) for ip in ips_ipv46)
+    for ip, asn in zip(ips_ipv46, asns):
         if net_count[ip['net']] == max_per_net:
             # do not add this ip as we already too many
             # ips from this network
             continue
-        asn = asmap.lookup(net_to_prefix(ipaddress.ip_network(ip['ip'])))
         if not asn or asn_count[ip['net'], asn] == max_per_asn[ip['net']]:
             # do not add this ip as we already have too many
             # ips from this ASN on this network
@@ -197,8 +198,7 @@ def main():
     args = parse_args()
 
     print(f'Loading asmap database "{args.asmap}"…', end='', file=sys.stderr, flush=True)
-    with open(args.asmap, 'rb') as f:
-        asmap = ASMap.from_binary(f.read())
+    asmap = BinaryASMap.from_file(args.asmap)
     print('Done.', file=sys.stderr)
 
     print('Loading and parsing DNS seeds…', end='', file=sys.stderr, flush=True)
@@ -1,13 +1,25 @@
 #!/usr/bin/env python3
 
+import functools
+import hashlib
+import http.server
 import json
+import os
+import socket
 import sys
 import subprocess
+import tempfile
+import threading
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import verify  # noqa: E402
+
 
 def main():
     """Tests ordered roughly from faster to slower."""
+    test_local_hosts()
+
     expect_code(run_verify("", "pub", '0.32'), 4, "Nonexistent version should fail")
     expect_code(run_verify("", "pub", '0.32.awefa.12f9h'), 11, "Malformed version should fail")
     expect_code(run_verify('--min-good-sigs 20', "pub", "22.0"), 9, "--min-good-sigs 20 should fail")
@@ -44,6 +56,74 @@ def main():
     assert v['bitcoin-22.0-x86_64-linux-gnu.tar.gz'] == '59ebd25dd82a51638b7a6bb914586201e67db67b919b2a1ff08925a7936d1b16'
 
 
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_directory(directory: str) -> tuple[http.server.ThreadingHTTPServer, str]:
+    """Serve the files in directory over HTTP on localhost, returning the server and its URL."""
+    server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', 0), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def unused_url() -> str:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def test_local_hosts():
+    """Fetch from hosts served on localhost and hash the files, without network access."""
+    print("- testing fetching from local hosts and hashing", flush=True)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        sums = ''.join(f"{i:064x}  bitcoin-{i}.tar.gz\n" for i in range(3)).encode()
+        servers = []
+        urls = []
+        for name, contents in [('primary', sums), ('equal', sums), ('different', sums + b"0" * 64 + b"  extra\n")]:
+            os.makedirs(os.path.join(tmp, name, 'bin'))
+            with open(os.path.join(tmp, name, 'bin', 'SHA256SUMS'), 'wb') as f:
+                f.write(contents)
+            server, url = serve_directory(os.path.join(tmp, name))
+            servers.append(server)
+            urls.append(url)
+        primary, equal, different = urls
+        missing = unused_url()
+        os.makedirs(os.path.join(tmp, 'work'))
+        os.chdir(os.path.join(tmp, 'work'))
+        try:
+            def fetch(hosts, require_all=False):
+                return verify.get_files_from_hosts_and_compare(hosts, '/bin/SHA256SUMS', 'SHA256SUMS', require_all)
+
+            R = verify.ReturnCode
+            assert fetch([primary, equal]) == R.SUCCESS
+            assert fetch([primary, equal, equal], require_all=True) == R.SUCCESS
+            assert fetch([primary, different]) == R.FILES_NOT_EQUAL
+            assert fetch([primary, missing]) == R.SUCCESS
+            assert fetch([primary, missing], require_all=True) == R.FILE_MISSING_FROM_ONE_HOST
+            assert fetch([missing, equal]) == R.FILE_GET_FAILED
+            print("✓ 'fetching from local hosts' passed")
+
+            data = os.urandom(2 * verify.HASH_CHUNK_SIZE + 1)
+
+            for size in [0, 1, verify.HASH_CHUNK_SIZE - 1, verify.HASH_CHUNK_SIZE, verify.HASH_CHUNK_SIZE + 1, len(data)]:
+                with open('binary', 'wb') as f:
+                    f.write(data[:size])
+                assert verify.sha256_file('binary') == hashlib.sha256(data[:size]).hexdigest()
+            hashes = [[hashlib.sha256(sums).hexdigest(), 'SHA256SUMS'], [hashlib.sha256(data).hexdigest(), 'binary']]
+            assert verify.verify_binary_hashes(hashes, jobs=2) == (R.SUCCESS, {f: h for h, f in hashes})
+            assert verify.verify_binary_hashes([hashes[0], ['00' * 32, 'binary']])[0] == R.INTEGRITY_FAILURE
+            print("✓ 'hashing files' passed")
+        finally:
+            os.chdir(cwd)
+            for server in servers:
+                server.shutdown()
+                server.server_close()
+
+
 def run_verify(global_args: str, command: str, command_args: str) -> subprocess.CompletedProcess:
     maybe_here = Path.cwd() / 'verify.py'
     path = maybe_here if maybe_here.exists() else Path.cwd() / 'contrib' / 'verify-binaries' / 'verify.py'
@@ -29,6 +29,7 @@ JSON output can by obtained by setting env BINVERIFY_JSON=1.
 """
 import argparse
 import difflib
+import filecmp
 import json
 import logging
 import os
@@ -39,9 +40,11 @@ import sys
 import shutil
 import tempfile
 import textwrap
+import time
 import urllib.request
 import urllib.error
 import enum
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from hashlib import sha256
 from pathlib import PurePath, Path
 
@@ -51,6 +54,10 @@ HOST2 = "https://bitcoin.org"
 VERSIONPREFIX = "bitcoin-core-"
 SUMS_FILENAME = 'SHA256SUMS'
 SIGNATUREFILENAME = f"{SUMS_FILENAME}.asc"
+# Files are hashed in chunks of this size, so they are never fully loaded into memory.
+HASH_CHUNK_SIZE = 1 << 20
+# Number of binaries downloaded from the primary host at the same time.
+MAX_PARALLEL_DOWNLOADS = 4
 
 
 class ReturnCode(enum.IntEnum):
@@ -239,11 +246,7 @@ def parse_gpg_result(
 
 
 def files_are_equal(filename1, filename2):
-    with open(filename1, 'rb') as file1:
-        contents1 = file1.read()
-    with open(filename2, 'rb') as file2:
-        contents2 = file2.read()
-    eq = contents1 == contents2
+    eq = filecmp.cmp(filename1, filename2, shallow=False)
 
     if not eq:
         with open(filename1, 'r', encoding='utf-8') as f1, \
@@ -276,8 +279,14 @@ def get_files_from_hosts_and_compare(
     def join_url(host: str) -> str:
         return host.rstrip('/') + '/' + path.lstrip('/')
 
+    # Fetch from all hosts at the same time, then evaluate the results in order. The other hosts
+    # are fetched from even if the primary host fails, but their results are ignored then.
+    fnames = [filename] + [filename + f'.{i + 2}' for i in range(len(other_hosts))]
+    with ThreadPoolExecutor(max_workers=len(hosts)) as pool:
+        results = list(pool.map(download_with_wget, map(join_url, hosts), fnames))
+
     url = join_url(primary_host)
-    success, output = download_with_wget(url, filename)
+    success, output = results[0]
     if not success:
         log.error(
             f"couldn't fetch file ({url}). "
@@ -290,10 +299,8 @@ def get_files_from_hosts_and_compare(
         log.info(f"got file {url} as {filename}")
         got_files.append(filename)
 
-    for i, host in enumerate(other_hosts):
+    for host, fname, (success, output) in zip(other_hosts, fnames[1:], results[1:]):
         url = join_url(host)
-        fname = filename + f'.{i + 2}'
-        success, output = download_with_wget(url, fname)
 
         if require_all and not success:
             log.error(
@@ -430,17 +437,38 @@ def parse_sums_file(sums_file_path: str, filename_filter: list[str]) -> list[lis
         return [line.split()[:2] for line in hash_file if len(filename_filter) == 0 or any(f in line for f in filename_filter)]
 
 
-def verify_binary_hashes(hashes_to_verify: list[list[str]]) -> tuple[ReturnCode, dict[str, str]]:
+def sha256_file(filename) -> str:
+    """Hash a file in chunks and return the hex digest."""
+    hasher = sha256()
+    buf = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buf)
+    with open(filename, 'rb', buffering=0) as f:
+        while size := f.readinto(buf):
+            hasher.update(view[:size])
+    return hasher.hexdigest()
+
+
+def verify_binary_hashes(hashes_to_verify: list[list[str]], jobs: t.Optional[int] = None) -> tuple[ReturnCode, dict[str, str]]:
     offending_files = []
     files_to_hashes = {}
 
-    for hash_expected, binary_filename in hashes_to_verify:
-        with open(binary_filename, 'rb') as binary_file:
-            hash_calculated = sha256(binary_file.read()).hexdigest()
-        if hash_calculated != hash_expected:
-            offending_files.append(binary_filename)
-        else:
-            files_to_hashes[binary_filename] = hash_calculated
+    # hashlib releases the GIL while hashing, so files are hashed in parallel threads.
+    start = time.time()
+    total_bytes = 0
+    filenames = [binary_filename for _, binary_filename in hashes_to_verify]
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        hashes_calculated = pool.map(sha256_file, filenames)
+        for i, ((hash_expected, binary_filename), hash_calculated) in enumerate(zip(hashes_to_verify, hashes_calculated)):
+            total_bytes += os.path.getsize(binary_filename)
+            log.info(f"hashed {binary_filename} ({i + 1}/{len(hashes_to_verify)})")
+            if hash_calculated != hash_expected:
+                offending_files.append(binary_filename)
+            else:
+                files_to_hashes[binary_filename] = hash_calculated
+    elapsed = time.time() - start
+    log.info(
+        f"hashed {len(hashes_to_verify)} files ({total_bytes / 1e6:.1f} MB) in {elapsed:.1f}s "
+        f"({total_bytes / 1e6 / max(elapsed, 1e-6):.1f} MB/s)")
 
     if offending_files:
         joined_files = '\n'.join(offending_files)
@@ -524,20 +552,29 @@ def verify_published_handler(args: argparse.Namespace) -> ReturnCode:
                 f"since {HOST1} does not host *{fragment} binaries")
             hashes_to_verify = [i for i in hashes_to_verify if fragment not in i[1]]
 
-    # download binaries
-    for _, binary_filename in hashes_to_verify:
+    # download binaries, a few at a time
+    def download_binary(binary_filename):
         log.info(f"downloading {binary_filename} to {WORKINGDIR}")
-        success, output = download_with_wget(
-            HOST1 + remote_dir + binary_filename, binary_filename)
+        return download_with_wget(HOST1 + remote_dir + binary_filename, binary_filename)
 
-        if not success:
-            log.error(
-                f"failed to download {binary_filename}\n"
-                f"wget output:\n{indent(output)}")
-            return ReturnCode.BINARY_DOWNLOAD_FAILED
+    binary_filenames = [binary_filename for _, binary_filename in hashes_to_verify]
+    pool = ThreadPoolExecutor(max_workers=MAX_PARALLEL_DOWNLOADS)
+    try:
+        downloads = {pool.submit(download_binary, binary_filename): binary_filename for binary_filename in binary_filenames}
+        for download in as_completed(downloads):
+            binary_filename = downloads[download]
+            success, output = download.result()
+            if not success:
+                log.error(
+                    f"failed to download {binary_filename}\n"
+                    f"wget output:\n{indent(output)}")
+                return ReturnCode.BINARY_DOWNLOAD_FAILED
+    finally:
+        # Stop at the first failure: drop the queued downloads instead of waiting for them.
+        pool.shutdown(wait=False, cancel_futures=True)
 
     # verify hashes
-    hashes_status, files_to_hashes = verify_binary_hashes(hashes_to_verify)
+    hashes_status, files_to_hashes = verify_binary_hashes(hashes_to_verify, args.jobs)
     if hashes_status != ReturnCode.SUCCESS:
         return hashes_status
 
@@ -607,7 +644,7 @@ def verify_binaries_handler(args: argparse.Namespace) -> ReturnCode:
                 missing_files.append(file)
 
     # verify hashes
-    hashes_status, files_to_hashes = verify_binary_hashes(files_to_hash)
+    hashes_status, files_to_hashes = verify_binary_hashes(files_to_hash, args.jobs)
     if hashes_status != ReturnCode.SUCCESS:
         return hashes_status
 
@@ -661,6 +698,11 @@ def main():
         default=os.environ.get('BINVERIFY_TRUSTED_KEYS', ''),
         help='A list of trusted signer GPG keys, separated by commas. Not "trusted keys" in the GPG sense.',
     )
+    parser.add_argument(
+        '--jobs', type=int, action='store',
+        default=int(os.environ.get('BINVERIFY_JOBS', os.cpu_count() or 1)),
+        help='The number of files to hash in parallel.',
+    )
     parser.add_argument(
         '--json', action='store_true',
         default=bool_from_env('BINVERIFY_JSON'),
@@ -699,6 +741,8 @@ def main():
     )
 
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
     if args.quiet:
         log.setLevel(logging.WARNING)
 
@@ -288,8 +288,7 @@ class EstimateFeeTest(BitcoinTestFramework):
                 tx = make_tx(self.wallet, u, high_feerate)
                 node.sendrawtransaction(tx["hex"])
                 txs.append(tx)
-            dec_txs = [res["result"] for res in node.batch([node.decoderawtransaction.get_request(tx["hex"]) for tx in txs])]
-            self.wallet.scan_txs(dec_txs)
+            self.wallet.scan_txs([tx["tx"] for tx in txs])
 
 
         # Mine the last replacement txs
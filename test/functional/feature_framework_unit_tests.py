@@ -16,19 +16,25 @@ from test_framework.test_framework import TEST_EXIT_PASSED, TEST_EXIT_FAILED
 # the output of `git grep unittest.TestCase ./test/functional/test_framework`
 TEST_FRAMEWORK_MODULES = [
     "address",
+    "authproxy",
+    "bdb",
+    "crypto.backend",
     "crypto.bip324_cipher",
     "blocktools",
     "crypto.chacha20",
+    "debuglog",
     "crypto.ellswift",
     "key",
     "messages",
     "crypto.muhash",
+    "p2p",
     "crypto.poly1305",
     "crypto.ripemd160",
     "crypto.secp256k1",
     "script",
     "script_util",
     "segwit_addr",
+    "wallet",
     "wallet_util",
 ]
 
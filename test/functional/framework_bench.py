@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# Copyright (c) 2024 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Micro-benchmarks for the test framework.
+
+These exercise hot paths of the Python test framework itself (no bitcoind is
+needed) and print how long each took. Run all benchmarks, or only the ones
+given on the command line:
+
+    framework_bench.py [--count N] [benchmark ...]
+"""
+
+import argparse
+import time
+
+from test_framework.blocktools import (
+    add_witness_commitment,
+    create_block,
+    create_coinbase,
+)
+from test_framework.messages import (
+    ByteReader,
+    CBlock,
+    COutPoint,
+    CInv,
+    CTransaction,
+    CTxIn,
+    CTxInWitness,
+    CTxOut,
+    MAX_INV_SIZE,
+    MSG_TX,
+    from_binary,
+    msg_inv,
+    msg_ping,
+)
+from test_framework.p2p import P2PConnection
+
+
+class _CountingConnection(P2PConnection):
+    """P2PConnection which counts received messages without handling them."""
+    def __init__(self):
+        super().__init__()
+        self.peer_connect_helper("0", 0, "regtest", 1)
+        self.received = 0
+
+    def on_message(self, message):
+        self.received += 1
+
+    def _log_message(self, direction, msg):
+        pass
+
+
+def bench_p2p_parser(count):
+    """Push count small messages through the v1 P2P receive path, in 1 MiB chunks as a socket under load would deliver them."""
+    conn = _CountingConnection()
+    messages = [conn.build_message(msg_ping(i)) for i in range(100)]
+    messages.append(conn.build_message(msg_inv([CInv(MSG_TX, i) for i in range(50)])))
+    data = b"".join(messages[i % len(messages)] for i in range(count))
+    start = time.perf_counter()
+    for pos in range(0, len(data), 1 << 20):
+        conn.data_received(data[pos:pos + (1 << 20)])
+    elapsed = time.perf_counter() - start
+    assert conn.received == count
+    return elapsed, f"{count} messages ({len(data)} bytes)"
+
+
+def bench_block_construction(count):
+    """Build a block of count segwit transactions, then repeatedly mutate one of them and rebuild the block, as feature_block.py does."""
+    start = time.perf_counter()
+    block = create_block(1, create_coinbase(1))
+    for i in range(count):
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(i, n)) for n in range(2)]
+        tx.vout = [CTxOut(1000, b"\x51" * 34) for _ in range(2)]
+        tx.wit.vtxinwit = [CTxInWitness() for _ in range(2)]
+        for inwit in tx.wit.vtxinwit:
+            inwit.scriptWitness.stack = [b"\x01" * 72, b"\x02" * 33]
+        tx.rehash()
+        block.vtx.append(tx)
+    for i in range(100):
+        tx = block.vtx[1 + i % count]
+        tx.vout[0].nValue += 1
+        tx.rehash()
+        add_witness_commitment(block)
+        block.solve()
+        block.serialize()
+        assert block.get_weight() > 0
+    elapsed = time.perf_counter() - start
+    return elapsed, f"{count} transactions, 100 rebuilds"
+
+
+def bench_deserialize(count):
+    """Deserialize a block of count segwit transactions and a maximum size inv message."""
+    block = CBlock()
+    for i in range(count):
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(i, n), b"\x00" * 20) for n in range(2)]
+        tx.vout = [CTxOut(1000, b"\x51" * 34) for _ in range(2)]
+        tx.wit.vtxinwit = [CTxInWitness() for _ in range(2)]
+        for inwit in tx.wit.vtxinwit:
+            inwit.scriptWitness.stack = [b"\x01" * 72, b"\x02" * 33]
+        block.vtx.append(tx)
+    block_data = block.serialize()
+    inv_data = msg_inv([CInv(MSG_TX, i) for i in range(MAX_INV_SIZE)]).serialize()
+    start = time.perf_counter()
+    from_binary(CBlock, block_data)
+    msg_inv().deserialize(ByteReader(inv_data))
+    elapsed = time.perf_counter() - start
+    return elapsed, f"{count} transactions ({len(block_data)} bytes) and {MAX_INV_SIZE} inv entries"
+
+
+BENCHMARKS = {
+    "p2p_parser": (bench_p2p_parser, 100000),
+    "block_construction": (bench_block_construction, 2000),
+    "deserialize": (bench_deserialize, 5000),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--count", type=int, help="override the default problem size of the benchmarks")
+    parser.add_argument("benchmarks", nargs="*", help=f"benchmarks to run, out of {', '.join(BENCHMARKS)} (default: all)")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}")
+    for name in args.benchmarks or BENCHMARKS:
+        bench, default_count = BENCHMARKS[name]
+        elapsed, description = bench(args.count or default_count)
+        print(f"{name}: {elapsed:.3f}s for {description}")
+
+
+if __name__ == '__main__':
+    main()
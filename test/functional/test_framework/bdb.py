@@ -22,9 +22,16 @@ pages are not implemented but may be needed in the future if dealing with wallet
 transactions.
 
 `db_dump -da wallet.dat` is useful to see the data in a wallet.dat BDB file
+
+The file is memory mapped and its leaf pages are parsed lazily as the key-value pairs are
+iterated over (see iter_bdb_kv), so no copy of the whole database is made.
 """
 
+import mmap
+import os
 import struct
+import tempfile
+import unittest
 
 # Important constants
 PAGESIZE = 4096
@@ -40,6 +47,9 @@ BTREE_META = 9
 BTREE_MAGIC = 0x053162
 DB_VERSION = 9
 
+PAGE_HEADER = struct.Struct('QIIIHHBB')
+ENTRY_HEADER = struct.Struct('HB')
+
 # Deserializes a leaf page into a dict.
 # Btree internal pages have the same header, for those, return None.
 # For the btree leaf pages, deserialize them and put all the data into a dict
@@ -127,25 +137,91 @@ def extract_kv_pairs(page_data):
             out[last_key] = entry['data']
     return out
 
-# Extract the key-value pairs of the BDB file given in filename
-def dump_bdb_kv(filename):
-    # Read in the BDB file and start deserializing it
-    pages = []
-    with open(filename, 'rb') as f:
-        data = f.read(PAGESIZE)
-        while len(data) > 0:
-            pages.append(data)
-            data = f.read(PAGESIZE)
-
-    # Sanity check the meta pages
-    dump_meta_page(pages[OUTER_META_PAGE])
-    dump_meta_page(pages[INNER_META_PAGE])
-
-    # Fetch the kv pairs from the leaf pages
-    kv = {}
-    for i in range(3, len(pages)):
-        info = dump_leaf_page(pages[i])
-        if info is not None:
-            info_kv = extract_kv_pairs(info)
-            kv = {**kv, **info_kv}
-    return kv
+# Yield the key-value pairs of the leaf page starting at pos in data, skipping keys not starting
+# with prefix. Like dump_leaf_page, but only the entries that are needed are read, and values
+# are only copied for matching keys.
+def iter_leaf_kv(data, pos=0, prefix=b''):
+    _, _, _, _, entries, _, _, pg_type = PAGE_HEADER.unpack_from(data, pos)
+    if pg_type == BTREE_INTERNAL:
+        return
+    assert pg_type == BTREE_LEAF, 'A non-btree leaf page has been encountered while dumping leaves'
+
+    offsets = struct.unpack_from('{}H'.format(entries), data, pos + PAGE_HEADER.size)
+    for i in range(0, entries, 2):
+        # By virtue of these all being pairs, even number entries are keys, and odd are values
+        start = pos + offsets[i] + ENTRY_HEADER.size
+        e_len, _ = ENTRY_HEADER.unpack_from(data, pos + offsets[i])
+        if data[start:start + len(prefix)] != prefix:
+            continue
+        key = data[start:start + e_len]
+        value = b''
+        if i + 1 < entries:
+            start = pos + offsets[i + 1] + ENTRY_HEADER.size
+            e_len, _ = ENTRY_HEADER.unpack_from(data, pos + offsets[i + 1])
+            value = data[start:start + e_len]
+        yield key, value
+
+# Yield the key-value pairs of the BDB file given in filename, optionally only those whose key
+# starts with prefix. Pairs are yielded in file order, so a key can be repeated if it appears
+# in multiple pages; the last one wins, as in dump_bdb_kv.
+def iter_bdb_kv(filename, prefix=b''):
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        # Sanity check the meta pages
+        dump_meta_page(data[OUTER_META_PAGE * PAGESIZE:(OUTER_META_PAGE + 1) * PAGESIZE])
+        dump_meta_page(data[INNER_META_PAGE * PAGESIZE:(INNER_META_PAGE + 1) * PAGESIZE])
+
+        # Fetch the kv pairs from the leaf pages
+        for pos in range(3 * PAGESIZE, len(data), PAGESIZE):
+            yield from iter_leaf_kv(data, pos, prefix)
+
+# Extract the key-value pairs of the BDB file given in filename, optionally only those whose key
+# starts with prefix
+def dump_bdb_kv(filename, prefix=b''):
+    return dict(iter_bdb_kv(filename, prefix))
+
+
+class TestFrameworkBdb(unittest.TestCase):
+    def make_meta_page(self, pgno):
+        page = bytearray(PAGESIZE)
+        struct.pack_into('QIIIIBBBBIIIIII20s', page, 0, 0, pgno, BTREE_MAGIC, DB_VERSION, PAGESIZE, 0, BTREE_META, 0, 0, 0, 0, 0, 0, 0, 0, b'')
+        return bytes(page)
+
+    def make_btree_page(self, pgno, pg_type, entries):
+        page = bytearray(PAGESIZE)
+        offsets = []
+        end = PAGESIZE
+        for data in entries:
+            end -= ENTRY_HEADER.size + len(data)
+            ENTRY_HEADER.pack_into(page, end, len(data), 1)
+            page[end + ENTRY_HEADER.size:end + ENTRY_HEADER.size + len(data)] = data
+            offsets.append(end)
+        PAGE_HEADER.pack_into(page, 0, 0, pgno, 0, 0, len(entries), end, 1, pg_type)
+        struct.pack_into('{}H'.format(len(offsets)), page, PAGE_HEADER.size, *offsets)
+        return bytes(page)
+
+    def test_dump_bdb_kv(self):
+        pages = [
+            self.make_meta_page(0),
+            self.make_btree_page(1, BTREE_INTERNAL, []),
+            self.make_meta_page(2),
+            self.make_btree_page(3, BTREE_LEAF, [b'\x07hdchain', b'chain', b'\x03key\x01', b'value1', b'\x03key\x02', b'value2']),
+            self.make_btree_page(4, BTREE_INTERNAL, [b'\x03key\x01']),
+            self.make_btree_page(5, BTREE_LEAF, [b'\x03key\x02', b'newvalue', b'\x0adefaultkey', b'', b'\x03key\x03']),
+        ]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'wallet.dat')
+            with open(filename, 'wb') as f:
+                f.write(b''.join(pages))
+
+            # Compare against deserializing the whole pages
+            expected = {}
+            for page in pages[3:]:
+                info = dump_leaf_page(page)
+                if info is not None:
+                    expected.update(extract_kv_pairs(info))
+            self.assertEqual(dump_bdb_kv(filename), expected)
+            self.assertEqual(expected[b'\x03key\x02'], b'newvalue')
+            self.assertEqual(expected[b'\x03key\x03'], b'')
+
+            self.assertEqual(dump_bdb_kv(filename, prefix=b'\x03key'), {k: v for k, v in expected.items() if k.startswith(b'\x03key')})
+            self.assertEqual(list(iter_bdb_kv(filename, prefix=b'\x03key\x02')), [(b'\x03key\x02', b'value2'), (b'\x03key\x02', b'newvalue')])
@@ -10,7 +10,7 @@ testing.
 
 import os
 
-from .authproxy import AuthServiceProxy
+from .authproxy import AuthServiceProxy, RPCBatch
 from typing import Optional
 
 REFERENCE_FILENAME = 'rpc_interface.txt'
@@ -33,13 +33,19 @@ class AuthServiceProxyWrapper():
         self.auth_service_proxy_instance = auth_service_proxy_instance
         self.rpc_url = rpc_url
         self.coverage_logfile = coverage_logfile
+        self._wrappers: dict[str, "AuthServiceProxyWrapper"] = {}
 
     def __getattr__(self, name):
         return_val = getattr(self.auth_service_proxy_instance, name)
         if not isinstance(return_val, type(self.auth_service_proxy_instance)):
             # If proxy getattr returned an unwrapped value, do the same here.
             return return_val
-        return AuthServiceProxyWrapper(return_val, self.rpc_url, self.coverage_logfile)
+        # The proxy caches its method proxies, so cache the wrappers for them as well
+        wrapper = self._wrappers.get(name)
+        if wrapper is None or wrapper.auth_service_proxy_instance is not return_val:
+            wrapper = AuthServiceProxyWrapper(return_val, self.rpc_url, self.coverage_logfile)
+            self._wrappers[name] = wrapper
+        return wrapper
 
     def __call__(self, *args, **kwargs):
         """
@@ -67,6 +73,12 @@ class AuthServiceProxyWrapper():
         self._log_call()
         return self.auth_service_proxy_instance.get_request(*args, **kwargs)
 
+    def batch(self, rpc_call_list=None):
+        if rpc_call_list is None:
+            # Queue the calls through this wrapper, so they are recorded
+            return RPCBatch(self)
+        return self.auth_service_proxy_instance.batch(rpc_call_list)
+
 def get_filename(dirname, n_node):
     """
     Get a filename unique to the test process ID and node.
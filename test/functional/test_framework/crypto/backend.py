@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# Copyright (c) 2024 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Backend selection for the test-only crypto primitives
+
+The modules in this package contain reference implementations written in pure Python, which
+are slow. For some primitives a faster implementation may be available on the machine:
+
+* ripemd160: hashlib, if the OpenSSL it was built against still provides RIPEMD160.
+* chacha20: the ChaCha20 cipher of the `cryptography` package, if it is installed.
+* poly1305: the Poly1305 authenticator of the `cryptography` package, if it is installed.
+
+Every primitive module registers its reference implementation here at import time, together
+with its test inputs. A native implementation found for it is only used after it produced the
+same results as the reference implementation on all of those inputs. Primitives without a
+native candidate (such as siphash) always use the reference implementation.
+
+The "auto" backend (the default) uses native implementations where available, while the
+"python" backend forces the reference implementations for all primitives, which is useful
+for debugging.
+"""
+
+import logging
+import unittest
+
+BACKEND_AUTO = "auto"
+BACKEND_PYTHON = "python"
+BACKENDS = (BACKEND_AUTO, BACKEND_PYTHON)
+
+logger = logging.getLogger("TestFramework.crypto")
+
+# Name of the currently selected backend.
+_backend = BACKEND_AUTO
+# Reference implementation for each registered primitive.
+_reference = {}
+# Native implementation for each registered primitive, if any passed the self-test.
+_native = {}
+
+
+def _ripemd160_hashlib(data):
+    import hashlib
+    return hashlib.new('ripemd160', data).digest()
+
+
+def _chacha20_block_cryptography(key, nonce, cnt):
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms  # type: ignore[import-not-found]
+    # The cryptography package takes a 16-byte nonce: a 32-bit little-endian block counter
+    # followed by the 12-byte nonce.
+    cipher = Cipher(algorithms.ChaCha20(bytes(key), cnt.to_bytes(4, 'little') + bytes(nonce)), mode=None)
+    return cipher.encryptor().update(bytes(64))
+
+
+def _poly1305_cryptography(key, data):
+    from cryptography.hazmat.primitives import poly1305  # type: ignore[import-not-found]
+    return poly1305.Poly1305.generate_tag(bytes(key), bytes(data))
+
+
+def _detect_native():
+    """Return a dict with the native implementations that can be used on this machine."""
+    native = {}
+    try:
+        import hashlib
+        hashlib.new('ripemd160')
+        native["ripemd160"] = _ripemd160_hashlib
+    except ValueError:
+        pass
+    try:
+        import cryptography.hazmat.primitives.ciphers  # type: ignore[import-not-found]  # noqa: F401
+        import cryptography.hazmat.primitives.poly1305  # type: ignore[import-not-found]  # noqa: F401
+        native["chacha20"] = _chacha20_block_cryptography
+        native["poly1305"] = _poly1305_cryptography
+    except ImportError:
+        pass
+    return native
+
+
+_NATIVE_CANDIDATES = _detect_native()
+
+
+def register(name, reference, self_test_inputs):
+    """Register the reference implementation of a primitive.
+
+    self_test_inputs is a list of argument tuples. If a native implementation is available for
+    name, it is called on each of them and only enabled if all results match the reference
+    implementation. Exceptions raised by the native implementation also disable it."""
+    _reference[name] = reference
+    native = _NATIVE_CANDIDATES.get(name)
+    if native is None:
+        return
+    try:
+        matches = all(native(*args) == reference(*args) for args in self_test_inputs)
+    except Exception as e:
+        logger.warning(f"Native {name} implementation failed self-test, using reference implementation: {e!r}")
+        return
+    if not matches:
+        logger.warning(f"Native {name} implementation does not match reference implementation, not using it")
+        return
+    _native[name] = native
+
+
+def get(name):
+    """Return the implementation of a primitive for the selected backend."""
+    if _backend == BACKEND_AUTO:
+        native = _native.get(name)
+        if native is not None:
+            return native
+    return _reference[name]
+
+
+def set_backend(backend):
+    """Select the backend used by all primitives."""
+    global _backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown crypto backend {backend!r}, must be one of {', '.join(BACKENDS)}")
+    _backend = backend
+
+
+def get_backend():
+    """Return the name of the selected backend."""
+    return _backend
+
+
+def active_implementations():
+    """Return a dict mapping each registered primitive to "native" or "python"."""
+    return {name: "native" if get(name) is not _reference[name] else "python" for name in sorted(_reference)}
+
+
+class TestFrameworkCryptoBackend(unittest.TestCase):
+    def test_backend_selection(self):
+        # Importing the primitive modules registers them.
+        from . import chacha20, poly1305, ripemd160, siphash  # noqa: F401
+        self.assertEqual(set(_reference), {"chacha20", "poly1305", "ripemd160", "siphash"})
+        self.assertEqual(get("siphash"), _reference["siphash"])
+        previous = get_backend()
+        try:
+            set_backend(BACKEND_PYTHON)
+            self.assertEqual(set(active_implementations().values()), {"python"})
+            for name in _reference:
+                self.assertIs(get(name), _reference[name])
+            set_backend(BACKEND_AUTO)
+            for name in _reference:
+                self.assertIs(get(name), _native.get(name, _reference[name]))
+            self.assertRaises(ValueError, set_backend, "invalid")
+        finally:
+            set_backend(previous)
+
+    def test_native_matches_reference(self):
+        """Every enabled native implementation agrees with the reference implementation."""
+        from . import chacha20, poly1305, ripemd160  # noqa: F401
+        inputs = {
+            "chacha20": [(bytes(range(32)), bytes(range(12)), cnt) for cnt in (0, 1, 2**32 - 1)],
+            "poly1305": [(bytes(range(32)), bytes(range(n))) for n in (0, 1, 15, 16, 17, 100)],
+            "ripemd160": [(bytes(range(n)),) for n in (0, 1, 55, 56, 64, 200)],
+        }
+        for name, native in _native.items():
+            for args in inputs[name]:
+                self.assertEqual(native(*args), _reference[name](*args))
@@ -9,9 +9,14 @@ It is designed for ease of understanding, not performance.
 
 WARNING: This code is slow and trivially vulnerable to side channel attacks. Do not use for
 anything but tests.
+
+chacha20_block() dispatches to a native implementation when available (see backend.py).
 """
 
 import unittest
+from typing import Any
+
+from . import backend
 
 CHACHA20_INDICES = (
     (0, 4, 8, 12), (1, 5, 9, 13), (2, 6, 10, 14), (3, 7, 11, 15),
@@ -43,7 +48,7 @@ def chacha20_doubleround(s):
         s[b] = rotl32(s[b] ^ s[c], 7)
 
 
-def chacha20_block(key, nonce, cnt):
+def chacha20_block_reference(key, nonce, cnt):
     """Compute the 64-byte output of the ChaCha20 block function.
     Takes as input a 32-byte key, 12-byte nonce, and 32-bit integer counter.
     """
@@ -63,6 +68,11 @@ def chacha20_block(key, nonce, cnt):
     # Produce byte output
     return b''.join(state[i].to_bytes(4, 'little') for i in range(16))
 
+
+def chacha20_block(key, nonce, cnt):
+    """Compute the 64-byte output of the ChaCha20 block function, using the selected crypto backend."""
+    return backend.get("chacha20")(key, nonce, cnt)
+
 class FSChaCha20:
     """Rekeying wrapper stream cipher around ChaCha20."""
     def __init__(self, initial_key, rekey_interval=REKEY_INTERVAL):
@@ -94,7 +104,7 @@ class FSChaCha20:
 
 # Test vectors from RFC7539/8439 consisting of 32 byte key, 12 byte nonce, block counter
 # and 64 byte output after applying `chacha20_block` function
-CHACHA20_TESTS = [
+CHACHA20_TESTS: list[list[Any]] = [
     ["000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f", [0x09000000, 0x4a000000], 1,
      "10f1e7e4d13b5915500fdd1fa32071c4c7d1f4c733c068030422aa9ac3d46c4e"
      "d2826446079faa0914c2d705d98b02a2b5129cd1de164eb9cbd083e8a2503c4e"],
@@ -137,6 +147,11 @@ FSCHACHA20_TESTS = [
      "8bfaa4eacff308fdb4a94a5ff25bd9d0c1f84b77f81239f67ff39d6e1ac280c9"],
 ]
 
+backend.register("chacha20", chacha20_block_reference, [
+    (bytes.fromhex(hex_key), nonce[0].to_bytes(4, 'little') + nonce[1].to_bytes(8, 'little'), counter)
+    for hex_key, nonce, counter, _ in CHACHA20_TESTS
+])
+
 
 class TestFrameworkChacha(unittest.TestCase):
     def test_chacha20(self):
@@ -147,6 +162,8 @@ class TestFrameworkChacha(unittest.TestCase):
             nonce_bytes = nonce[0].to_bytes(4, 'little') + nonce[1].to_bytes(8, 'little')
             keystream = chacha20_block(key, nonce_bytes, counter)
             self.assertEqual(hex_output, keystream.hex())
+            keystream = chacha20_block_reference(key, nonce_bytes, counter)
+            self.assertEqual(hex_output, keystream.hex())
 
     def test_fschacha20(self):
         """FSChaCha20 test vectors."""
@@ -9,20 +9,29 @@ It is designed for ease of understanding, not performance.
 
 WARNING: This code is slow and trivially vulnerable to side channel attacks. Do not use for
 anything but tests.
+
+Poly1305.tag() dispatches to a native implementation when available (see backend.py).
 """
 
 import unittest
 
+from . import backend
+
 
 class Poly1305:
     """Class representing a running poly1305 computation."""
     MODULUS = 2**130 - 5
 
     def __init__(self, key):
+        self.key = key
         self.r = int.from_bytes(key[:16], 'little') & 0xffffffc0ffffffc0ffffffc0fffffff
         self.s = int.from_bytes(key[16:], 'little')
 
     def tag(self, data):
+        """Compute the poly1305 tag, using the selected crypto backend."""
+        return backend.get("poly1305")(self.key, data)
+
+    def tag_reference(self, data):
         """Compute the poly1305 tag."""
         acc, length = 0, len(data)
         for i in range((length + 15) // 16):
@@ -91,6 +100,10 @@ POLY1305_TESTS = [
      "13000000000000000000000000000000"],
 ]
 
+backend.register("poly1305", lambda key, data: Poly1305(key).tag_reference(data), [
+    (bytes.fromhex(hex_key), bytes.fromhex(hex_message)) for hex_message, hex_key, _ in POLY1305_TESTS
+])
+
 
 class TestFrameworkPoly1305(unittest.TestCase):
     def test_poly1305(self):
@@ -102,3 +115,5 @@ class TestFrameworkPoly1305(unittest.TestCase):
             tag = bytes.fromhex(hex_tag)
             comp_tag = Poly1305(key).tag(message)
             self.assertEqual(tag, comp_tag)
+            comp_tag = Poly1305(key).tag_reference(message)
+            self.assertEqual(tag, comp_tag)
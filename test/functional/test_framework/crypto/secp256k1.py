@@ -4,7 +4,9 @@
 
 """Test-only implementation of low-level secp256k1 field and group arithmetic
 
-It is designed for ease of understanding, not performance.
+It is designed for ease of understanding, not performance. Scalar multiplication uses
+Jacobian coordinates and windowed algorithms internally, as it dominates the runtime of
+signing and verification in the functional tests.
 
 WARNING: This code is slow and trivially vulnerable to side channel attacks. Do not use for
 anything but tests.
@@ -15,6 +17,7 @@ Exports:
 * G: the secp256k1 generator point
 """
 
+import random
 import unittest
 from hashlib import sha256
 
@@ -150,6 +153,114 @@ class FE:
         return f"FE(0x{int(self):x})"
 
 
+# Helpers for the scalar multiplication code in GE.mul and FastGEMul. They operate on plain
+# integers modulo FE.SIZE rather than on FE objects, and represent intermediate points in
+# Jacobian coordinates (X, Y, Z), corresponding to the affine point (X/Z^2, Y/Z^3). This
+# avoids a field inversion for every point addition; only a single one is needed at the end.
+# Points with Z == 0 represent infinity. Precomputed tables hold affine (x, y) tuples, so
+# that the cheaper mixed Jacobian+affine addition formula can be used.
+
+# Window size used for the wNAF representation of scalars in GE.mul.
+_WNAF_WINDOW = 5
+
+_JACOBIAN_INFINITY = (0, 1, 0)
+
+def _jacobian_double(a):
+    """Double a point in Jacobian coordinates."""
+    x1, y1, z1 = a
+    if z1 == 0 or y1 == 0:
+        return _JACOBIAN_INFINITY
+    p = FE.SIZE
+    yy = y1 * y1 % p
+    s = 4 * x1 * yy % p
+    m = 3 * x1 * x1 % p
+    x3 = (m * m - 2 * s) % p
+    y3 = (m * (s - x3) - 8 * yy * yy) % p
+    z3 = 2 * y1 * z1 % p
+    return (x3, y3, z3)
+
+def _jacobian_add_affine(a, b):
+    """Add a point in Jacobian coordinates and an affine (x, y) point (which is not infinity)."""
+    x1, y1, z1 = a
+    x2, y2 = b
+    if z1 == 0:
+        return (x2, y2, 1)
+    p = FE.SIZE
+    zz = z1 * z1 % p
+    h = (x2 * zz - x1) % p
+    r = (y2 * zz * z1 - y1) % p
+    if h == 0:
+        if r == 0:
+            # For identical inputs, use the doubling formula.
+            return _jacobian_double(a)
+        # A point added to its own negation is infinity.
+        return _JACOBIAN_INFINITY
+    hh = h * h % p
+    hhh = h * hh % p
+    v = x1 * hh % p
+    x3 = (r * r - hhh - 2 * v) % p
+    y3 = (r * (v - x3) - y1 * hhh) % p
+    z3 = z1 * h % p
+    return (x3, y3, z3)
+
+def _jacobian_to_affine_batch(points):
+    """Convert a list of non-infinite Jacobian points to affine (x, y) tuples.
+
+    Montgomery's trick is used to compute all the inverses of Z with a single field inversion."""
+    p = FE.SIZE
+    prefix = []
+    acc = 1
+    for _, _, z in points:
+        prefix.append(acc)
+        acc = acc * z % p
+    inv = pow(acc, -1, p)
+    result = [None] * len(points)
+    for i in range(len(points) - 1, -1, -1):
+        x, y, z = points[i]
+        zinv = inv * prefix[i] % p
+        inv = inv * z % p
+        zinv2 = zinv * zinv % p
+        result[i] = (x * zinv2 % p, y * zinv2 * zinv % p)
+    return result
+
+def _jacobian_to_ge(a):
+    """Convert a point in Jacobian coordinates to a group element."""
+    if a[2] == 0:
+        return GE()
+    (x, y), = _jacobian_to_affine_batch([a])
+    return GE(x, y)
+
+def _odd_multiples(ge, window):
+    """Compute the affine table [1*ge, 3*ge, 5*ge, ..., (2^(window-1) - 1)*ge]."""
+    x, y = int(ge.x), int(ge.y)
+    table = [(x, y, 1)]
+    (dx, dy), = _jacobian_to_affine_batch([_jacobian_double(table[0])])
+    for _ in range((1 << (window - 2)) - 1):
+        table.append(_jacobian_add_affine(table[-1], (dx, dy)))
+    return _jacobian_to_affine_batch(table)
+
+def _wnaf(a, window):
+    """Convert a non-negative integer to its width-window non-adjacent form.
+
+    The result is a list of digits, least significant first, each of which is either 0 or an
+    odd integer in the range [-(2^(window-1) - 1), 2^(window-1) - 1]. Any window consecutive
+    digits contain at most one nonzero digit."""
+    naf = []
+    half = 1 << (window - 1)
+    full = 1 << window
+    while a:
+        if a & 1:
+            d = a & (full - 1)
+            if d >= half:
+                d -= full
+            a -= d
+        else:
+            d = 0
+        naf.append(d)
+        a >>= 1
+    return naf
+
+
 class GE:
     """Objects of this class represent secp256k1 group elements (curve points or infinity)
 
@@ -211,20 +322,41 @@ class GE:
         """Compute a (batch) scalar group element multiplication.
 
         GE.mul((a1, p1), (a2, p2), (a3, p3)) is identical to a1*p1 + a2*p2 + a3*p3,
-        but more efficient."""
-        # Reduce all the scalars modulo order first (so we can deal with negatives etc).
-        naps = [(a % GE.ORDER, p) for a, p in aps]
+        but more efficient.
+
+        This uses Strauss' algorithm: every scalar is converted to wNAF form, and a single
+        chain of doublings in Jacobian coordinates is shared by all of them. The terms which
+        multiply G are instead added in at the end using the FAST_G table."""
+        # Reduce all the scalars modulo order first (so we can deal with negatives etc), and
+        # drop the terms which do not contribute.
+        g_scalar = 0
+        naps = []
+        for a, p in aps:
+            a %= GE.ORDER
+            if a == 0 or p.infinity:
+                continue
+            if p is G:
+                g_scalar += a
+            else:
+                naps.append((_wnaf(a, _WNAF_WINDOW), _odd_multiples(p, _WNAF_WINDOW)))
         # Start with point at infinity.
-        r = GE()
-        # Iterate over all bit positions, from high to low.
-        for i in range(255, -1, -1):
+        r = _JACOBIAN_INFINITY
+        # Iterate over all wNAF digit positions, from high to low.
+        for i in range(max((len(naf) for naf, _ in naps), default=0) - 1, -1, -1):
             # Double what we have so far.
-            r = r + r
-            # Add then add the points for which the corresponding scalar bit is set.
-            for (a, p) in naps:
-                if (a >> i) & 1:
-                    r += p
-        return r
+            r = _jacobian_double(r)
+            # Then add (or subtract) the precomputed odd multiple for every nonzero digit.
+            for naf, table in naps:
+                if i < len(naf) and naf[i]:
+                    d = naf[i]
+                    if d > 0:
+                        r = _jacobian_add_affine(r, table[d >> 1])
+                    else:
+                        x, y = table[-d >> 1]
+                        r = _jacobian_add_affine(r, (x, FE.SIZE - y))
+        if g_scalar:
+            r = FAST_G._mul_jacobian(g_scalar, r)
+        return _jacobian_to_ge(r)
 
     def __rmul__(self, a):
         """Multiply an integer with a group element."""
@@ -322,27 +454,44 @@ class FastGEMul:
     """Table for fast multiplication with a constant group element.
 
     Speed up scalar multiplication with a fixed point P by using a precomputed lookup table with
-    its powers of 2:
+    all multiples of P by (WINDOW-bit) digits, for each digit position of the scalar:
 
-        table = [P, 2*P, 4*P, (2^3)*P, (2^4)*P, ..., (2^255)*P]
+        table[i] = [1*(2^(WINDOW*i))*P, 2*(2^(WINDOW*i))*P, ..., (2^WINDOW - 1)*(2^(WINDOW*i))*P]
 
-    During multiplication, the points corresponding to each bit set in the scalar are added up,
-    i.e. on average ~128 point additions take place.
+    During multiplication, the scalar is split into WINDOW-bit digits, and the table entries
+    corresponding to each nonzero digit are added up, i.e. at most 256/WINDOW point additions
+    take place, and no doublings at all.
     """
 
+    # Number of scalar bits covered by each table lookup.
+    WINDOW = 8
+
     def __init__(self, p):
-        self.table = [p]  # table[i] = (2^i) * p
-        for _ in range(255):
-            p = p + p
-            self.table.append(p)
+        mask = (1 << self.WINDOW) - 1
+        self.table = []
+        base = (int(p.x), int(p.y))
+        for _ in range((256 + self.WINDOW - 1) // self.WINDOW):
+            # Compute [base, 2*base, ..., mask*base, (mask+1)*base], where the last entry is the
+            # base for the next digit position.
+            row = [(base[0], base[1], 1)]
+            for _ in range(mask):
+                row.append(_jacobian_add_affine(row[-1], base))
+            row = _jacobian_to_affine_batch(row)
+            base = row.pop()
+            self.table.append(row)
+
+    def _mul_jacobian(self, a, r=_JACOBIAN_INFINITY):
+        """Compute r + a*P, where r is a point in Jacobian coordinates, returned likewise."""
+        mask = (1 << self.WINDOW) - 1
+        a = a % GE.ORDER
+        for row in self.table:
+            if a & mask:
+                r = _jacobian_add_affine(r, row[(a & mask) - 1])
+            a >>= self.WINDOW
+        return r
 
     def mul(self, a):
-        result = GE()
-        a = a % GE.ORDER
-        for bit in range(a.bit_length()):
-            if a & (1 << bit):
-                result += self.table[bit]
-        return result
+        return _jacobian_to_ge(self._mul_jacobian(a))
 
 # Precomputed table with multiples of G for fast multiplication
 FAST_G = FastGEMul(G)
@@ -352,3 +501,38 @@ class TestFrameworkSecp256k1(unittest.TestCase):
         H = sha256(G.to_bytes_uncompressed()).digest()
         assert GE.lift_x(FE.from_bytes(H)) is not None
         self.assertEqual(H.hex(), "50929b74c1a04954b78b4b6035e97a5e078a5a0f28ec96d547bfee9ace803ac0")
+
+    def test_mul(self):
+        def mul_reference(*aps):
+            """Bit-by-bit double-and-add using affine GE additions only."""
+            r = GE()
+            for i in range(255, -1, -1):
+                r = r + r
+                for a, p in aps:
+                    if ((a % GE.ORDER) >> i) & 1:
+                        r = r + p
+            return r
+
+        def assert_ge_equal(a, b):
+            self.assertEqual(a.infinity, b.infinity)
+            if not a.infinity:
+                self.assertEqual(int(a.x), int(b.x))
+                self.assertEqual(int(a.y), int(b.y))
+
+        rng = random.Random(0)
+        P = G + G
+        Q = next(GE.lift_x(x) for x in range(1, 100) if GE.is_valid_x(x))
+        scalars = [0, 1, 2, 3, 15, 16, 17, 255, 256, GE.ORDER - 1, GE.ORDER, GE.ORDER + 1, -1, -5, 2**255]
+        scalars += [rng.randrange(GE.ORDER) for _ in range(5)]
+        for a in scalars:
+            assert_ge_equal(a * G, mul_reference((a, G)))
+            assert_ge_equal(a * P, mul_reference((a, P)))
+            assert_ge_equal(GE.mul((a, Q)), mul_reference((a, Q)))
+            assert_ge_equal(a * GE(), GE())
+        for _ in range(5):
+            a, b, c = (rng.choice(scalars) for _ in range(3))
+            assert_ge_equal(GE.mul((a, G), (b, P), (c, Q)), mul_reference((a, G), (b, P), (c, Q)))
+        # Terms cancelling out, and repeated points.
+        assert_ge_equal(GE.mul((5, P), (-5, P)), GE())
+        assert_ge_equal(GE.mul((3, G), (-1, P), (1, -Q), (1, Q)), G)
+        assert_ge_equal(GE.mul(), GE())
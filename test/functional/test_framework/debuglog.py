@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# Copyright (c) 2024 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Incremental reading of a node's debug.log
+
+A DebugLogFollower only reads the bytes appended to the debug.log of one node since it was last
+read. The path of the log can be given as a callable, which is resolved on every read, so a node
+whose datadir or chain changes is still followed correctly. The file is opened for each read only, so the node (or the test cleanup) is never prevented
+from removing or re-creating it. Callers mark the position they are interested in with mark(), and get
+everything logged after it from data() until they release() the mark again. Data before the
+oldest active mark is dropped.
+
+Waiting for the log to change does not poll: on Linux, an inotify watch on the directory of the
+log file wakes up the waiting thread as soon as the node writes to it. Elsewhere (or if inotify is
+not available) the file size is checked every millisecond.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import platform
+import selectors
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+# Upper bound of a single wait. An inotify event consumed by another thread waiting on the same
+# instance (or a watch that went stale because its directory was removed) can therefore only delay
+# a waiter by this much.
+MAX_WAIT_SLICE = 0.05
+# Interval to check the size of the log file at if inotify is not available.
+POLL_INTERVAL = 0.001
+
+IN_MODIFY = 0x00000002
+IN_CREATE = 0x00000100
+IN_MOVED_TO = 0x00000080
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+# struct inotify_event: int wd; uint32_t mask, cookie, len; char name[len]
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """Wakes up waiting threads when a file in one of the watched directories changes.
+
+    A single inotify instance is shared by all followers of a process, since the number of
+    instances per user is limited."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self._watches = {}  # directory -> watch descriptor
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._fd, selectors.EVENT_READ)
+
+    def watch(self, directory):
+        """Watch directory for written and created files. Return whether it is watched."""
+        with self._lock:
+            if directory in self._watches:
+                return True
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), IN_MODIFY | IN_CREATE | IN_MOVED_TO)
+            if wd < 0:
+                return False
+            self._watches[directory] = wd
+            return True
+
+    def wait(self, timeout):
+        """Wait until any watched directory changes or timeout seconds passed."""
+        if not self._selector.select(timeout):
+            return
+        try:
+            events = os.read(self._fd, 65536)
+        except BlockingIOError:
+            # Another thread consumed the events.
+            return
+        pos = 0
+        ignored = set()
+        while pos < len(events):
+            wd, mask, _, name_len = INOTIFY_EVENT.unpack_from(events, pos)
+            if mask & IN_IGNORED:
+                ignored.add(wd)
+            pos += INOTIFY_EVENT.size + name_len
+        if ignored:
+            # The directory was removed, it has to be watched again once it exists.
+            with self._lock:
+                self._watches = {d: wd for d, wd in self._watches.items() if wd not in ignored}
+
+
+_inotify = None
+_inotify_lock = threading.Lock()
+
+
+def get_inotify():
+    """Return the Inotify instance of this process, or None if inotify is not available."""
+    global _inotify
+    with _inotify_lock:
+        if _inotify is None:
+            _inotify = False
+            if platform.system() == "Linux":
+                try:
+                    _inotify = Inotify()
+                except (OSError, AttributeError):
+                    pass
+        return _inotify or None
+
+
+class DebugLogFollower:
+    """Follows a log file that is appended to, and possibly re-created, by a node.
+
+    path is either the path of the log file, or a callable returning it."""
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        # Path of the file currently followed.
+        self._followed = None
+        self._inode = None
+        # Offset in the file up to which it was read.
+        self._end = 0
+        # Data read from the file, starting at offset self._base.
+        self._base = 0
+        self._data = bytearray()
+        # Active marks, as offset -> number of holders.
+        self._marks = {}
+
+    @property
+    def path(self):
+        return self._path() if callable(self._path) else self._path
+
+    def _reset(self):
+        self._inode = None
+        self._end = 0
+        self._base = 0
+        self._data.clear()
+
+    def _update(self):
+        path = self.path
+        if path != self._followed:
+            # The node logs to another file now, follow it from its start.
+            self._reset()
+            self._followed = path
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self._reset()
+            return
+        if st.st_ino != self._inode or st.st_size < self._end:
+            # The file was re-created or truncated: follow the new file from its start.
+            self._reset()
+            self._inode = st.st_ino
+        if not self._marks:
+            # Nobody is interested in the data, so skip over it.
+            self._end = st.st_size
+            self._base = self._end
+            self._data.clear()
+            return
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_ino != self._inode:
+                    # Re-created since the stat above, picked up by the next update.
+                    return
+                f.seek(self._end)
+                new_data = f.read()
+        except FileNotFoundError:
+            return
+        self._data += new_data
+        self._end += len(new_data)
+
+    def update(self):
+        """Read the data appended to the log since the last update. Return the end offset."""
+        with self._lock:
+            self._update()
+            return self._end
+
+    def mark(self):
+        """Return the current end of the log, and keep the data logged after it until release()."""
+        with self._lock:
+            self._update()
+            self._marks[self._end] = self._marks.get(self._end, 0) + 1
+            return self._end
+
+    def release(self, offset):
+        """Release a mark returned by mark(), dropping data no mark needs any more."""
+        with self._lock:
+            self._marks[offset] -= 1
+            if not self._marks[offset]:
+                del self._marks[offset]
+            keep_from = min(self._marks, default=self._end)
+            if keep_from > self._base:
+                del self._data[:min(keep_from, self._end) - self._base]
+                self._base = min(keep_from, self._end)
+
+    def data(self, start, end=None):
+        """Return the log data between the offsets start and end (default: the end of the data read)."""
+        with self._lock:
+            if end is None:
+                end = self._end
+            return bytes(self._data[max(start - self._base, 0):max(end - self._base, 0)])
+
+    def wait(self, timeout):
+        """Wait until the log may have changed or timeout seconds passed."""
+        timeout = min(timeout, MAX_WAIT_SLICE)
+        inotify = get_inotify()
+        if inotify is not None and inotify.watch(os.path.dirname(self.path)):
+            inotify.wait(timeout)
+            return
+        end = self._end
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if os.stat(self.path).st_size != end:
+                    return
+            except FileNotFoundError:
+                pass
+            time.sleep(POLL_INTERVAL)
+
+    def wait_for(self, start, expected, unexpected, timeout):
+        """Wait until all byte strings in expected were logged after offset start.
+
+        Only the data appended since the last check is searched. Return None on success, or the
+        byte string of unexpected found in the log. Raise TimeoutError if not all expected
+        messages were found within timeout seconds."""
+        remaining = list(expected)
+        # Messages can be split between reads, so re-check the last bytes of the previous read.
+        overlap = max((len(m) for m in remaining + list(unexpected)), default=1) - 1
+        checked = start
+        time_end = time.monotonic() + timeout
+        while True:
+            end = self.update()
+            if end > checked:
+                new_data = self.data(max(start, checked - overlap), end)
+                for msg in unexpected:
+                    if msg in new_data:
+                        return msg
+                remaining = [msg for msg in remaining if msg not in new_data]
+                checked = end
+            if not remaining:
+                return None
+            time_left = time_end - time.monotonic()
+            if time_left <= 0:
+                raise TimeoutError
+            self.wait(time_left)
+
+
+class TestFrameworkDebugLog(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "debug.log")
+        with open(self.path, "wb") as f:
+            f.write(b"old line\n")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def append(self, data):
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    def test_incremental_read(self):
+        follower = DebugLogFollower(self.path)
+        start = follower.mark()
+        self.assertEqual(start, 9)
+        self.append(b"first\n")
+        follower.update()
+        inner = follower.mark()
+        self.append(b"second\n")
+        follower.update()
+        self.assertEqual(follower.data(start), b"first\nsecond\n")
+        self.assertEqual(follower.data(inner), b"second\n")
+        follower.release(start)
+        self.assertEqual(follower.data(inner), b"second\n")
+        follower.release(inner)
+        self.assertEqual(follower._data, b"")
+        # Without marks, appended data is not read.
+        self.append(b"unread\n")
+        self.assertEqual(follower.update(), 29)
+        self.assertEqual(follower._data, b"")
+
+    def test_changed_path(self):
+        path = self.path
+        follower = DebugLogFollower(lambda: path)
+        start = follower.mark()
+        self.append(b"first\n")
+        self.assertIsNone(follower.wait_for(start, [b"first"], [], 0))
+        follower.release(start)
+        path = os.path.join(self.dir.name, "other.log")
+        with open(path, "wb") as f:
+            f.write(b"other log\n")
+        start = follower.mark()
+        self.assertEqual(start, 10)
+        with open(path, "ab") as f:
+            f.write(b"second\n")
+        self.assertIsNone(follower.wait_for(start, [b"second"], [], 0))
+        self.assertEqual(follower.data(start), b"second\n")
+        follower.release(start)
+
+    def test_file_not_kept_open(self):
+        if not os.path.isdir("/proc/self/fd"):
+            self.skipTest("/proc/self/fd not available")
+        follower = DebugLogFollower(self.path)
+        start = follower.mark()
+        self.append(b"line\n")
+        follower.update()
+        open_files = [os.path.realpath(os.path.join("/proc/self/fd", fd)) for fd in os.listdir("/proc/self/fd")]
+        self.assertNotIn(os.path.realpath(self.path), open_files)
+        follower.release(start)
+
+    def test_recreated_file(self):
+        follower = DebugLogFollower(self.path)
+        start = follower.mark()
+        os.remove(self.path)
+        new_log = b"a new log which is longer\n"
+        self.append(new_log)
+        follower.update()
+        self.assertEqual(follower.data(start), new_log[start:])
+        follower.release(start)
+
+    def test_wait_for(self):
+        follower = DebugLogFollower(self.path)
+        start = follower.mark()
+        self.assertIsNone(follower.wait_for(start, [], [], 0))
+        self.assertRaises(TimeoutError, follower.wait_for, start, [b"old"], [], 0)
+
+        def write_later():
+            time.sleep(0.1)
+            self.append(b"split mes")
+            time.sleep(0.1)
+            self.append(b"sage\nbad\n")
+        writer = threading.Thread(target=write_later)
+        writer.start()
+        begin = time.monotonic()
+        self.assertIsNone(follower.wait_for(start, [b"split message"], [], 10))
+        self.assertLess(time.monotonic() - begin, 5)
+        writer.join()
+        self.assertEqual(follower.wait_for(start, [b"never"], [b"bad"], 10), b"bad")
+        follower.release(start)
+
+    def test_inotify(self):
+        inotify = get_inotify()
+        if inotify is None:
+            self.skipTest("inotify not available")
+        self.assertTrue(inotify.watch(self.dir.name))
+        self.assertFalse(inotify.watch(os.path.join(self.dir.name, "missing")))
+        timer = threading.Timer(0.1, self.append, [b"x"])
+        timer.start()
+        begin = time.monotonic()
+        inotify.wait(10)
+        self.assertLess(time.monotonic() - begin, 5)
+        timer.join()
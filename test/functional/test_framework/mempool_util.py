@@ -11,7 +11,6 @@ from .blocktools import (
 from .util import (
     assert_equal,
     assert_greater_than,
-    create_lots_of_big_transactions,
     gen_return_txouts,
 )
 from .wallet import (
@@ -63,12 +62,16 @@ def fill_mempool(test_framework, node):
     base_fee = relayfee * 130
 
     test_framework.log.debug("Fill up the mempool with txs with higher fee rate")
+    txs = []
+    for batch_of_txid in range(num_of_batches):
+        fee = (batch_of_txid + 1) * base_fee
+        txs += ephemeral_miniwallet.create_self_transfers(utxos_to_spend=confirmed_utxos[:tx_batch_size], fee=fee, txouts=txouts)
+        del confirmed_utxos[:tx_batch_size]
+    # All txs are built the same way, so let the node check the fee of one of them
+    res = node.testmempoolaccept([txs[0]["hex"]])[0]
+    assert_equal(res["fees"]["base"], base_fee)
     with node.assert_debug_log(["rolling minimum fee bumped"]):
-        for batch_of_txid in range(num_of_batches):
-            fee = (batch_of_txid + 1) * base_fee
-            utxos = confirmed_utxos[:tx_batch_size]
-            create_lots_of_big_transactions(ephemeral_miniwallet, node, fee, tx_batch_size, txouts, utxos)
-            del confirmed_utxos[:tx_batch_size]
+        ephemeral_miniwallet.send_txs(from_node=node, txs=txs)
 
     test_framework.log.debug("The tx should be evicted by now")
     # The number of transactions created should be greater than the ones present in the mempool
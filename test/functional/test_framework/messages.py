@@ -15,6 +15,9 @@ msg_block, msg_tx, msg_headers, etc.:
 
 ser_*, deser_*: functions that handle serialization/deserialization.
 
+ByteReader: a stream over a bytes-like object which can be passed to every
+    deserialize() method instead of BytesIO, and decodes fields in place.
+
 Classes use __slots__ to ensure extraneous attributes aren't accidentally added
 by tests, compromising their intended effect.
 """
@@ -25,6 +28,7 @@ from io import BytesIO
 import math
 import random
 import socket
+import struct
 import time
 import unittest
 
@@ -107,7 +111,92 @@ def ser_compact_size(l):
     return r
 
 
+_UINT16 = struct.Struct("<H")
+_UINT32 = struct.Struct("<I")
+_UINT64 = struct.Struct("<Q")
+_INT64 = struct.Struct("<q")
+_INV = struct.Struct("<I32s")
+_OUTPOINT = struct.Struct("<32sI")
+_BLOCK_HEADER = struct.Struct("<i32s32sIII")
+
+
+class ByteReader:
+    """A read-only stream over a bytes-like object (bytes, bytearray or memoryview)
+
+    It implements read() with the same semantics as BytesIO, so it can be passed to every
+    deserialize() method. The deser_* helpers detect it and decode fields directly from the
+    underlying buffer, with struct.unpack_from at the current offset, instead of allocating
+    an intermediate bytes object for every field. Truncated data is zero-filled, exactly like
+    reading past the end of a BytesIO, so both give the same result for any input. The data is
+    not copied, so it must not be modified while it is being read; everything returned by read()
+    is a bytes copy."""
+    __slots__ = ("_view", "_pos", "_size")
+
+    def __init__(self, data):
+        view = memoryview(data)
+        self._view = view if view.format == "B" else view.cast("B")
+        self._pos = 0
+        self._size = len(self._view)
+
+    def read(self, n=-1):
+        start = self._pos
+        if n is None or n < 0:
+            self._pos = self._size
+        else:
+            self._pos = min(start + n, self._size)
+        return bytes(self._view[start:self._pos])
+
+    def tell(self):
+        return self._pos
+
+    def has(self, n):
+        """Return whether at least n bytes are left."""
+        return self._pos + n <= self._size
+
+    def unpack(self, s):
+        """Unpack struct s at the current offset and advance past it. Check has(s.size) first."""
+        pos = self._pos
+        if pos + s.size > self._size:
+            raise struct.error(f"unpack requires {s.size} bytes, but only {self._size - pos} are left")
+        self._pos = pos + s.size
+        return s.unpack_from(self._view, pos)
+
+    def read_uint256(self):
+        pos = self._pos
+        self._pos = min(pos + 32, self._size)
+        return int.from_bytes(self._view[pos:pos + 32], "little")
+
+    def read_compact_size(self):
+        try:
+            nit, self._pos = _compact_size_at(self._view, self._pos)
+        except (IndexError, struct.error):
+            # Truncated: zero-filled like reading past the end of a BytesIO
+            nit = int.from_bytes(self.read(1), "little")
+            if nit >= 253:
+                nit = int.from_bytes(self.read(1 << (nit - 252)), "little")
+        return nit
+
+    def read_string(self):
+        """Read a compact size prefixed byte string."""
+        nit = self.read_compact_size()
+        return self.read(nit)
+
+
+def _compact_size_at(view, pos):
+    """Decode the compact size at offset pos of view. Returns it and the offset after it."""
+    nit = view[pos]
+    if nit < 253:
+        return nit, pos + 1
+    if nit == 253:
+        return _UINT16.unpack_from(view, pos + 1)[0], pos + 3
+    if nit == 254:
+        return _UINT32.unpack_from(view, pos + 1)[0], pos + 5
+    return _UINT64.unpack_from(view, pos + 1)[0], pos + 9
+
+
 def deser_compact_size(f):
+    if type(f) is ByteReader:
+        return f.read_compact_size()
     nit = int.from_bytes(f.read(1), "little")
     if nit == 253:
         nit = int.from_bytes(f.read(2), "little")
@@ -119,6 +208,8 @@ def deser_compact_size(f):
 
 
 def deser_string(f):
+    if type(f) is ByteReader:
+        return f.read_string()
     nit = deser_compact_size(f)
     return f.read(nit)
 
@@ -128,6 +219,8 @@ def ser_string(s):
 
 
 def deser_uint256(f):
+    if type(f) is ByteReader:
+        return f.read_uint256()
     return int.from_bytes(f.read(32), 'little')
 
 
@@ -164,17 +257,17 @@ def deser_vector(f, c, deser_function_name=None):
 # entries in the vector (we use this for serializing the vector of transactions
 # for a witness block).
 def ser_vector(l, ser_function_name=None):
-    r = ser_compact_size(len(l))
-    for i in l:
-        if ser_function_name:
-            r += getattr(i, ser_function_name)()
-        else:
-            r += i.serialize()
-    return r
+    if ser_function_name:
+        return ser_compact_size(len(l)) + b"".join(getattr(i, ser_function_name)() for i in l)
+    return ser_compact_size(len(l)) + b"".join(i.serialize() for i in l)
 
 
 def deser_uint256_vector(f):
     nit = deser_compact_size(f)
+    if type(f) is ByteReader:
+        # Zero-fill truncated data, like deser_uint256 does
+        data = f.read(32 * nit).ljust(32 * nit, b"\0")
+        return [int.from_bytes(data[i:i + 32], 'little') for i in range(0, len(data), 32)]
     r = []
     for _ in range(nit):
         t = deser_uint256(f)
@@ -183,14 +276,27 @@ def deser_uint256_vector(f):
 
 
 def ser_uint256_vector(l):
-    r = ser_compact_size(len(l))
-    for i in l:
-        r += ser_uint256(i)
+    return ser_compact_size(len(l)) + b"".join(ser_uint256(i) for i in l)
+
+
+def deser_inv_vector(f):
+    nit = deser_compact_size(f)
+    if type(f) is ByteReader:
+        # Zero-fill truncated data, like CInv.deserialize does
+        data = f.read(_INV.size * nit).ljust(_INV.size * nit, b"\0")
+        return [CInv(t, int.from_bytes(h, "little")) for t, h in _INV.iter_unpack(data)]
+    r = []
+    for _ in range(nit):
+        t = CInv()
+        t.deserialize(f)
+        r.append(t)
     return r
 
 
 def deser_string_vector(f):
     nit = deser_compact_size(f)
+    if type(f) is ByteReader:
+        return [f.read_string() for _ in range(nit)]
     r = []
     for _ in range(nit):
         t = deser_string(f)
@@ -199,10 +305,7 @@ def deser_string_vector(f):
 
 
 def ser_string_vector(l):
-    r = ser_compact_size(len(l))
-    for sv in l:
-        r += ser_string(sv)
-    return r
+    return ser_compact_size(len(l)) + b"".join(ser_string(sv) for sv in l)
 
 
 def from_hex(obj, hex_string):
@@ -211,7 +314,7 @@ def from_hex(obj, hex_string):
     Note that there is no complementary helper like e.g. `to_hex` for the
     inverse operation. To serialize a message object to a hex string, simply
     use obj.serialize().hex()"""
-    obj.deserialize(BytesIO(bytes.fromhex(hex_string)))
+    obj.deserialize(ByteReader(bytes.fromhex(hex_string)))
     return obj
 
 
@@ -224,9 +327,9 @@ def tx_from_hex(hex_string):
 def from_binary(cls, stream):
     """deserialize a binary stream (or bytes object) into an object"""
     # handle bytes object by turning it into a stream
-    was_bytes = isinstance(stream, bytes)
+    was_bytes = isinstance(stream, (bytes, bytearray, memoryview))
     if was_bytes:
-        stream = BytesIO(stream)
+        stream = ByteReader(stream)
     obj = cls()
     obj.deserialize(stream)
     if was_bytes:
@@ -382,6 +485,10 @@ class CInv:
         self.hash = h
 
     def deserialize(self, f):
+        if type(f) is ByteReader and f.has(_INV.size):
+            self.type, hash_bytes = f.unpack(_INV)
+            self.hash = int.from_bytes(hash_bytes, "little")
+            return
         self.type = int.from_bytes(f.read(4), "little")
         self.hash = deser_uint256(f)
 
@@ -427,6 +534,10 @@ class COutPoint:
         self.n = n
 
     def deserialize(self, f):
+        if type(f) is ByteReader and f.has(_OUTPOINT.size):
+            hash_bytes, self.n = f.unpack(_OUTPOINT)
+            self.hash = int.from_bytes(hash_bytes, "little")
+            return
         self.hash = deser_uint256(f)
         self.n = int.from_bytes(f.read(4), "little")
 
@@ -540,13 +651,10 @@ class CTxWitness:
             self.vtxinwit[i].deserialize(f)
 
     def serialize(self):
-        r = b""
         # This is different than the usual vector serialization --
         # we omit the length of the vector, which is required to be
         # the same length as the transaction's vin vector.
-        for x in self.vtxinwit:
-            r += x.serialize()
-        return r
+        return b"".join(x.serialize() for x in self.vtxinwit)
 
     def __repr__(self):
         return "CTxWitness(%s)" % \
@@ -559,9 +667,28 @@ class CTxWitness:
         return True
 
 
+def _freeze(key):
+    """Copy any bytearrays in a (nested) tuple, so later in-place changes to them are detected."""
+    if type(key) is tuple:
+        return tuple(_freeze(x) for x in key)
+    if type(key) is bytearray:
+        return bytes(key)
+    return key
+
+
 class CTransaction:
+    """A transaction.
+
+    The txid is cached in self.sha256 and self.hash, and must be explicitly
+    recalculated with rehash() after the transaction is modified.
+
+    Serializations, the wtxid and the weight are cached as well, but those
+    caches are dropped automatically when the transaction content changes.
+    This is detected by comparing a snapshot of all the fields (which is much
+    cheaper to build than a serialization), so it also covers in-place changes
+    to nested objects like tx.vin[0].prevout.n or witness stacks."""
     __slots__ = ("hash", "nLockTime", "version", "sha256", "vin", "vout",
-                 "wit")
+                 "wit", "_cache", "_cache_key")
 
     def __init__(self, tx=None):
         if tx is None:
@@ -572,6 +699,8 @@ class CTransaction:
             self.nLockTime = 0
             self.sha256 = None
             self.hash = None
+            self._cache = {}
+            self._cache_key = None
         else:
             self.version = tx.version
             self.vin = copy.deepcopy(tx.vin)
@@ -580,8 +709,18 @@ class CTransaction:
             self.sha256 = tx.sha256
             self.hash = tx.hash
             self.wit = copy.deepcopy(tx.wit)
+            self._cache = {}
+            self._cache_key = None
 
     def deserialize(self, f):
+        if type(f) is ByteReader:
+            start = f.tell()
+            try:
+                self._deserialize_from_reader(f)
+                return
+            except (IndexError, struct.error):
+                # Truncated: decode it again below, which zero-fills like a BytesIO
+                f._pos = start
         self.version = int.from_bytes(f.read(4), "little")
         self.vin = deser_vector(f, CTxIn)
         flags = 0
@@ -602,37 +741,106 @@ class CTransaction:
         self.nLockTime = int.from_bytes(f.read(4), "little")
         self.sha256 = None
         self.hash = None
+        self._cache = {}
+        self._cache_key = None
+
+    def _deserialize_from_reader(self, f):
+        """Like deserialize(), but decode the fields in place from the buffer of ByteReader f.
+
+        Transactions make up nearly all of the data in blocks, so this inlines the decoding of
+        the inputs, outputs and witnesses, instead of going through their deserialize() methods.
+        Truncated data raises IndexError or struct.error, leaving f where it was."""
+        view, pos = f._view, f._pos
+        self.version, = _UINT32.unpack_from(view, pos)
+        nin, pos = _compact_size_at(view, pos + 4)
+        flags = 0
+        if nin == 0:
+            flags = view[pos]
+            pos += 1
+            if flags != 0:
+                nin, pos = _compact_size_at(view, pos)
+        vin = []
+        for _ in range(nin):
+            hash_bytes, n = _OUTPOINT.unpack_from(view, pos)
+            nscript, pos = _compact_size_at(view, pos + 36)
+            script = bytes(view[pos:pos + nscript])
+            pos += nscript
+            sequence, = _UINT32.unpack_from(view, pos)
+            pos += 4
+            vin.append(CTxIn(COutPoint(int.from_bytes(hash_bytes, "little"), n), script, sequence))
+        self.vin = vin
+        if nin != 0 or flags != 0:
+            nout, pos = _compact_size_at(view, pos)
+            vout = []
+            for _ in range(nout):
+                value, = _INT64.unpack_from(view, pos)
+                nscript, pos = _compact_size_at(view, pos + 8)
+                vout.append(CTxOut(value, bytes(view[pos:pos + nscript])))
+                pos += nscript
+            self.vout = vout
+        self.wit = CTxWitness()
+        if flags != 0:
+            for _ in range(nin):
+                inwit = CTxInWitness()
+                nstack, pos = _compact_size_at(view, pos)
+                stack = inwit.scriptWitness.stack
+                for _ in range(nstack):
+                    nitem, pos = _compact_size_at(view, pos)
+                    stack.append(bytes(view[pos:pos + nitem]))
+                    pos += nitem
+                self.wit.vtxinwit.append(inwit)
+        self.nLockTime, = _UINT32.unpack_from(view, pos)
+        f._pos = pos + 4
+        self.sha256 = None
+        self.hash = None
+        self._cache = {}
+        self._cache_key = None
+
+    def _get_cache(self):
+        """Return the dict of cached values, emptied if the transaction changed since they were computed."""
+        key = (self.version, self.nLockTime,
+               tuple((i.prevout.hash, i.prevout.n, i.scriptSig, i.nSequence) for i in self.vin),
+               tuple((o.nValue, o.scriptPubKey) for o in self.vout),
+               tuple(tuple(w.scriptWitness.stack) for w in self.wit.vtxinwit))
+        if key != self._cache_key:
+            self._cache = {}
+            self._cache_key = _freeze(key)
+        return self._cache
 
     def serialize_without_witness(self):
-        r = b""
-        r += self.version.to_bytes(4, "little")
-        r += ser_vector(self.vin)
-        r += ser_vector(self.vout)
-        r += self.nLockTime.to_bytes(4, "little")
-        return r
+        cache = self._get_cache()
+        if "without_witness" not in cache:
+            cache["without_witness"] = b"".join((
+                self.version.to_bytes(4, "little"),
+                ser_vector(self.vin),
+                ser_vector(self.vout),
+                self.nLockTime.to_bytes(4, "little"),
+            ))
+        return cache["without_witness"]
 
     # Only serialize with witness when explicitly called for
     def serialize_with_witness(self):
-        flags = 0
-        if not self.wit.is_null():
-            flags |= 1
-        r = b""
-        r += self.version.to_bytes(4, "little")
-        if flags:
-            dummy = []
-            r += ser_vector(dummy)
-            r += flags.to_bytes(1, "little")
-        r += ser_vector(self.vin)
-        r += ser_vector(self.vout)
-        if flags & 1:
-            if (len(self.wit.vtxinwit) != len(self.vin)):
-                # vtxinwit must have the same length as vin
-                self.wit.vtxinwit = self.wit.vtxinwit[:len(self.vin)]
-                for _ in range(len(self.wit.vtxinwit), len(self.vin)):
-                    self.wit.vtxinwit.append(CTxInWitness())
-            r += self.wit.serialize()
-        r += self.nLockTime.to_bytes(4, "little")
-        return r
+        if not self.wit.is_null() and len(self.wit.vtxinwit) != len(self.vin):
+            # vtxinwit must have the same length as vin
+            self.wit.vtxinwit = self.wit.vtxinwit[:len(self.vin)]
+            for _ in range(len(self.wit.vtxinwit), len(self.vin)):
+                self.wit.vtxinwit.append(CTxInWitness())
+        cache = self._get_cache()
+        if "with_witness" not in cache:
+            if self.wit.is_null():
+                cache["with_witness"] = self.serialize_without_witness()
+            else:
+                flags = 1
+                cache["with_witness"] = b"".join((
+                    self.version.to_bytes(4, "little"),
+                    ser_vector([]),  # dummy
+                    flags.to_bytes(1, "little"),
+                    ser_vector(self.vin),
+                    ser_vector(self.vout),
+                    self.wit.serialize(),
+                    self.nLockTime.to_bytes(4, "little"),
+                ))
+        return cache["with_witness"]
 
     # Regular serialization is with witness -- must explicitly
     # call serialize_without_witness to exclude witness data.
@@ -652,12 +860,18 @@ class CTransaction:
     # self.sha256 and self.hash -- those are expected to be the txid.
     def calc_sha256(self, with_witness=False):
         if with_witness:
-            # Don't cache the result, just return it
-            return uint256_from_str(hash256(self.serialize_with_witness()))
-
+            # Don't store the result in self.sha256, just return it
+            cache = self._get_cache()
+            if "wtxid" not in cache:
+                cache["wtxid"] = uint256_from_str(hash256(self.serialize_with_witness()))
+            return cache["wtxid"]
+
+        cache = self._get_cache()
+        if "txid" not in cache:
+            cache["txid"] = hash256(self.serialize_without_witness())
         if self.sha256 is None:
-            self.sha256 = uint256_from_str(hash256(self.serialize_without_witness()))
-        self.hash = hash256(self.serialize_without_witness())[::-1].hex()
+            self.sha256 = uint256_from_str(cache["txid"])
+        self.hash = cache["txid"][::-1].hex()
 
     def is_valid(self):
         self.calc_sha256()
@@ -669,9 +883,12 @@ class CTransaction:
     # Calculate the transaction weight using witness and non-witness
     # serialization size (does NOT use sigops).
     def get_weight(self):
-        with_witness_size = len(self.serialize_with_witness())
-        without_witness_size = len(self.serialize_without_witness())
-        return (WITNESS_SCALE_FACTOR - 1) * without_witness_size + with_witness_size
+        cache = self._get_cache()
+        if "weight" not in cache:
+            with_witness_size = len(self.serialize_with_witness())
+            without_witness_size = len(self.serialize_without_witness())
+            cache["weight"] = (WITNESS_SCALE_FACTOR - 1) * without_witness_size + with_witness_size
+        return cache["weight"]
 
     def get_vsize(self):
         return math.ceil(self.get_weight() / WITNESS_SCALE_FACTOR)
@@ -710,12 +927,17 @@ class CBlockHeader:
         self.hash = None
 
     def deserialize(self, f):
-        self.nVersion = int.from_bytes(f.read(4), "little", signed=True)
-        self.hashPrevBlock = deser_uint256(f)
-        self.hashMerkleRoot = deser_uint256(f)
-        self.nTime = int.from_bytes(f.read(4), "little")
-        self.nBits = int.from_bytes(f.read(4), "little")
-        self.nNonce = int.from_bytes(f.read(4), "little")
+        if type(f) is ByteReader and f.has(_BLOCK_HEADER.size):
+            self.nVersion, prev, merkle, self.nTime, self.nBits, self.nNonce = f.unpack(_BLOCK_HEADER)
+            self.hashPrevBlock = int.from_bytes(prev, "little")
+            self.hashMerkleRoot = int.from_bytes(merkle, "little")
+        else:
+            self.nVersion = int.from_bytes(f.read(4), "little", signed=True)
+            self.hashPrevBlock = deser_uint256(f)
+            self.hashMerkleRoot = deser_uint256(f)
+            self.nTime = int.from_bytes(f.read(4), "little")
+            self.nBits = int.from_bytes(f.read(4), "little")
+            self.nNonce = int.from_bytes(f.read(4), "little")
         self.sha256 = None
         self.hash = None
 
@@ -738,8 +960,9 @@ class CBlockHeader:
             r += self.nTime.to_bytes(4, "little")
             r += self.nBits.to_bytes(4, "little")
             r += self.nNonce.to_bytes(4, "little")
-            self.sha256 = uint256_from_str(hash256(r))
-            self.hash = hash256(r)[::-1].hex()
+            h = hash256(r)
+            self.sha256 = uint256_from_str(h)
+            self.hash = h[::-1].hex()
 
     def rehash(self):
         self.sha256 = None
@@ -825,9 +1048,11 @@ class CBlock(CBlockHeader):
     # Calculate the block weight using witness and non-witness
     # serialization size (does NOT use sigops).
     def get_weight(self):
-        with_witness_size = len(self.serialize(with_witness=True))
-        without_witness_size = len(self.serialize(with_witness=False))
-        return (WITNESS_SCALE_FACTOR - 1) * without_witness_size + with_witness_size
+        # The header and transaction count are serialized the same way with
+        # and without witness, so the block weight is the sum of the weights
+        # of its parts.
+        header_size = BLOCK_HEADER_SIZE + len(ser_compact_size(len(self.vtx)))
+        return WITNESS_SCALE_FACTOR * header_size + sum(tx.get_weight() for tx in self.vtx)
 
     def __repr__(self):
         return "CBlock(nVersion=%i hashPrevBlock=%064x hashMerkleRoot=%064x nTime=%s nBits=%08x nNonce=%08x vtx=%s)" \
@@ -1240,7 +1465,7 @@ class msg_inv:
             self.inv = inv
 
     def deserialize(self, f):
-        self.inv = deser_vector(f, CInv)
+        self.inv = deser_inv_vector(f)
 
     def serialize(self):
         return ser_vector(self.inv)
@@ -1257,7 +1482,7 @@ class msg_getdata:
         self.inv = inv if inv is not None else []
 
     def deserialize(self, f):
-        self.inv = deser_vector(f, CInv)
+        self.inv = deser_inv_vector(f)
 
     def serialize(self):
         return ser_vector(self.inv)
@@ -1455,7 +1680,7 @@ class msg_notfound:
         self.vec = vec or []
 
     def deserialize(self, f):
-        self.vec = deser_vector(f, CInv)
+        self.vec = deser_inv_vector(f)
 
     def serialize(self):
         return ser_vector(self.vec)
@@ -1911,3 +2136,112 @@ class TestFrameworkScript(unittest.TestCase):
         check_addrv2("2bqghnldu6mcug4pikzprwhtjjnsyederctvci6klcwzepnjd46ikjyd.onion", CAddress.NET_TORV3)
         check_addrv2("255fhcp6ajvftnyo7bwz3an3t4a4brhopm3bamyh2iu5r3gnr2rq.b32.i2p", CAddress.NET_I2P)
         check_addrv2("fc32:17ea:e415:c3bf:9808:149d:b5a2:c9aa", CAddress.NET_CJDNS)
+
+    def test_transaction_cache(self):
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(1, 0))]
+        tx.vout = [CTxOut(1000, bytearray(b"\x51"))]
+        tx.rehash()
+
+        def check_uncached(tx):
+            fresh = tx_from_hex(tx.serialize().hex())
+            self.assertEqual(tx.serialize_without_witness(), fresh.serialize_without_witness())
+            self.assertEqual(tx.calc_sha256(True), fresh.calc_sha256(True))
+            self.assertEqual(tx.get_weight(), fresh.get_weight())
+
+        check_uncached(tx)
+        # Changes to nested objects, including in-place changes to bytearrays, invalidate the cache
+        tx.vin[0].prevout.n = 1
+        check_uncached(tx)
+        tx.vout[0].scriptPubKey[0] = 0x52
+        check_uncached(tx)
+        tx.wit.vtxinwit = [CTxInWitness()]
+        tx.wit.vtxinwit[0].scriptWitness.stack = [b"\x01"]
+        check_uncached(tx)
+        tx.wit.vtxinwit[0].scriptWitness.stack.append(b"\x02")
+        check_uncached(tx)
+        # The txid in sha256 is only updated on rehash(), while calc_sha256() always refreshes hash
+        txid = tx.sha256
+        tx.nLockTime = 1
+        self.assertEqual(tx.sha256, txid)
+        tx.calc_sha256()
+        self.assertEqual(tx.sha256, txid)
+        self.assertEqual(tx.hash, hash256(tx.serialize_without_witness())[::-1].hex())
+        tx.rehash()
+        self.assertNotEqual(tx.sha256, txid)
+        self.assertEqual(tx.hash, hash256(tx.serialize_without_witness())[::-1].hex())
+
+    def test_block_weight(self):
+        block = CBlock()
+        for i in range(3):
+            tx = CTransaction()
+            tx.vin = [CTxIn(COutPoint(i, 0))]
+            tx.vout = [CTxOut(i, b"\x51")]
+            tx.wit.vtxinwit = [CTxInWitness()]
+            tx.wit.vtxinwit[0].scriptWitness.stack = [b"\x01" * i]
+            block.vtx.append(tx)
+        self.assertEqual(block.get_weight(), 3 * len(block.serialize(with_witness=False)) + len(block.serialize()))
+
+    def test_byte_reader(self):
+        """Deserializing from a ByteReader gives the same result as from a BytesIO."""
+        def check(obj_type, data):
+            expected = obj_type()
+            expected.deserialize(BytesIO(data))
+            for buf in (data, bytearray(data), memoryview(data)):
+                reader = ByteReader(buf)
+                actual = obj_type()
+                actual.deserialize(reader)
+                self.assertEqual(reader.read(), b"")
+                self.assertEqual(repr(actual), repr(expected))
+                self.assertEqual(actual.serialize(), expected.serialize())
+            return actual
+
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(i, i), b"\x01" * 300, i) for i in range(3)]
+        tx.vout = [CTxOut(-i, b"\x02" * 70000) for i in range(2)]
+        check(CTransaction, tx.serialize())
+        tx.wit.vtxinwit = [CTxInWitness() for _ in range(3)]
+        tx.wit.vtxinwit[1].scriptWitness.stack = [b"", b"\x03" * 80]
+        tx = check(CTransaction, tx.serialize())
+        self.assertTrue(all(type(x) is bytes for x in [tx.vin[0].scriptSig, tx.vout[0].scriptPubKey, tx.wit.vtxinwit[1].scriptWitness.stack[1]]))
+        check(CTransaction, CTransaction().serialize())
+        block = CBlock()
+        block.nVersion, block.hashPrevBlock, block.nTime = -1, 2**256 - 1, 2**32 - 1
+        block.vtx = [tx, tx]
+        check(CBlock, block.serialize())
+        check(msg_inv, msg_inv([CInv(MSG_TX, i) for i in range(300)]).serialize())
+        # Reading past the end behaves like a BytesIO: the optional relay field of a version message
+        version = msg_version()
+        version.relay = 1
+        check(msg_version, version.serialize()[:-1])
+
+    def test_byte_reader_truncated(self):
+        """Truncated data is zero-filled by a ByteReader like by a BytesIO."""
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(i, i), b"\x01" * 300, i) for i in range(2)]
+        tx.vout = [CTxOut(1, b"\x02" * 20)]
+        tx.wit.vtxinwit = [CTxInWitness() for _ in range(2)]
+        tx.wit.vtxinwit[1].scriptWitness.stack = [b"\x03" * 80]
+        block = CBlock()
+        block.nVersion = -1
+        block.vtx = [tx]
+        for obj_type, data in [
+            (CTransaction, tx.serialize()),
+            (CBlock, block.serialize()),
+            (msg_inv, msg_inv([CInv(MSG_TX, i) for i in range(3)]).serialize()),
+            (msg_getheaders, msg_getheaders().serialize()),
+        ]:
+            for end in range(len(data)):
+                stream = BytesIO(data[:end])
+                expected = obj_type()
+                expected.deserialize(stream)
+                reader = ByteReader(data[:end])
+                actual = obj_type()
+                actual.deserialize(reader)
+                self.assertEqual(reader.tell(), stream.tell())
+                self.assertEqual(repr(actual), repr(expected))
+        for hex_string in ["", "02000000", tx.serialize().hex()[:-2]]:
+            expected = CTransaction()
+            expected.deserialize(BytesIO(bytes.fromhex(hex_string)))
+            self.assertEqual(repr(tx_from_hex(hex_string)), repr(expected))
+        self.assertEqual(ByteReader(b"\xfe\x01").read_compact_size(), 1)
@@ -13,6 +13,7 @@ node. Messages are sent to/received from the node on an asyncio event loop.
 State held inside the objects must be guarded by the p2p_lock to avoid data
 races between the main testing thread and the event loop.
 
+ReceiveBuffer: A byte buffer with a read cursor, holding data received from a node
 P2PConnection: A low-level connection object to a node's P2P interface
 P2PInterface: A high-level interface object for communicating to a node over P2P
 P2PDataStore: A p2p interface class that keeps a store of transactions and blocks
@@ -25,12 +26,18 @@ from collections import defaultdict
 from io import BytesIO
 import logging
 import platform
+import random
 import struct
 import sys
 import threading
+import time
+import unittest
+import unittest.mock
 
 from test_framework.messages import (
+    ByteReader,
     CBlockHeader,
+    CInv,
     MAX_HEADERS_RESULTS,
     msg_addr,
     msg_addrv2,
@@ -108,6 +115,8 @@ TXID_RELAY_DELAY = 2
 OVERLOADED_PEER_TX_DELAY = 2
 # How long to wait before downloading a transaction from an additional peer
 GETDATA_TX_INTERVAL = 60
+# Layout of the v1 P2P message header: magic bytes, message type, payload length and checksum
+MSG_HEADER = struct.Struct("<4s12sI4s")
 
 MESSAGEMAP = {
     b"addr": msg_addr,
@@ -148,6 +157,56 @@ MESSAGEMAP = {
 }
 
 
+class ReceiveBuffer:
+    """A byte buffer with a read cursor, holding data received from a node.
+
+    Received data is appended at the end, and parsed messages are consumed from the
+    front by advancing the cursor, rather than by re-slicing the whole buffer after
+    every message (which is quadratic in the amount of buffered data). The consumed
+    space is reclaimed in bulk when new data arrives and at least half of the buffer
+    has been consumed.
+
+    Unconsumed data is exposed as a memoryview, so that headers and payloads can be
+    parsed without copying. A bytearray cannot be resized while memoryviews into it
+    are alive; if a caller still holds one, a fresh bytearray is allocated instead."""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+
+    def __len__(self):
+        return len(self._buf) - self._pos
+
+    def append(self, data):
+        """Append received data at the end of the buffer."""
+        try:
+            if self._pos * 2 >= len(self._buf):
+                del self._buf[:self._pos]
+                self._pos = 0
+            self._buf += data
+        except BufferError:
+            self._buf = self._buf[self._pos:] + data
+            self._pos = 0
+
+    def view(self):
+        """Return a memoryview of the unconsumed data."""
+        return memoryview(self._buf)[self._pos:]
+
+    def getvalue(self):
+        """Return a copy of the unconsumed data as bytes."""
+        return bytes(self.view())
+
+    def consume(self, n):
+        """Mark the next n bytes as consumed."""
+        assert 0 <= n <= len(self)
+        self._pos += n
+
+    def clear(self):
+        """Discard all data."""
+        self._buf = bytearray()
+        self._pos = 0
+
+
 class P2PConnection(asyncio.Protocol):
     """A low-level connection object to a node's P2P interface.
 
@@ -186,7 +245,7 @@ class P2PConnection(asyncio.Protocol):
         self.dstport = dstport
         # The initial message to send after the connection was made:
         self.on_connection_send_msg = None
-        self.recvbuf = b""
+        self.recvbuf = ReceiveBuffer()
         self.magic_bytes = MAGIC_BYTES[net]
 
     def peer_connect(self, dstaddr, dstport, *, net, timeout_factor, supports_v2_p2p):
@@ -230,6 +289,7 @@ class P2PConnection(asyncio.Protocol):
         if self.p2p_connected_to_node and not self.supports_v2_p2p:
             self.send_version()
         self.on_open()
+        notify_p2p_state_changed()
 
     def connection_lost(self, exc):
         """asyncio callback when a connection is closed."""
@@ -239,8 +299,9 @@ class P2PConnection(asyncio.Protocol):
         else:
             logger.debug("Closed connection to: %s:%d" % (self.dstaddr, self.dstport))
         self._transport = None
-        self.recvbuf = b""
+        self.recvbuf.clear()
         self.on_close()
+        notify_p2p_state_changed()
 
     # v2 handshake method
     def _on_data_v2_handshake(self):
@@ -257,8 +318,8 @@ class P2PConnection(asyncio.Protocol):
             if not self.v2_state.initiating and not self.v2_state.sent_garbage:
                 # if the responder hasn't sent garbage yet, the responder is still reading ellswift bytes
                 # reads ellswift bytes till the first mismatch from 12 bytes V1_PREFIX
-                length, send_handshake_bytes = self.v2_state.respond_v2_handshake(BytesIO(self.recvbuf))
-                self.recvbuf = self.recvbuf[length:]
+                length, send_handshake_bytes = self.v2_state.respond_v2_handshake(BytesIO(self.recvbuf.getvalue()))
+                self.recvbuf.consume(length)
                 if send_handshake_bytes == -1:
                     self.v2_state = None
                     return
@@ -270,8 +331,8 @@ class P2PConnection(asyncio.Protocol):
 
             # `complete_handshake()` reads the remaining ellswift bytes from recvbuf
             # and sends response after deriving shared ECDH secret using received ellswift bytes
-            length, response = self.v2_state.complete_handshake(BytesIO(self.recvbuf))
-            self.recvbuf = self.recvbuf[length:]
+            length, response = self.v2_state.complete_handshake(BytesIO(self.recvbuf.getvalue()))
+            self.recvbuf.consume(length)
             if response:
                 self.send_raw_message(response)
             else:
@@ -281,10 +342,10 @@ class P2PConnection(asyncio.Protocol):
         # is derived in `complete_handshake()`.
         # so `authenticate_handshake()` which uses the BIP324 derived ciphers gets called after `complete_handshake()`.
         assert self.v2_state.peer
-        length, is_mac_auth = self.v2_state.authenticate_handshake(self.recvbuf)
+        length, is_mac_auth = self.v2_state.authenticate_handshake(self.recvbuf.getvalue())
         if not is_mac_auth:
             raise ValueError("invalid v2 mac tag in handshake authentication")
-        self.recvbuf = self.recvbuf[length:]
+        self.recvbuf.consume(length)
         if self.v2_state.tried_v2_handshake:
             # for v2 outbound connections, send version message immediately after v2 handshake
             if self.p2p_connected_to_node:
@@ -298,7 +359,7 @@ class P2PConnection(asyncio.Protocol):
     def data_received(self, t):
         """asyncio callback when data is read from the socket."""
         if len(t) > 0:
-            self.recvbuf += t
+            self.recvbuf.append(t)
             if self.supports_v2_p2p and not self.v2_state.tried_v2_handshake:
                 self._on_data_v2_handshake()
             else:
@@ -312,24 +373,26 @@ class P2PConnection(asyncio.Protocol):
         the on_message callback for processing."""
         try:
             while True:
+                buf = self.recvbuf.view()
                 if self.supports_v2_p2p:
                     # v2 P2P messages are read
-                    msglen, msg = self.v2_state.v2_receive_packet(self.recvbuf)
+                    msglen, msg = self.v2_state.v2_receive_packet(buf)
                     if msglen == -1:
-                        raise ValueError("invalid v2 mac tag " + repr(self.recvbuf))
+                        raise ValueError("invalid v2 mac tag " + repr(self.recvbuf.getvalue()))
                     elif msglen == 0:  # need to receive more bytes in recvbuf
                         return
-                    self.recvbuf = self.recvbuf[msglen:]
+                    self.recvbuf.consume(msglen)
 
                     if msg is None:  # ignore decoy messages
-                        return
+                        continue
                     assert msg  # application layer messages (which aren't decoy messages) are non-empty
+                    msg = memoryview(msg)
                     shortid = msg[0]  # 1-byte short message type ID
                     if shortid == 0:
                         # next 12 bytes are interpreted as ASCII message type if shortid is b'\x00'
                         if len(msg) < 13:
                             raise IndexError("msg needs minimum required length of 13 bytes")
-                        msgtype = msg[1:13].rstrip(b'\x00')
+                        msgtype = bytes(msg[1:13]).rstrip(b'\x00')
                         msg = msg[13:]  # msg is set to be payload
                     else:
                         # a 1-byte short message type ID
@@ -337,26 +400,25 @@ class P2PConnection(asyncio.Protocol):
                         msg = msg[1:]
                 else:
                     # v1 P2P messages are read
-                    if len(self.recvbuf) < 4:
+                    if len(buf) < 4:
                         return
-                    if self.recvbuf[:4] != self.magic_bytes:
-                        raise ValueError("magic bytes mismatch: {} != {}".format(repr(self.magic_bytes), repr(self.recvbuf)))
-                    if len(self.recvbuf) < 4 + 12 + 4 + 4:
+                    if buf[:4] != self.magic_bytes:
+                        raise ValueError("magic bytes mismatch: {} != {}".format(repr(self.magic_bytes), repr(self.recvbuf.getvalue())))
+                    if len(buf) < MSG_HEADER.size:
                         return
-                    msgtype = self.recvbuf[4:4+12].split(b"\x00", 1)[0]
-                    msglen = struct.unpack("<i", self.recvbuf[4+12:4+12+4])[0]
-                    checksum = self.recvbuf[4+12+4:4+12+4+4]
-                    if len(self.recvbuf) < 4 + 12 + 4 + 4 + msglen:
+                    _, msgtype, msglen, checksum = MSG_HEADER.unpack_from(buf)
+                    msgtype = msgtype.split(b"\x00", 1)[0]
+                    if len(buf) < MSG_HEADER.size + msglen:
                         return
-                    msg = self.recvbuf[4+12+4+4:4+12+4+4+msglen]
+                    msg = buf[MSG_HEADER.size:MSG_HEADER.size + msglen]
                     th = sha256(msg)
                     h = sha256(th)
                     if checksum != h[:4]:
-                        raise ValueError("got bad checksum " + repr(self.recvbuf))
-                    self.recvbuf = self.recvbuf[4+12+4+4+msglen:]
+                        raise ValueError("got bad checksum " + repr(self.recvbuf.getvalue()))
+                    self.recvbuf.consume(MSG_HEADER.size + msglen)
                 if msgtype not in MESSAGEMAP:
-                    raise ValueError("Received unknown msgtype from %s:%d: '%s' %s" % (self.dstaddr, self.dstport, msgtype, repr(msg)))
-                f = BytesIO(msg)
+                    raise ValueError("Received unknown msgtype from %s:%d: '%s' %s" % (self.dstaddr, self.dstport, msgtype, repr(bytes(msg))))
+                f = ByteReader(msg)
                 t = MESSAGEMAP[msgtype]()
                 t.deserialize(f)
                 self._log_message("receive", t)
@@ -504,6 +566,7 @@ class P2PInterface(P2PConnection):
                 self.message_count[msgtype] += 1
                 self.last_message[msgtype] = message
                 getattr(self, 'on_' + msgtype)(message)
+                p2p_state_changed.notify_all()
             except Exception:
                 print("ERROR delivering %s (%s)" % (repr(message), sys.exc_info()[0]))
                 raise
@@ -585,7 +648,7 @@ class P2PInterface(P2PConnection):
                 assert self.is_connected
             return test_function_in()
 
-        wait_until_helper_internal(test_function, timeout=timeout, lock=p2p_lock, timeout_factor=self.timeout_factor)
+        wait_until_helper_internal(test_function, timeout=timeout, lock=p2p_state_changed, timeout_factor=self.timeout_factor)
 
     def wait_for_connect(self, *, timeout=60):
         test_function = lambda: self.is_connected
@@ -710,6 +773,14 @@ class P2PInterface(P2PConnection):
 # This lock should be acquired in the thread running the test logic to synchronize
 # access to any data shared with the P2PInterface or P2PConnection.
 p2p_lock = threading.Lock()
+# Notified (with p2p_lock held) whenever a P2PInterface received a message or a connection
+# was opened or closed, so that P2PInterface.wait_until() re-checks its predicate right away.
+p2p_state_changed = threading.Condition(p2p_lock)
+
+
+def notify_p2p_state_changed():
+    with p2p_lock:
+        p2p_state_changed.notify_all()
 
 
 class NetworkThread(threading.Thread):
@@ -945,3 +1016,70 @@ class P2PTxInvStore(P2PInterface):
         self.wait_until(lambda: set(self.tx_invs_received.keys()) == set([int(tx, 16) for tx in txns]), timeout=timeout)
         # Flush messages and wait for the getdatas to be processed
         self.sync_with_ping()
+
+
+class TestFrameworkP2P(unittest.TestCase):
+    class _Collector(P2PConnection):
+        """P2PConnection which records received messages instead of handling them."""
+        def __init__(self):
+            super().__init__()
+            self.peer_connect_helper("0", 0, "regtest", 1)
+            self.messages = []
+
+        def on_message(self, message):
+            self.messages.append(message)
+
+    def _check_chunked_receive(self, sender, receiver):
+        rng = random.Random(0)
+        sent = []
+        for i in range(200):
+            sent.append(rng.choice([msg_ping(i), msg_inv([CInv(MSG_TX, i)] * rng.randrange(50)), msg_getaddr()]))
+        data = b"".join(sender.build_message(msg) for msg in sent)
+        pos = 0
+        while pos < len(data):
+            step = rng.randrange(1, 300)
+            receiver.data_received(data[pos:pos + step])
+            pos += step
+        self.assertEqual(len(receiver.recvbuf), 0)
+        self.assertEqual([m.serialize() for m in receiver.messages], [m.serialize() for m in sent])
+
+    def test_receive_v1(self):
+        self._check_chunked_receive(self._Collector(), self._Collector())
+
+    def test_receive_v2(self):
+        sender, receiver = self._Collector(), self._Collector()
+        sender.v2_state = EncryptedP2PState(initiating=True, net="regtest")
+        receiver.v2_state = EncryptedP2PState(initiating=False, net="regtest")
+        for state in (sender.v2_state, receiver.v2_state):
+            state.initialize_v2_transport(bytes(32))
+            state.tried_v2_handshake = True
+        # Decoy packets in between messages are skipped.
+        receiver.data_received(sender.v2_state.v2_enc_packet(b"decoy", ignore=True))
+        self._check_chunked_receive(sender, receiver)
+
+    def test_receive_buffer(self):
+        buf = ReceiveBuffer()
+        buf.append(b"abcdef")
+        buf.consume(4)
+        self.assertEqual(buf.getvalue(), b"ef")
+        # A view held by the caller must not prevent appending or compaction.
+        view = buf.view()
+        buf.append(b"gh")
+        self.assertEqual(bytes(view), b"ef")
+        self.assertEqual(buf.getvalue(), b"efgh")
+        buf.consume(4)
+        self.assertEqual(len(buf), 0)
+        buf.append(b"ij")
+        self.assertEqual(buf.getvalue(), b"ij")
+
+    def test_wait_until_wakeup(self):
+        """P2PInterface.wait_until() returns as soon as a message arrives, without polling."""
+        peer = P2PInterface()
+        peer.peer_connect_helper("0", 0, "regtest", 1)
+        timer = threading.Timer(0.1, peer.on_message, [msg_pong(1)])
+        timer.start()
+        start = time.time()
+        with unittest.mock.patch("test_framework.util.WAIT_MAX_DELAY", 60):
+            peer.wait_until(lambda: "pong" in peer.last_message, check_connected=False)
+        self.assertLess(time.time() - start, 10)
+        timer.join()
@@ -7,6 +7,8 @@
 import configparser
 from enum import Enum
 import argparse
+import hashlib
+import json
 import logging
 import os
 import platform
@@ -22,6 +24,7 @@ import time
 from .address import create_deterministic_address_bcrt1_p2tr_op_true
 from .authproxy import JSONRPCException
 from . import coverage
+from .crypto import backend as crypto_backend
 from .p2p import NetworkThread
 from .test_node import TestNode
 from .util import (
@@ -29,11 +32,14 @@ from .util import (
     PortSeed,
     assert_equal,
     check_json_precision,
+    clone_tree,
     find_vout_for_address,
     get_datadir_path,
     initialize_datadir,
+    map_concurrently,
     p2p_port,
     wait_until_helper_internal,
+    wait_stats,
 )
 
 
@@ -194,6 +200,8 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                             help="use BIP324 v2 connections between all nodes by default")
         parser.add_argument("--v1transport", dest="v1transport", default=False, action="store_true",
                             help="Explicitly use v1 transport (can be used to overwrite global --v2transport option)")
+        parser.add_argument("--crypto-backend", dest="crypto_backend", default=crypto_backend.BACKEND_AUTO, choices=crypto_backend.BACKENDS,
+                            help="Implementation of the framework's crypto primitives: 'auto' uses native implementations where available, 'python' forces the pure Python reference code (default: %(default)s)")
 
         self.add_options(parser)
         # Running TestShell in a Jupyter notebook causes an additional -f argument
@@ -273,6 +281,9 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             self.options.tmpdir = tempfile.mkdtemp(prefix=TMPDIR_PREFIX)
         self._start_logging()
 
+        crypto_backend.set_backend(self.options.crypto_backend)
+        self.log.debug(f"Crypto backend {self.options.crypto_backend}: {crypto_backend.active_implementations()}")
+
         # Seed the PRNG. Note that test runs are reproducible if and only if
         # a single thread accesses the PRNG. For more information, see
         # https://docs.python.org/3/library/random.html#notes-on-reproducibility.
@@ -321,6 +332,15 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 node.cleanup_on_exit = False
             self.log.info("Note: bitcoinds were not stopped and may still be running")
 
+        self.log.info("Waited {:.3f} s in {} wait_until() calls (longest {:.3f} s)".format(
+            wait_stats.total, wait_stats.count, wait_stats.longest))
+        startup_times = [t for node in self.nodes for t in node.startup_times]
+        self.log.info("Started nodes {} times in {:.3f} s (longest {:.3f} s)".format(
+            len(startup_times), sum(startup_times), max(startup_times, default=0)))
+        shutdown_times = [t for node in self.nodes for t in node.shutdown_times]
+        self.log.info("Stopped nodes {} times in {:.3f} s (longest {:.3f} s)".format(
+            len(shutdown_times), sum(shutdown_times), max(shutdown_times, default=0)))
+
         should_clean_up = (
             not self.options.nocleanup and
             not self.options.noshutdown and
@@ -565,8 +585,9 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         try:
             for i, node in enumerate(self.nodes):
                 node.start(extra_args[i], *args, **kwargs)
-            for node in self.nodes:
-                node.wait_for_rpc_connection()
+            # Wait for all nodes at the same time, so that starting them takes as long as the
+            # slowest node instead of the sum of all nodes.
+            map_concurrently(lambda node: node.wait_for_rpc_connection(), self.nodes)
         except Exception:
             # If one node failed to start, stop the others
             self.stop_nodes()
@@ -582,13 +603,8 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
 
     def stop_nodes(self, wait=0):
         """Stop multiple bitcoind test nodes"""
-        for node in self.nodes:
-            # Issue RPC to stop nodes
-            node.stop_node(wait=wait, wait_until_stopped=False)
-
-        for node in self.nodes:
-            # Wait for nodes to stop
-            node.wait_until_stopped()
+        # Issue RPC to stop nodes and wait for them to stop, for all nodes at the same time
+        map_concurrently(lambda node: node.stop_node(wait=wait), self.nodes)
 
     def restart_node(self, i, extra_args=None, clear_addrman=False):
         """Stop and start a test node"""
@@ -748,13 +764,27 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         rpc_connections = nodes or self.nodes
         timeout = int(timeout * self.options.timeout_factor)
         stop_time = time.time() + timeout
+
+        def get_status(node):
+            # Query each node in a single round trip
+            with node.batch() as batch:
+                calls = (batch.getbestblockhash(), batch.getblockcount(), batch.getpeerinfo())
+            return [call.result() for call in calls]
+
         while time.time() <= stop_time:
-            best_hash = [x.getbestblockhash() for x in rpc_connections]
+            status = map_concurrently(get_status, rpc_connections)
+            best_hash = [best_hash for best_hash, _, _ in status]
             if best_hash.count(best_hash[0]) == len(rpc_connections):
                 return
             # Check that each peer has at least one connection
-            assert (all([len(x.getpeerinfo()) for x in rpc_connections]))
-            time.sleep(wait)
+            assert (all([len(peer_info) for _, _, peer_info in status]))
+            # Instead of sleeping, wait for the nodes which are behind to reach the tip of the
+            # node with the most blocks, which is usually the tip they will all sync to. This
+            # returns as soon as they do, or after `wait` seconds, like the sleep did.
+            target_hash = max(status, key=lambda s: s[1])[0]
+            wait_ms = max(1, int(min(wait, stop_time - time.time()) * 1000))
+            lagging = [node for node, h in zip(rpc_connections, best_hash) if h != target_hash]
+            map_concurrently(lambda node: node.waitforblock(target_hash, wait_ms), lagging)
         raise AssertionError("Block sync timed out after {}s:{}".format(
             timeout,
             "".join("\n  {!r}".format(b) for b in best_hash),
@@ -768,16 +798,27 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         rpc_connections = nodes or self.nodes
         timeout = int(timeout * self.options.timeout_factor)
         stop_time = time.time() + timeout
+
+        def get_status(node):
+            # Query each node in a single round trip
+            with node.batch() as batch:
+                calls = (batch.getrawmempool(), batch.getpeerinfo())
+            return [call.result() for call in calls]
+
+        # There is no RPC to wait for mempool changes, so poll, but start with short intervals
+        # to not add up to `wait` seconds of latency when the transactions relay quickly.
+        poll_interval = min(0.05, wait)
         while time.time() <= stop_time:
-            pool = [set(r.getrawmempool()) for r in rpc_connections]
+            status = map_concurrently(get_status, rpc_connections)
+            pool = [set(mempool) for mempool, _ in status]
             if pool.count(pool[0]) == len(rpc_connections):
                 if flush_scheduler:
-                    for r in rpc_connections:
-                        r.syncwithvalidationinterfacequeue()
+                    map_concurrently(lambda r: r.syncwithvalidationinterfacequeue(), rpc_connections)
                 return
             # Check that each peer has at least one connection
-            assert (all([len(x.getpeerinfo()) for x in rpc_connections]))
-            time.sleep(wait)
+            assert (all([len(peer_info) for _, peer_info in status]))
+            time.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, wait)
         raise AssertionError("Mempool sync timed out after {}s:{}".format(
             timeout,
             "".join("\n  {!r}".format(m) for m in pool),
@@ -820,27 +861,81 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             rpc_handler.setLevel(logging.DEBUG)
             rpc_logger.addHandler(rpc_handler)
 
+    def _binary_digest(self, path):
+        """Return the sha256 digest of a file, which is remembered in the cache directory until the file is modified."""
+        digests_path = os.path.join(self.options.cachedir, "digests.json")
+        path = os.path.realpath(shutil.which(path) or path)
+        stat = os.stat(path)
+        fingerprint = [stat.st_size, stat.st_mtime_ns]
+        try:
+            with open(digests_path, encoding="utf8") as f:
+                digests = json.load(f)
+        except (OSError, ValueError):
+            digests = {}
+        if path in digests and digests[path][:2] == fingerprint:
+            return bytes.fromhex(digests[path][2])
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            # Hash in chunks, as the binary can be large (e.g. in debug builds)
+            while chunk := f.read(1 << 20):
+                hasher.update(chunk)
+        digest = hasher.digest()
+        digests[path] = fingerprint + [digest.hex()]
+        # Write atomically, as tests running in parallel may read it
+        os.makedirs(self.options.cachedir, exist_ok=True)
+        tmp_path = "{}.tmp{}".format(digests_path, os.getpid())
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump(digests, f)
+        os.replace(tmp_path, digests_path)
+        return digest
+
+    def _get_chain_cache_dir(self, extra_conf, extra_args):
+        """Return the directory for the cached chain used by this test.
+
+        The directory name is a hash of everything the cached chain depends on: the chain, the
+        options of the node creating it, the bitcoind binary and the framework code (all of
+        test_framework/, which includes e.g. the derivation of the addresses mined to). So a
+        cache can be kept across test runs, and is never reused after one of them changed."""
+        key = hashlib.sha256(json.dumps([self.chain, self.disable_autoconnect, extra_conf, extra_args]).encode())
+        key.update(self._binary_digest(self.options.bitcoind))
+        framework_dir = os.path.dirname(os.path.abspath(__file__))
+        sources = sorted(
+            os.path.relpath(os.path.join(root, name), framework_dir)
+            for root, _, files in os.walk(framework_dir)
+            for name in files if name.endswith(".py")
+        )
+        for source in sources:
+            with open(os.path.join(framework_dir, source), "rb") as f:
+                key.update(source.encode() + hashlib.sha256(f.read()).digest())
+        return os.path.join(self.options.cachedir, key.hexdigest()[:16])
+
     def _initialize_chain(self):
         """Initialize a pre-mined blockchain for use by the test.
 
-        Create a cache of a 199-block-long chain
-        Afterward, create num_nodes copies from the cache."""
+        Create a cache of a 199-block-long chain, unless it already exists
+        Afterward, create num_nodes clones of the cache."""
 
         CACHE_NODE_ID = 0  # Use node 0 to create the cache for all other nodes
-        cache_node_dir = get_datadir_path(self.options.cachedir, CACHE_NODE_ID)
+        cache_extra_conf = ["bind=127.0.0.1"]
+        cache_extra_args = ['-disablewallet']
+        cache_dir = self._get_chain_cache_dir(cache_extra_conf, cache_extra_args)
+        cache_node_dir = get_datadir_path(cache_dir, CACHE_NODE_ID)
         assert self.num_nodes <= MAX_NODES
 
         if not os.path.isdir(cache_node_dir):
             self.log.debug("Creating cache directory {}".format(cache_node_dir))
 
-            initialize_datadir(self.options.cachedir, CACHE_NODE_ID, self.chain, self.disable_autoconnect)
+            # Build the cache in a private directory, and publish it with an atomic
+            # rename, so tests running in parallel never use a partially built cache.
+            build_dir = "{}.tmp{}".format(cache_dir, os.getpid())
+            build_node_dir = initialize_datadir(build_dir, CACHE_NODE_ID, self.chain, self.disable_autoconnect)
             self.nodes.append(
                 TestNode(
                     CACHE_NODE_ID,
-                    cache_node_dir,
+                    build_node_dir,
                     chain=self.chain,
-                    extra_conf=["bind=127.0.0.1"],
-                    extra_args=['-disablewallet'],
+                    extra_conf=cache_extra_conf,
+                    extra_args=cache_extra_args,
                     rpchost=None,
                     timewait=self.rpc_timeout,
                     timeout_factor=self.options.timeout_factor,
@@ -881,17 +976,26 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             self.nodes = []
 
             def cache_path(*paths):
-                return os.path.join(cache_node_dir, self.chain, *paths)
+                return os.path.join(build_node_dir, self.chain, *paths)
 
             os.rmdir(cache_path('wallets'))  # Remove empty wallets dir
             for entry in os.listdir(cache_path()):
                 if entry not in ['chainstate', 'blocks', 'indexes']:  # Only indexes, chainstate and blocks folders
                     os.remove(cache_path(entry))
 
+            try:
+                os.rename(build_dir, cache_dir)
+            except OSError:
+                # Another test created the same cache in the meantime
+                shutil.rmtree(build_dir)
+
+        # Record the use, so test_runner.py keeps the cache
+        os.utime(cache_dir)
+
         for i in range(self.num_nodes):
-            self.log.debug("Copy cache directory {} to node {}".format(cache_node_dir, i))
+            self.log.debug("Clone cache directory {} to node {}".format(cache_node_dir, i))
             to_dir = get_datadir_path(self.options.tmpdir, i)
-            shutil.copytree(cache_node_dir, to_dir)
+            clone_tree(cache_node_dir, to_dir)
             initialize_datadir(self.options.tmpdir, i, self.chain, self.disable_autoconnect)  # Overwrite port/rpcport in bitcoin.conf
 
     def _initialize_chain_clean(self):
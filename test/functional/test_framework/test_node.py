@@ -24,13 +24,16 @@ from pathlib import Path
 
 from .authproxy import (
     JSONRPCException,
+    RPCBatch,
     serialization_fallback,
 )
+from .debuglog import DebugLogFollower, get_inotify
 from .descriptors import descsum_create
 from .messages import NODE_P2P_V2
 from .p2p import P2P_SERVICES, P2P_SUBVERSION
 from .util import (
     MAX_NODES,
+    WAIT_MIN_DELAY,
     assert_equal,
     append_config,
     delete_cookie_file,
@@ -43,6 +46,8 @@ from .util import (
 )
 
 BITCOIND_PROC_WAIT_TIMEOUT = 60
+# Upper bound of the delay between two attempts to connect to a starting bitcoind.
+STARTUP_MAX_DELAY = 0.25
 
 
 class FailedToStartError(Exception):
@@ -158,6 +163,14 @@ class TestNode():
 
         self.p2ps = []
         self.timeout_factor = timeout_factor
+        # Follows debug.log for assert_debug_log and busy_wait_for_debug_log.
+        self.debug_log = DebugLogFollower(lambda: self.debug_log_path)
+        # Seconds from starting bitcoind until its RPC interface was ready, for every start.
+        self.start_time = None
+        self.startup_times = []
+        # Seconds from requesting bitcoind to stop until it exited, for every stop.
+        self.stop_time = None
+        self.shutdown_times = []
 
         self.mocktime = None
 
@@ -248,6 +261,7 @@ class TestNode():
         if env is not None:
             subp_env.update(env)
 
+        self.start_time = time.time()
         self.process = subprocess.Popen(self.args + extra_args, env=subp_env, stdout=stdout, stderr=stderr, cwd=cwd, **kwargs)
 
         self.running = True
@@ -256,11 +270,25 @@ class TestNode():
         if self.start_perf:
             self._start_perf()
 
+    def _wait_for_startup_progress(self, timeout):
+        """Wait until bitcoind may have made progress starting up, or for at most timeout seconds.
+
+        On Linux this returns as soon as a file in the chain directory (such as the cookie file
+        or debug.log) is written."""
+        inotify = get_inotify()
+        if inotify is not None and inotify.watch(str(self.chain_path)):
+            inotify.wait(timeout)
+        else:
+            time.sleep(timeout)
+
     def wait_for_rpc_connection(self, *, wait_for_import=True):
         """Sets up an RPC connection to the bitcoind process. Returns False if unable to connect."""
-        # Poll at a rate of four times per second
-        poll_per_s = 4
-        for _ in range(poll_per_s * self.rpc_timeout):
+        time_end = time.time() + self.rpc_timeout
+        # Attempts are retried with an exponential backoff, or earlier once bitcoind wrote to
+        # its chain directory.
+        delay = WAIT_MIN_DELAY
+        rpc = None
+        while time.time() < time_end:
             if self.process.poll() is not None:
                 # Attach abrupt shutdown error/s to the exception message
                 self.stderr.seek(0)
@@ -270,42 +298,51 @@ class TestNode():
                 raise FailedToStartError(self._node_msg(
                     f'bitcoind exited with status {self.process.returncode} during initialization. {str_error}'))
             try:
-                rpc = get_rpc_proxy(
-                    rpc_url(self.datadir_path, self.index, self.chain, self.rpchost),
-                    self.index,
-                    timeout=self.rpc_timeout // 2,  # Shorter timeout to allow for one retry in case of ETIMEDOUT
-                    coveragedir=self.coverage_dir,
-                )
-                rpc.getblockcount()
+                if rpc is None:
+                    # The proxy is reused for all attempts once the credentials are known.
+                    rpc = get_rpc_proxy(
+                        rpc_url(self.datadir_path, self.index, self.chain, self.rpchost),
+                        self.index,
+                        timeout=self.rpc_timeout // 2,  # Shorter timeout to allow for one retry in case of ETIMEDOUT
+                        coveragedir=self.coverage_dir,
+                    )
                 # If the call to getblockcount() succeeds then the RPC connection is up
-                if self.version_is_at_least(190000) and wait_for_import:
-                    # getmempoolinfo.loaded is available since commit
-                    # bb8ae2c (version 0.19.0)
-                    self.wait_until(lambda: rpc.getmempoolinfo()['loaded'])
-                    # Wait for the node to finish reindex, block import, and
-                    # loading the mempool. Usually importing happens fast or
-                    # even "immediate" when the node is started. However, there
-                    # is no guarantee and sometimes ImportBlocks might finish
-                    # later. This is going to cause intermittent test failures,
-                    # because generally the tests assume the node is fully
-                    # ready after being started.
-                    #
-                    # For example, the node will reject block messages from p2p
-                    # when it is still importing with the error "Unexpected
-                    # block message received"
-                    #
-                    # The wait is done here to make tests as robust as possible
-                    # and prevent racy tests and intermittent failures as much
-                    # as possible. Some tests might not need this, but the
-                    # overhead is trivial, and the added guarantees are worth
-                    # the minimal performance cost.
-                self.log.debug("RPC successfully started")
-                if self.use_cli:
+                with rpc.batch() as batch:
+                    blockcount = batch.getblockcount()
+                    if self.version_is_at_least(190000) and wait_for_import:
+                        # getmempoolinfo.loaded is available since commit
+                        # bb8ae2c (version 0.19.0)
+                        mempoolinfo = batch.getmempoolinfo()
+                    else:
+                        mempoolinfo = None
+                blockcount.result()
+                # Wait for the node to finish reindex, block import, and
+                # loading the mempool. Usually importing happens fast or
+                # even "immediate" when the node is started. However, there
+                # is no guarantee and sometimes ImportBlocks might finish
+                # later. This is going to cause intermittent test failures,
+                # because generally the tests assume the node is fully
+                # ready after being started.
+                #
+                # For example, the node will reject block messages from p2p
+                # when it is still importing with the error "Unexpected
+                # block message received"
+                #
+                # The wait is done here to make tests as robust as possible
+                # and prevent racy tests and intermittent failures as much
+                # as possible. Some tests might not need this, but the
+                # overhead is trivial, and the added guarantees are worth
+                # the minimal performance cost.
+                if mempoolinfo is None or mempoolinfo.result()['loaded']:
+                    startup_time = time.time() - self.start_time
+                    self.startup_times.append(startup_time)
+                    self.log.debug("RPC successfully started after {:.3f} s".format(startup_time))
+                    if self.use_cli:
+                        return
+                    self.rpc = rpc
+                    self.rpc_connected = True
+                    self.url = self.rpc.rpc_url
                     return
-                self.rpc = rpc
-                self.rpc_connected = True
-                self.url = self.rpc.rpc_url
-                return
             except JSONRPCException as e:  # Initialization phase
                 # -28 RPC in warmup
                 # -342 Service unavailable, RPC server started but is shutting down due to error
@@ -325,22 +362,24 @@ class TestNode():
             except ValueError as e:  # cookie file not found and no rpcuser or rpcpassword; bitcoind is still starting
                 if "No RPC credentials" not in str(e):
                     raise
-            time.sleep(1.0 / poll_per_s)
+            self._wait_for_startup_progress(delay)
+            delay = min(delay * 2, STARTUP_MAX_DELAY)
         self._raise_assertion_error("Unable to connect to bitcoind after {}s".format(self.rpc_timeout))
 
     def wait_for_cookie_credentials(self):
         """Ensures auth cookie credentials can be read, e.g. for testing CLI with -rpcwait before RPC connection is up."""
         self.log.debug("Waiting for cookie credentials")
-        # Poll at a rate of four times per second.
-        poll_per_s = 4
-        for _ in range(poll_per_s * self.rpc_timeout):
+        time_end = time.time() + self.rpc_timeout
+        delay = WAIT_MIN_DELAY
+        while time.time() < time_end:
             try:
                 get_auth_cookie(self.datadir_path, self.chain)
                 self.log.debug("Cookie credentials successfully retrieved")
                 return
             except ValueError:  # cookie file not found and no rpcuser or rpcpassword; bitcoind is still starting
                 pass            # so we continue polling until RPC credentials are retrieved
-            time.sleep(1.0 / poll_per_s)
+            self._wait_for_startup_progress(delay)
+            delay = min(delay * 2, STARTUP_MAX_DELAY)
         self._raise_assertion_error("Unable to retrieve cookie credentials after {}s".format(self.rpc_timeout))
 
     def generate(self, nblocks, maxtries=1000000, **kwargs):
@@ -384,6 +423,7 @@ class TestNode():
         if not self.running:
             return
         self.log.debug("Stopping node")
+        self.stop_time = time.time()
         try:
             # Do not use wait argument when testing older nodes, e.g. in wallet_backwards_compatibility.py
             if self.version_is_at_least(180000):
@@ -430,7 +470,13 @@ class TestNode():
         self.process = None
         self.rpc_connected = False
         self.rpc = None
-        self.log.debug("Node stopped")
+        if self.stop_time is not None:
+            shutdown_time = time.time() - self.stop_time
+            self.shutdown_times.append(shutdown_time)
+            self.stop_time = None
+            self.log.debug("Node stopped after {:.3f} s".format(shutdown_time))
+        else:
+            self.log.debug("Node stopped")
         return True
 
     def wait_until_stopped(self, *, timeout=BITCOIND_PROC_WAIT_TIMEOUT, expect_error=False, **kwargs):
@@ -474,6 +520,10 @@ class TestNode():
             dl.seek(0, 2)
             return dl.tell()
 
+    def _print_debug_log(self, start):
+        log = self.debug_log.data(start).decode("utf8", errors="replace")
+        return " - " + "\n - ".join(log.splitlines())
+
     @contextlib.contextmanager
     def assert_debug_log(self, expected_msgs, unexpected_msgs=None, timeout=2):
         if unexpected_msgs is None:
@@ -481,65 +531,42 @@ class TestNode():
         assert_equal(type(expected_msgs), list)
         assert_equal(type(unexpected_msgs), list)
 
-        time_end = time.time() + timeout * self.timeout_factor
-        prev_size = self.debug_log_size(encoding="utf-8")  # Must use same encoding that is used to read() below
-
-        yield
+        prev_size = self.debug_log.mark()
+        try:
+            yield
 
-        while True:
-            found = True
-            with open(self.debug_log_path, encoding="utf-8", errors="replace") as dl:
-                dl.seek(prev_size)
-                log = dl.read()
-            print_log = " - " + "\n - ".join(log.splitlines())
-            for unexpected_msg in unexpected_msgs:
-                if re.search(re.escape(unexpected_msg), log, flags=re.MULTILINE):
-                    self._raise_assertion_error('Unexpected message "{}" partially matches log:\n\n{}\n\n'.format(unexpected_msg, print_log))
-            for expected_msg in expected_msgs:
-                if re.search(re.escape(expected_msg), log, flags=re.MULTILINE) is None:
-                    found = False
-            if found:
-                return
-            if time.time() >= time_end:
-                break
-            time.sleep(0.05)
-        self._raise_assertion_error('Expected messages "{}" does not partially match log:\n\n{}\n\n'.format(str(expected_msgs), print_log))
+            try:
+                unexpected_msg = self.debug_log.wait_for(
+                    prev_size,
+                    [msg.encode("utf8") for msg in expected_msgs],
+                    [msg.encode("utf8") for msg in unexpected_msgs],
+                    timeout * self.timeout_factor)
+            except TimeoutError:
+                self._raise_assertion_error('Expected messages "{}" does not partially match log:\n\n{}\n\n'.format(str(expected_msgs), self._print_debug_log(prev_size)))
+            if unexpected_msg is not None:
+                self._raise_assertion_error('Unexpected message "{}" partially matches log:\n\n{}\n\n'.format(unexpected_msg.decode("utf8"), self._print_debug_log(prev_size)))
+        finally:
+            self.debug_log.release(prev_size)
 
     @contextlib.contextmanager
     def busy_wait_for_debug_log(self, expected_msgs, timeout=60):
         """
         Block until we see a particular debug log message fragment or until we exceed the timeout.
-        Return:
-            the number of log lines we encountered when matching
+        The log is followed with inotify where available, so the message fragment is detected
+        as fast as possible without spinning.
         """
-        time_end = time.time() + timeout * self.timeout_factor
-        prev_size = self.debug_log_size(mode="rb")  # Must use same mode that is used to read() below
-
-        yield
-
-        while True:
-            found = True
-            with open(self.debug_log_path, "rb") as dl:
-                dl.seek(prev_size)
-                log = dl.read()
-
-            for expected_msg in expected_msgs:
-                if expected_msg not in log:
-                    found = False
-
-            if found:
-                return
-
-            if time.time() >= time_end:
-                print_log = " - " + "\n - ".join(log.decode("utf8", errors="replace").splitlines())
-                break
-
-            # No sleep here because we want to detect the message fragment as fast as
-            # possible.
+        prev_size = self.debug_log.mark()
+        try:
+            yield
 
-        self._raise_assertion_error(
-            'Expected messages "{}" does not partially match log:\n\n{}\n\n'.format(
-                str(expected_msgs), print_log))
+            try:
+                self.debug_log.wait_for(prev_size, expected_msgs, [], timeout * self.timeout_factor)
+            except TimeoutError:
+                self._raise_assertion_error(
+                    'Expected messages "{}" does not partially match log:\n\n{}\n\n'.format(
+                        str(expected_msgs), self._print_debug_log(prev_size)))
+        finally:
+            self.debug_log.release(prev_size)
 
     @contextlib.contextmanager
     def wait_for_new_peer(self, timeout=5):
@@ -871,7 +898,9 @@ class TestNodeCLI():
     def __getattr__(self, command):
         return TestNodeCLIAttr(self, command)
 
-    def batch(self, requests):
+    def batch(self, requests=None):
+        if requests is None:
+            return RPCBatch(self)
         results = []
         for request in requests:
             try:
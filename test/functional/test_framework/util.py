@@ -5,6 +5,7 @@
 """Helpful routines for regression testing."""
 
 from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal, ROUND_DOWN
 from subprocess import CalledProcessError
 import hashlib
@@ -16,6 +17,8 @@ import pathlib
 import platform
 import random
 import re
+import shutil
+import threading
 import time
 
 from . import coverage
@@ -265,9 +268,37 @@ def satoshi_round(amount):
     return Decimal(amount).quantize(Decimal('0.00000001'), rounding=ROUND_DOWN)
 
 
+# Delays between two checks of a wait_until() predicate: the first check is repeated after
+# WAIT_MIN_DELAY seconds, and the delay doubles up to WAIT_MAX_DELAY seconds.
+WAIT_MIN_DELAY = 0.001
+WAIT_MAX_DELAY = 0.05
+
+
+class WaitStats:
+    """Time spent in wait_until_helper_internal() by this process."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+
+    def record(self, elapsed):
+        with self._lock:
+            self.count += 1
+            self.total += elapsed
+            self.longest = max(self.longest, elapsed)
+
+
+wait_stats = WaitStats()
+
+
 def wait_until_helper_internal(predicate, *, attempts=float('inf'), timeout=float('inf'), lock=None, timeout_factor=1.0):
     """Sleep until the predicate resolves to be True.
 
+    The predicate is checked with an exponential backoff from WAIT_MIN_DELAY to
+    WAIT_MAX_DELAY seconds. If lock is a threading.Condition, the predicate is checked
+    whenever the condition is notified instead, and at least every WAIT_MAX_DELAY seconds.
+
     Warning: Note that this method is not recommended to be used in tests as it is
     not aware of the context of the test framework. Using the `wait_until()` members
     from `BitcoinTestFramework` or `P2PInterface` class ensures the timeout is
@@ -278,18 +309,28 @@ def wait_until_helper_internal(predicate, *, attempts=float('inf'), timeout=floa
         timeout = 60
     timeout = timeout * timeout_factor
     attempt = 0
-    time_end = time.time() + timeout
+    time_start = time.time()
+    time_end = time_start + timeout
+    delay = WAIT_MIN_DELAY
 
-    while attempt < attempts and time.time() < time_end:
-        if lock:
-            with lock:
+    try:
+        while attempt < attempts and time.time() < time_end:
+            if lock:
+                with lock:
+                    if predicate():
+                        return
+                    if isinstance(lock, threading.Condition):
+                        attempt += 1
+                        lock.wait(max(0, min(WAIT_MAX_DELAY, time_end - time.time())))
+                        continue
+            else:
                 if predicate():
                     return
-        else:
-            if predicate():
-                return
-        attempt += 1
-        time.sleep(0.05)
+            attempt += 1
+            time.sleep(delay)
+            delay = min(delay * 2, WAIT_MAX_DELAY)
+    finally:
+        wait_stats.record(time.time() - time_start)
 
     # Print the cause of the timeout
     predicate_source = "''''\n" + inspect.getsource(predicate) + "'''"
@@ -438,6 +479,36 @@ def get_datadir_path(dirname, n):
     return pathlib.Path(dirname) / f"node{n}"
 
 
+# ioctl to create a copy-on-write clone of a file on Linux (btrfs, XFS, ...), from linux/fs.h
+FICLONE = 0x40049409
+_reflink_supported = platform.system() == "Linux"
+
+
+def _clone_file(src, dst):
+    global _reflink_supported
+    if _reflink_supported:
+        import fcntl
+        try:
+            with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+                fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+            shutil.copystat(src, dst)
+            return dst
+        except OSError:
+            # Not supported by the filesystem, or across filesystems. Don't try again.
+            _reflink_supported = False
+    return shutil.copy2(src, dst)
+
+
+def clone_tree(src, dst):
+    """Copy the directory tree src to dst, using copy-on-write clones of the files where supported.
+
+    A clone shares the data of its source file until either of them is modified, so it takes
+    no time to create, regardless of the size of the file. Other filesystems fall back to a
+    regular copy. Hard links are not used, because bitcoind and some tests modify files (such
+    as blk*.dat and *.ldb) in place."""
+    return shutil.copytree(src, dst, copy_function=_clone_file)
+
+
 def get_temp_default_datadir(temp_dir: pathlib.Path) -> tuple[dict, pathlib.Path]:
     """Return os-specific environment variables that can be set to make the
     GetDefaultDataDir() function return a datadir path under the provided
@@ -508,6 +579,19 @@ def check_node_connections(*, node, num_in, num_out):
     assert_equal(info["connections_out"], num_out)
 
 
+def map_concurrently(fn, nodes):
+    """Call fn(node) for every node, each in its own thread, and return the results in order.
+
+    This overlaps the RPC round trips (and long-polls) to different nodes. If any of the calls
+    raises, the exception of the first such node is re-raised once all calls returned."""
+    nodes = list(nodes)
+    if len(nodes) <= 1:
+        return [fn(node) for node in nodes]
+    with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        futures = [executor.submit(fn, node) for node in nodes]
+    return [future.result() for future in futures]
+
+
 # Transaction/Block functions
 #############################
 
@@ -526,18 +610,16 @@ def gen_return_txouts():
 # Create a spend of each passed-in utxo, splicing in "txouts" to each raw
 # transaction to make it large.  See gen_return_txouts() above.
 def create_lots_of_big_transactions(mini_wallet, node, fee, tx_batch_size, txouts, utxos=None):
-    txids = []
-    use_internal_utxos = utxos is None
-    for _ in range(tx_batch_size):
-        tx = mini_wallet.create_self_transfer(
-            utxo_to_spend=None if use_internal_utxos else utxos.pop(),
-            fee=fee,
-        )["tx"]
-        tx.vout.extend(txouts)
-        res = node.testmempoolaccept([tx.serialize().hex()])[0]
-        assert_equal(res['fees']['base'], fee)
-        txids.append(node.sendrawtransaction(tx.serialize().hex()))
-    return txids
+    txs = mini_wallet.create_self_transfers(
+        count=tx_batch_size,
+        utxos_to_spend=None if utxos is None else [utxos.pop() for _ in range(tx_batch_size)],
+        fee=fee,
+        txouts=txouts,
+    )
+    # All txs are built the same way, so let the node check the fee of one of them
+    res = node.testmempoolaccept([txs[0]['hex']])[0]
+    assert_equal(res['fees']['base'], fee)
+    return mini_wallet.send_txs(from_node=node, txs=txs)
 
 
 def mine_large_block(test_framework, mini_wallet, node):
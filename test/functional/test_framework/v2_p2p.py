@@ -261,6 +261,9 @@ class EncryptedP2PState:
     def v2_receive_packet(self, response, aad=b''):
         """Decrypt a BIP324 packet
 
+        response can be any bytes-like object; slicing a memoryview avoids copying the
+        data that follows the packet.
+
         Returns:
         1. int - number of bytes consumed (or -1 if error)
         2. bytes - contents of decrypted non-decoy packet if any (or None otherwise)
@@ -273,7 +276,7 @@ class EncryptedP2PState:
         response = response[LENGTH_FIELD_LEN:]
         if len(response) < HEADER_LEN + self.contents_len + CHACHA20POLY1305_EXPANSION:
             return 0, None
-        aead_ciphertext = response[:HEADER_LEN + self.contents_len + CHACHA20POLY1305_EXPANSION]
+        aead_ciphertext = bytes(response[:HEADER_LEN + self.contents_len + CHACHA20POLY1305_EXPANSION])
         plaintext = self.peer['recv_P'].decrypt(aad, aead_ciphertext)
         if plaintext is None:
             return -1, None  # disconnect
@@ -7,7 +7,12 @@
 from copy import deepcopy
 from decimal import Decimal
 from enum import Enum
+import hashlib
+import heapq
+import logging
 import math
+import time
+import unittest
 from typing import (
     Any,
     Optional,
@@ -35,6 +40,10 @@ from test_framework.messages import (
     CTxOut,
     hash256,
     ser_compact_size,
+    ser_vector,
+    sha256,
+    tx_from_hex,
+    uint256_from_str,
     WITNESS_SCALE_FACTOR,
 )
 from test_framework.script import (
@@ -55,11 +64,16 @@ from test_framework.script_util import (
 from test_framework.util import (
     assert_equal,
     assert_greater_than_or_equal,
+    gen_return_txouts,
     get_fee,
 )
 from test_framework.wallet_util import generate_keypair
 
+logger = logging.getLogger("TestFramework.miniwallet")
+
 DEFAULT_FEE = Decimal("0.0001")
+# Number of mempool transactions fetched per batch request in rescan_utxos()
+RESCAN_BATCH_SIZE = 100
 
 class MiniWalletMode(Enum):
     """Determines the transaction type the MiniWallet is creating and spending.
@@ -90,7 +104,8 @@ class MiniWalletMode(Enum):
 class MiniWallet:
     def __init__(self, test_node, *, mode=MiniWalletMode.ADDRESS_OP_TRUE, tag_name=None):
         self._test_node = test_node
-        self._utxos = []
+        self._tip_height = None
+        self._reset_utxos()
         self._mode = mode
 
         assert isinstance(mode, MiniWalletMode)
@@ -119,6 +134,82 @@ class MiniWallet:
     def _create_utxo(self, *, txid, vout, value, height, coinbase, confirmations):
         return {"txid": txid, "vout": vout, "value": value, "height": height, "coinbase": coinbase, "confirmations": confirmations}
 
+    def _reset_utxos(self):
+        """Drop all utxos from the internal store.
+
+        The store is keyed by outpoint, with a txid index for lookups by txid.
+        Spendable utxos are additionally kept in two heaps (confirmed and
+        unconfirmed) ordered by selection preference, and immature coinbase
+        utxos in a heap ordered by height until the tip makes them mature.
+        Heap entries are removed lazily: an entry whose sequence number no
+        longer matches the one stored for its outpoint is stale.
+        """
+        self._utxos = {}  # (txid, vout) -> utxo
+        self._utxo_seq = {}  # (txid, vout) -> insertion sequence number
+        self._txid_vouts = {}  # txid -> list of vouts
+        self._confirmed_heap = []  # (-value, height, -seq, outpoint)
+        self._unconfirmed_heap = []  # (-value, height, -seq, outpoint)
+        self._immature_heap = []  # (height, seq, outpoint)
+        self._next_seq = 0
+
+    def _is_mature(self, utxo):
+        return not utxo['coinbase'] or COINBASE_MATURITY - 1 <= self._tip_height - utxo['height']
+
+    def _utxo_order(self, utxo):
+        """Sort key putting the preferred utxo (largest value, lowest height, most recently added) last"""
+        return (utxo['value'], -utxo['height'], self._utxo_seq[(utxo['txid'], utxo['vout'])])
+
+    def _add_utxo(self, utxo):
+        outpoint = (utxo['txid'], utxo['vout'])
+        if outpoint in self._utxos:
+            self._remove_utxo(self._utxos[outpoint])
+        seq = self._next_seq
+        self._next_seq += 1
+        self._utxos[outpoint] = utxo
+        self._utxo_seq[outpoint] = seq
+        self._txid_vouts.setdefault(utxo['txid'], []).append(utxo['vout'])
+        if not self._is_mature(utxo):
+            heapq.heappush(self._immature_heap, (utxo['height'], seq, outpoint))
+        else:
+            self._push_spendable(utxo, seq, outpoint)
+
+    def _push_spendable(self, utxo, seq, outpoint):
+        heap = self._confirmed_heap if utxo['confirmations'] > 0 else self._unconfirmed_heap
+        heapq.heappush(heap, (-utxo['value'], utxo['height'], -seq, outpoint))
+
+    def _remove_utxo(self, utxo):
+        outpoint = (utxo['txid'], utxo['vout'])
+        del self._utxos[outpoint]
+        del self._utxo_seq[outpoint]
+        vouts = self._txid_vouts[utxo['txid']]
+        vouts.remove(utxo['vout'])
+        if not vouts:
+            del self._txid_vouts[utxo['txid']]
+
+    def _mature_coinbases(self):
+        """Move coinbase utxos that are mature at the cached tip height to the confirmed heap"""
+        heap = self._immature_heap
+        while heap and COINBASE_MATURITY - 1 <= self._tip_height - heap[0][0]:
+            _, seq, outpoint = heapq.heappop(heap)
+            if self._utxo_seq.get(outpoint) == seq:
+                self._push_spendable(self._utxos[outpoint], seq, outpoint)
+
+    def _peek(self, heap):
+        """Return the top entry of a spendable heap, dropping stale entries"""
+        while heap and self._utxo_seq.get(heap[0][3]) != -heap[0][2]:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def _select_largest(self, confirmed_only):
+        self._mature_coinbases()
+        entries = [self._peek(self._confirmed_heap)]
+        if not confirmed_only:
+            entries.append(self._peek(self._unconfirmed_heap))
+        entries = [e for e in entries if e is not None]
+        if not entries:
+            raise StopIteration
+        return self._utxos[min(entries)[3]]
+
     def _bulk_tx(self, tx, target_weight):
         """Pad a transaction with extra outputs until it reaches a target weight (or higher).
         returns the tx
@@ -135,15 +226,16 @@ class MiniWallet:
         assert_greater_than_or_equal(target_weight + 3, tx.get_weight())
 
     def get_balance(self):
-        return sum(u['value'] for u in self._utxos)
+        return sum(u['value'] for u in self._utxos.values())
 
     def rescan_utxos(self, *, include_mempool=True):
         """Drop all utxos and rescan the utxo set"""
-        self._utxos = []
+        self._reset_utxos()
         res = self._test_node.scantxoutset(action="start", scanobjects=[self.get_descriptor()])
         assert_equal(True, res['success'])
+        self._tip_height = res['height']
         for utxo in res['unspents']:
-            self._utxos.append(
+            self._add_utxo(
                 self._create_utxo(txid=utxo["txid"],
                                   vout=utxo["vout"],
                                   value=utxo["amount"],
@@ -154,23 +246,44 @@ class MiniWallet:
             mempool = self._test_node.getrawmempool(verbose=True)
             # Sort tx by ancestor count. See BlockAssembler::SortForBlock in src/node/miner.cpp
             sorted_mempool = sorted(mempool.items(), key=lambda item: (item[1]["ancestorcount"], int(item[0], 16)))
-            for txid, _ in sorted_mempool:
-                self.scan_tx(self._test_node.getrawtransaction(txid=txid, verbose=True))
+            txids = [txid for txid, _ in sorted_mempool]
+            for i in range(0, len(txids), RESCAN_BATCH_SIZE):
+                with self._test_node.batch() as batch:
+                    raw_txs = [batch.getrawtransaction(txid=txid) for txid in txids[i:i + RESCAN_BATCH_SIZE]]
+                for raw_tx in raw_txs:
+                    self.scan_tx(raw_tx.result())
 
     def scan_tx(self, tx):
-        """Scan the tx and adjust the internal list of owned utxos"""
-        for spent in tx["vin"]:
+        """Scan the tx and adjust the internal list of owned utxos
+
+        tx can be a decoded transaction (e.g. as returned by decoderawtransaction),
+        a CTransaction or a raw transaction hex string, which is decoded locally.
+        """
+        if isinstance(tx, str):
+            tx = tx_from_hex(tx)
+        if isinstance(tx, CTransaction):
+            self._scan_ctx(tx, tx.rehash())
+            return
+        spent = [(txin["txid"], txin["vout"]) for txin in tx["vin"]]
+        outputs = [(out["n"], out["value"]) for out in tx["vout"] if out["scriptPubKey"]["hex"] == self._scriptPubKey.hex()]
+        self._scan(tx["txid"], spent, outputs)
+
+    def _scan_ctx(self, tx, txid):
+        spent = [(f"{txin.prevout.hash:064x}", txin.prevout.n) for txin in tx.vin]
+        outputs = [(n, Decimal(out.nValue) / COIN) for n, out in enumerate(tx.vout) if out.scriptPubKey == self._scriptPubKey]
+        self._scan(txid, spent, outputs)
+
+    def _scan(self, txid, spent, outputs):
+        for outpoint in spent:
             # Mark spent. This may happen when the caller has ownership of a
             # utxo that remained in this wallet. For example, by passing
             # mark_as_spent=False to get_utxo or by using an utxo returned by a
             # create_self_transfer* call.
-            try:
-                self.get_utxo(txid=spent["txid"], vout=spent["vout"])
-            except StopIteration:
-                pass
-        for out in tx['vout']:
-            if out['scriptPubKey']['hex'] == self._scriptPubKey.hex():
-                self._utxos.append(self._create_utxo(txid=tx["txid"], vout=out["n"], value=out["value"], height=0, coinbase=False, confirmations=0))
+            utxo = self._utxos.get(outpoint)
+            if utxo is not None:
+                self._remove_utxo(utxo)
+        for n, value in outputs:
+            self._add_utxo(self._create_utxo(txid=txid, vout=n, value=value, height=0, coinbase=False, confirmations=0))
 
     def scan_txs(self, txs):
         for tx in txs:
@@ -232,36 +345,53 @@ class MiniWallet:
 
         Args:
         txid: get the first utxo we find from a specific transaction
+
+        Coinbase maturity is evaluated against the tip height cached by the
+        last rescan_utxos() (and thus generate()), so no RPC is issued unless
+        no mature utxo is left while immature coinbase utxos are pending.
         """
-        self._utxos = sorted(self._utxos, key=lambda k: (k['value'], -k['height']))  # Put the largest utxo last
-        blocks_height = self._test_node.getblockchaininfo()['blocks']
-        mature_coins = list(filter(lambda utxo: not utxo['coinbase'] or COINBASE_MATURITY - 1 <= blocks_height - utxo['height'], self._utxos))
         if txid:
-            utxo_filter: Any = filter(lambda utxo: txid == utxo['txid'], self._utxos)
+            if vout is not None:
+                candidates = [self._utxos[(txid, vout)]] if (txid, vout) in self._utxos else []
+            else:
+                candidates = [self._utxos[(txid, n)] for n in self._txid_vouts.get(txid, [])]
+            if confirmed_only:
+                candidates = [utxo for utxo in candidates if utxo['confirmations'] > 0]
+            if not candidates:
+                raise StopIteration
+            utxo = min(candidates, key=self._utxo_order)  # The smallest utxo of the tx
+        elif vout is not None:
+            candidates = [utxo for utxo in self._utxos.values() if utxo['vout'] == vout and self._is_mature(utxo)]
+            if confirmed_only:
+                candidates = [utxo for utxo in candidates if utxo['confirmations'] > 0]
+            if not candidates:
+                raise StopIteration
+            utxo = max(candidates, key=self._utxo_order)
         else:
-            utxo_filter = reversed(mature_coins)  # By default the largest utxo
-        if vout is not None:
-            utxo_filter = filter(lambda utxo: vout == utxo['vout'], utxo_filter)
-        if confirmed_only:
-            utxo_filter = filter(lambda utxo: utxo['confirmations'] > 0, utxo_filter)
-        index = self._utxos.index(next(utxo_filter))
+            try:
+                utxo = self._select_largest(confirmed_only)  # By default the largest utxo
+            except StopIteration:
+                if not self._immature_heap:
+                    raise
+                # Blocks may have been mined without rescanning, so refresh the tip
+                self._tip_height = self._test_node.getblockcount()
+                utxo = self._select_largest(confirmed_only)
         if mark_as_spent:
-            return self._utxos.pop(index)
-        else:
-            return self._utxos[index]
+            self._remove_utxo(utxo)
+        return utxo
 
     def get_utxos(self, *, include_immature_coinbase=False, mark_as_spent=True, confirmed_only=False):
         """Returns the list of all utxos and optionally mark them as spent"""
+        utxo_filter: Any = self._utxos.values()
         if not include_immature_coinbase:
-            blocks_height = self._test_node.getblockchaininfo()['blocks']
-            utxo_filter = filter(lambda utxo: not utxo['coinbase'] or COINBASE_MATURITY - 1 <= blocks_height - utxo['height'], self._utxos)
-        else:
-            utxo_filter = self._utxos
+            if self._immature_heap:
+                self._tip_height = self._test_node.getblockcount()
+            utxo_filter = filter(self._is_mature, utxo_filter)
         if confirmed_only:
             utxo_filter = filter(lambda utxo: utxo['confirmations'] > 0, utxo_filter)
         utxos = deepcopy(list(utxo_filter))
         if mark_as_spent:
-            self._utxos = []
+            self._reset_utxos()
         return utxos
 
     def send_self_transfer(self, *, from_node, **kwargs):
@@ -373,12 +503,7 @@ class MiniWallet:
         assert fee_rate >= 0
         assert fee >= 0
         # calculate fee
-        if self._mode in (MiniWalletMode.RAW_OP_TRUE, MiniWalletMode.ADDRESS_OP_TRUE):
-            vsize = Decimal(104)  # anyone-can-spend
-        elif self._mode == MiniWalletMode.RAW_P2PK:
-            vsize = Decimal(168)  # P2PK (73 bytes scriptSig + 35 bytes scriptPubKey + 60 bytes other)
-        else:
-            assert False
+        vsize = self._self_transfer_vsize()
         if target_weight and not fee:  # respect fee_rate if target weight is passed
             # the actual weight might be off by 3 WUs, so calculate based on that (see self._bulk_tx)
             max_actual_weight = target_weight + 3
@@ -398,9 +523,129 @@ class MiniWallet:
 
         return tx
 
+    def _self_transfer_vsize(self):
+        """Return the vsize of a 1-in-1-out self-transfer"""
+        if self._mode in (MiniWalletMode.RAW_OP_TRUE, MiniWalletMode.ADDRESS_OP_TRUE):
+            return Decimal(104)  # anyone-can-spend
+        elif self._mode == MiniWalletMode.RAW_P2PK:
+            return Decimal(168)  # P2PK (73 bytes scriptSig + 35 bytes scriptPubKey + 60 bytes other)
+        else:
+            assert False
+
+    def create_self_transfers(self, *, count=None, utxos_to_spend=None, chained=False, fee_rate=Decimal("0.003"), fee=Decimal("0"), txouts=None):
+        """Create many 1-in-1-out self-transfers in one pass and return a list of objects (see create_self_transfer).
+
+        Without chained, the txs are independent and each one spends the next of
+        utxos_to_spend, or a utxo taken from the wallet if not given. With chained,
+        each tx spends the output of the previous one, starting with the first of
+        utxos_to_spend (or a utxo from the wallet). count defaults to the number
+        of utxos_to_spend.
+
+        txouts (e.g. from gen_return_txouts()) are appended to every tx to make it
+        large, and are included in the size fee_rate is applied to. Their
+        serialization is shared by all txs, and the input script or witness is
+        only built once unless txs have to be signed (RAW_P2PK mode).
+        """
+        assert fee_rate >= 0
+        assert fee >= 0
+        utxos_to_spend = list(utxos_to_spend or [])
+        if count is None:
+            count = len(utxos_to_spend)
+        txouts = list(txouts or [])
+        padding = b"".join(txout.serialize() for txout in txouts)
+        padding_hex = padding.hex()
+        num_outputs = ser_compact_size(1 + len(txouts))
+        vsize = self._self_transfer_vsize() + len(padding) + len(num_outputs) - 1
+
+        template = None
+        if self._mode != MiniWalletMode.RAW_P2PK:
+            template = CTransaction()
+            template.vin = [CTxIn()]
+            self.sign_tx(template)
+
+        start = time.time()
+        txs = []
+        for i in range(count):
+            if chained and txs:
+                utxo_to_spend = txs[-1]["new_utxo"]
+            elif i < len(utxos_to_spend):
+                utxo_to_spend = utxos_to_spend[i]
+            else:
+                assert not utxos_to_spend, "not enough utxos_to_spend"
+                utxo_to_spend = self.get_utxo()
+            input_value = int(COIN * utxo_to_spend["value"])
+            amount = int(COIN * (utxo_to_spend["value"] - (fee or (fee_rate * vsize / 1000))))
+            assert amount > 0
+
+            tx = CTransaction()
+            tx.vin = [CTxIn(COutPoint(int(utxo_to_spend['txid'], 16), utxo_to_spend['vout']), nSequence=0)]
+            tx.vout = [CTxOut(amount, bytearray(self._scriptPubKey))] + txouts
+            if template is None:
+                self.sign_tx(tx)
+            else:
+                tx.vin[0].scriptSig = template.vin[0].scriptSig
+                tx.wit.vtxinwit = list(template.wit.vtxinwit)
+
+            # Serialize the parts around the shared txouts only
+            version = tx.version.to_bytes(4, "little")
+            vin = ser_vector(tx.vin)
+            vout = num_outputs + tx.vout[0].serialize()
+            locktime = tx.nLockTime.to_bytes(4, "little")
+            txid = _hash256_parts(version, vin, vout, padding, locktime)
+            tx.sha256 = uint256_from_str(txid)
+            tx.hash = txid[::-1].hex()
+            if tx.wit.is_null():
+                wtxid = txid
+                tx_hex = "".join((version.hex(), vin.hex(), vout.hex(), padding_hex, locktime.hex()))
+            else:
+                head = b"".join((version, b"\x00\x01", vin, vout))
+                tail = tx.wit.serialize() + locktime
+                wtxid = _hash256_parts(head, padding, tail)
+                tx_hex = "".join((head.hex(), padding_hex, tail.hex()))
+            txs.append({
+                "new_utxo": self._create_utxo(
+                    txid=tx.hash,
+                    vout=0,
+                    value=Decimal(amount) / COIN,
+                    height=0,
+                    coinbase=False,
+                    confirmations=0,
+                ),
+                "fee": Decimal(input_value - amount) / COIN,
+                "txid": tx.hash,
+                "wtxid": wtxid[::-1].hex(),
+                "hex": tx_hex,
+                "tx": tx,
+            })
+        elapsed = time.time() - start
+        logger.debug(f"Created {count} transactions in {elapsed:.3f}s ({count / max(elapsed, 1e-6):.0f} tx/s)")
+        return txs
+
+    def send_txs(self, *, from_node, txs, maxfeerate=0, package=False):
+        """Broadcast txs (objects as returned by the create_self_transfer* calls) and scan them.
+
+        The txs are sent as one batch of sendrawtransaction calls, which the node
+        processes in order, or with submitpackage if package is set. The txs must
+        not have been modified after their creation. Returns the list of txids.
+        """
+        start = time.time()
+        if package:
+            res = from_node.submitpackage(package=[tx["hex"] for tx in txs], maxfeerate=maxfeerate)
+            assert_equal(res["package_msg"], "success")
+        else:
+            with from_node.batch() as batch:
+                calls = [batch.sendrawtransaction(hexstring=tx["hex"], maxfeerate=maxfeerate) for tx in txs]
+            for call, tx in zip(calls, txs):
+                assert_equal(call.result(), tx["txid"])
+        elapsed = time.time() - start
+        logger.debug(f"Sent {len(txs)} transactions in {elapsed:.3f}s ({len(txs) / max(elapsed, 1e-6):.0f} tx/s)")
+        for tx in txs:
+            self._scan_ctx(tx["tx"], tx["txid"])
+        return [tx["txid"] for tx in txs]
+
     def sendrawtransaction(self, *, from_node, tx_hex, maxfeerate=0, **kwargs):
         txid = from_node.sendrawtransaction(hexstring=tx_hex, maxfeerate=maxfeerate, **kwargs)
-        self.scan_tx(from_node.decoderawtransaction(tx_hex))
+        self.scan_tx(tx_hex)
         return txid
 
     def create_self_transfer_chain(self, *, chain_length, utxo_to_spend=None):
@@ -430,6 +675,14 @@ class MiniWallet:
         return chain
 
 
+def _hash256_parts(*parts):
+    """Return the double-SHA256 of the concatenation of parts, without concatenating them"""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part)
+    return sha256(h.digest())
+
+
 def getnewdestination(address_type='bech32m'):
     """Generate a random destination of the specified type and return the
        corresponding public key, scriptPubKey and address. Supported types are
@@ -454,3 +707,89 @@ def getnewdestination(address_type='bech32m'):
     else:
         assert False
     return pubkey, scriptpubkey, address
+
+
+class TestMiniWallet(unittest.TestCase):
+    class FakeNode:
+        """Answers the RPCs used by rescan_utxos() from a fixed utxo set and counts the calls"""
+        def __init__(self, height, unspents):
+            self.height = height
+            self.unspents = unspents
+            self.calls = 0
+
+        def scantxoutset(self, **kwargs):
+            self.calls += 1
+            return {"success": True, "height": self.height, "unspents": self.unspents}
+
+        def getrawmempool(self, **kwargs):
+            self.calls += 1
+            return {}
+
+        def getblockcount(self):
+            self.calls += 1
+            return self.height
+
+    def test_get_utxo(self):
+        def unspent(n, amount, height, coinbase):
+            return {"txid": f"{n:064x}", "vout": 0, "amount": Decimal(amount), "height": height, "coinbase": coinbase}
+        node = self.FakeNode(200, [
+            unspent(1, 50, 102, True),  # immature at height 200
+            unspent(2, 25, 76, True),
+            unspent(3, 25, 80, True),
+            unspent(4, 10, 150, False),
+        ])
+        wallet = MiniWallet(node, mode=MiniWalletMode.RAW_OP_TRUE)
+        calls = node.calls
+        wallet.scan_tx({"txid": f"{5:064x}", "vin": [], "vout": [
+            {"n": n, "value": Decimal(amount), "scriptPubKey": {"hex": wallet.get_scriptPubKey().hex()}}
+            for n, amount in enumerate((25, 1, 2))]})
+        self.assertEqual(wallet.get_balance(), Decimal(138))
+        # Largest value first, lower height (unconfirmed) wins ties
+        self.assertEqual(wallet.get_utxo(mark_as_spent=False)["txid"], f"{5:064x}")
+        self.assertEqual(wallet.get_utxo(confirmed_only=True)["height"], 76)
+        self.assertEqual(wallet.get_utxo(txid=f"{5:064x}")["vout"], 1)
+        self.assertEqual(wallet.get_utxo(txid=f"{5:064x}", vout=0)["value"], 25)
+        self.assertRaises(StopIteration, wallet.get_utxo, txid=f"{5:064x}", vout=0)
+        self.assertEqual([wallet.get_utxo()["value"] for _ in range(3)], [25, 10, 2])
+        self.assertEqual(node.calls, calls)
+        # The immature coinbase is only picked up once the tip has advanced
+        self.assertRaises(StopIteration, wallet.get_utxo)
+        node.height = 201
+        self.assertEqual(wallet.get_utxo()["value"], 50)
+        self.assertRaises(StopIteration, wallet.get_utxo)
+
+    def test_scan_tx(self):
+        node = self.FakeNode(200, [{"txid": f"{1:064x}", "vout": 0, "amount": Decimal(50), "height": 1, "coinbase": True}])
+        wallet = MiniWallet(node, mode=MiniWalletMode.RAW_OP_TRUE)
+        tx = wallet.create_self_transfer_multi(utxos_to_spend=[wallet.get_utxo(mark_as_spent=False)], num_outputs=2)
+        wallet.scan_tx(tx["tx"])
+        self.assertEqual(wallet.get_utxos(mark_as_spent=False), tx["new_utxos"])
+        child = wallet.create_self_transfer(utxo_to_spend=tx["new_utxos"][0])
+        wallet.scan_tx(child["hex"])
+        self.assertEqual(wallet.get_utxos(mark_as_spent=False), [tx["new_utxos"][1], child["new_utxo"]])
+        decoded = {
+            "txid": f"{2:064x}",
+            "vin": [{"txid": child["txid"], "vout": 0}],
+            "vout": [{"n": 0, "value": Decimal(1), "scriptPubKey": {"hex": "51"}}],
+        }
+        wallet.scan_tx(decoded)
+        self.assertEqual(wallet.get_utxos(mark_as_spent=False), [tx["new_utxos"][1], {
+            "txid": f"{2:064x}", "vout": 0, "value": Decimal(1), "height": 0, "coinbase": False, "confirmations": 0,
+        }])
+
+    def test_create_self_transfers(self):
+        txouts = gen_return_txouts()
+        for mode in MiniWalletMode:
+            wallet = MiniWallet(self.FakeNode(200, []), mode=mode)
+            utxos = [wallet._create_utxo(txid=f"{n:064x}", vout=n, value=Decimal(50), height=1, coinbase=True, confirmations=200) for n in range(3)]
+            for chained in (False, True):
+                txs = wallet.create_self_transfers(utxos_to_spend=utxos, count=3, chained=chained, fee=Decimal("0.01"), txouts=txouts)
+                for i, tx in enumerate(txs):
+                    spent = txs[i - 1]["new_utxo"] if chained and i else utxos[i]
+                    self.assertEqual(tx["tx"].vin[0].prevout.hash, int(spent["txid"], 16))
+                    self.assertEqual(tx["fee"], Decimal("0.01"))
+                    self.assertEqual(tx["hex"], tx["tx"].serialize().hex())
+                    self.assertEqual(tx["wtxid"], tx["tx"].getwtxid())
+                    self.assertEqual(tx["txid"], tx["tx"].rehash())
+            tx = wallet.create_self_transfers(utxos_to_spend=utxos[:1], fee_rate=Decimal("0.01"), txouts=txouts)[0]
+            self.assertEqual(tx["fee"], get_fee(tx["tx"].get_vsize(), Decimal("0.01")))
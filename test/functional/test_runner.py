@@ -17,9 +17,11 @@ from collections import deque
 import configparser
 import csv
 import datetime
+import json
 import os
 import pathlib
 import platform
+import selectors
 import time
 import shutil
 import signal
@@ -37,6 +39,8 @@ MIN_FREE_SPACE = 1.1 * 1024 * 1024 * 1024
 ADDITIONAL_SPACE_PER_JOB = 100 * 1024 * 1024
 # Minimum amount of space required for --nocleanup
 MIN_NO_CLEANUP_SPACE = 12 * 1024 * 1024 * 1024
+# Cached chains which were not used for this long are removed on startup
+MAX_CACHE_AGE = 7 * 24 * 60 * 60
 
 # Formatting. Default colors to empty strings.
 DEFAULT, BOLD, GREEN, RED = ("", ""), ("", ""), ("", ""), ("", "")
@@ -416,6 +420,7 @@ NON_SCRIPTS = [
     # These are python files that live in the functional tests directory, but are not test scripts.
     "combine_logs.py",
     "create_cache.py",
+    "framework_bench.py",
     "test_runner.py",
 ]
 
@@ -435,7 +440,7 @@ def main():
     parser.add_argument('--extended', action='store_true', help='run the extended test suite in addition to the basic tests')
     parser.add_argument('--help', '-h', '-?', action='store_true', help='print help text and exit')
     parser.add_argument('--jobs', '-j', type=int, default=4, help='how many test scripts to run in parallel. Default=4.')
-    parser.add_argument('--keepcache', '-k', action='store_true', help='the default behavior is to flush the cache directory on startup. --keepcache retains the cache from the previous testrun.')
+    parser.add_argument('--keepcache', '-k', action='store_true', help='the default behavior is to remove cached chains which were not used for a week, or were created by an older version of the test framework, on startup. --keepcache retains all of them.')
     parser.add_argument('--quiet', '-q', action='store_true', help='only print dots, results summary and failure logs')
     parser.add_argument('--tmpdirprefix', '-t', default=tempfile.gettempdir(), help="Root directory for datadirs")
     parser.add_argument('--failfast', '-F', action='store_true', help='stop execution after the first test failure')
@@ -443,6 +448,8 @@ def main():
     parser.add_argument("--nocleanup", dest="nocleanup", default=False, action="store_true",
                         help="Leave bitcoinds and test.* datadir on exit or error")
     parser.add_argument('--resultsfile', '-r', help='store test results (as CSV) to the provided file')
+    parser.add_argument('--durationsfile', help='JSON file with the durations of previous test runs, used to start the longest tests first, and updated after the run '
+                                                '(default: test/functional_test_durations.json in the build directory)')
 
 
     args, unknown_args = parser.parse_known_args()
@@ -555,7 +562,9 @@ def main():
     check_script_prefixes()
 
     if not args.keepcache:
-        shutil.rmtree("%s/test/cache" % config["environment"]["BUILDDIR"], ignore_errors=True)
+        prune_cache("%s/test/cache" % config["environment"]["BUILDDIR"])
+
+    durations_filepath = pathlib.Path(args.durationsfile or "%s/test/functional_test_durations.json" % config["environment"]["BUILDDIR"])
 
     run_tests(
         test_list=test_list,
@@ -569,9 +578,30 @@ def main():
         failfast=args.failfast,
         use_term_control=args.ansi,
         results_filepath=results_filepath,
+        durations_filepath=durations_filepath,
     )
 
-def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=False, args=None, combined_logs_len=0, failfast=False, use_term_control, results_filepath=None):
+def prune_cache(cache_dir):
+    """Remove stale entries from the cache directory.
+
+    Cached chains are stored in directories named after a hash of everything they depend on
+    (see BitcoinTestFramework._get_chain_cache_dir), so they don't need to be flushed when
+    bitcoind is rebuilt, and are kept until they were not used for MAX_CACHE_AGE. Anything
+    else, like the unkeyed cache of older versions or interrupted builds, is removed."""
+    if not os.path.isdir(cache_dir):
+        return
+    now = time.time()
+    for entry in os.scandir(cache_dir):
+        if entry.name == "digests.json":
+            continue
+        if re.fullmatch("[0-9a-f]{16}", entry.name) and entry.is_dir() and now - entry.stat().st_mtime < MAX_CACHE_AGE:
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            os.remove(entry.path)
+
+def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=False, args=None, combined_logs_len=0, failfast=False, use_term_control, results_filepath=None, durations_filepath=None):
     args = args or []
 
     # Warn if bitcoind is already running
@@ -583,10 +613,7 @@ def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=
         # pgrep not supported
         pass
 
-    # Warn if there is a cache directory
     cache_dir = "%s/test/cache" % build_dir
-    if os.path.isdir(cache_dir):
-        print("%sWARNING!%s There is a cache directory here: %s. If tests fail unexpectedly, try deleting the cache directory." % (BOLD[1], BOLD[0], cache_dir))
 
     # Warn if there is not enough space on the testing dir
     min_space = MIN_FREE_SPACE + (jobs - 1) * ADDITIONAL_SPACE_PER_JOB
@@ -616,6 +643,8 @@ def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=
             sys.stdout.buffer.write(e.output)
             raise
 
+    durations = read_durations(durations_filepath) if durations_filepath else {}
+
     #Run Tests
     job_queue = TestHandler(
         num_tests_parallel=jobs,
@@ -624,6 +653,7 @@ def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=
         test_list=test_list,
         flags=flags,
         use_term_control=use_term_control,
+        durations=durations,
     )
     start_time = time.time()
     test_results = []
@@ -666,11 +696,16 @@ def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=
                     sys.exit(f"Early exiting after test failure due to insufficient free space in {tmpdir}\n"
                              f"Test execution data left in {tmpdir}.\n"
                              f"Additional storage is needed to execute testing.")
+        remaining_time = job_queue.predict_remaining_time()
+        if remaining_time is not None and not job_queue.done():
+            logging.debug("Predicted remaining time: %d s" % remaining_time)
 
     runtime = int(time.time() - start_time)
     print_results(test_results, max_len_name, runtime)
     if results_filepath:
         write_results(test_results, results_filepath, runtime)
+    if durations_filepath:
+        write_durations(durations, test_results, durations_filepath)
 
     if coverage:
         coverage_passed = coverage.report_rpc_coverage()
@@ -696,22 +731,24 @@ def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=
 
 
 def print_results(test_results, max_len_name, runtime):
-    results = "\n" + BOLD[1] + "%s | %s | %s\n\n" % ("TEST".ljust(max_len_name), "STATUS   ", "DURATION") + BOLD[0]
+    results = "\n" + BOLD[1] + "%s | %s | %s | %s\n\n" % ("TEST".ljust(max_len_name), "STATUS   ", "DURATION", "WAITING") + BOLD[0]
 
     test_results.sort(key=TestResult.sort_key)
     all_passed = True
     time_sum = 0
+    wait_time_sum = 0
 
     for test_result in test_results:
         all_passed = all_passed and test_result.was_successful
         time_sum += test_result.time
+        wait_time_sum += test_result.wait_time or 0
         test_result.padding = max_len_name
         results += str(test_result)
 
     status = TICK + "Passed" if all_passed else CROSS + "Failed"
     if not all_passed:
         results += RED[1]
-    results += BOLD[1] + "\n%s | %s | %s s (accumulated) \n" % ("ALL".ljust(max_len_name), status.ljust(9), time_sum) + BOLD[0]
+    results += BOLD[1] + "\n%s | %s | %s s (accumulated), %.1f s waiting \n" % ("ALL".ljust(max_len_name), status.ljust(9), time_sum, wait_time_sum) + BOLD[0]
     if not all_passed:
         results += RED[0]
     results += "Runtime: %s s\n" % (runtime)
@@ -721,31 +758,95 @@ def print_results(test_results, max_len_name, runtime):
 def write_results(test_results, filepath, total_runtime):
     with open(filepath, mode="w", encoding="utf8") as results_file:
         results_writer = csv.writer(results_file)
-        results_writer.writerow(['test', 'status', 'duration(seconds)'])
+        results_writer.writerow(['test', 'status', 'duration(seconds)', 'waiting(seconds)'])
         all_passed = True
+        wait_time_sum = 0
         for test_result in test_results:
             all_passed = all_passed and test_result.was_successful
-            results_writer.writerow([test_result.name, test_result.status, str(test_result.time)])
-        results_writer.writerow(['ALL', ("Passed" if all_passed else "Failed"), str(total_runtime)])
+            wait_time_sum += test_result.wait_time or 0
+            wait_time = "" if test_result.wait_time is None else "%.3f" % test_result.wait_time
+            results_writer.writerow([test_result.name, test_result.status, str(test_result.time), wait_time])
+        results_writer.writerow(['ALL', ("Passed" if all_passed else "Failed"), str(total_runtime), "%.3f" % wait_time_sum])
+
+def read_durations(filepath):
+    """Return the test durations recorded by write_durations(), or an empty dict if there are none."""
+    try:
+        with open(filepath, encoding="utf8") as durations_file:
+            return json.load(durations_file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"{BOLD[1]}WARNING!{BOLD[0]} Ignoring unreadable test durations file {filepath}: {e}")
+        return {}
+
+
+def write_durations(durations, test_results, filepath):
+    """Record the durations of the passed tests, averaged with the previous ones to smooth out noise."""
+    for test_result in test_results:
+        if test_result.status == "Passed":
+            previous = durations.get(test_result.name)
+            durations[test_result.name] = test_result.time if previous is None else (previous + test_result.time) / 2
+    try:
+        with open(filepath, mode="w", encoding="utf8") as durations_file:
+            json.dump(durations, durations_file, indent=1, sort_keys=True)
+    except OSError as e:
+        print(f"{BOLD[1]}WARNING!{BOLD[0]} Could not write test durations file {filepath}: {e}")
 
 class TestHandler:
     """
     Trigger the test scripts passed in via the list.
+
+    Tests with a known duration from previous runs are started longest first, after the
+    tests without one (in list order), so the long tests don't end up running alone at the
+    end of the run.
     """
 
-    def __init__(self, *, num_tests_parallel, tests_dir, tmpdir, test_list, flags, use_term_control):
+    def __init__(self, *, num_tests_parallel, tests_dir, tmpdir, test_list, flags, use_term_control, durations=None):
         assert num_tests_parallel >= 1
         self.num_jobs = num_tests_parallel
         self.tests_dir = tests_dir
         self.tmpdir = tmpdir
-        self.test_list = test_list
+        self.durations = durations or {}
+        self.test_list = sorted(test_list, key=lambda test: (test in self.durations, -self.durations.get(test, 0)))
         self.flags = flags
         self.jobs = []
         self.use_term_control = use_term_control
+        # On POSIX, each test process is passed the write end of a pipe, which is closed when
+        # it exits. Waiting on the read ends with a selector wakes up as soon as a test is done,
+        # instead of polling the processes periodically.
+        self.selector = selectors.DefaultSelector() if os.name == "posix" else None
+        self.exit_pipes = {}
 
     def done(self):
         return not (self.jobs or self.test_list)
 
+    def predict_remaining_time(self):
+        """Return the expected number of seconds until all tests are done, or None without durations from previous runs."""
+        if not self.durations:
+            return None
+        default_duration = sum(self.durations.values()) / len(self.durations)
+        now = time.time()
+        running = [max(self.durations.get(job[0], default_duration) - (now - job[1]), 0) for job in self.jobs]
+        queued = sum(self.durations.get(test, default_duration) for test in self.test_list)
+        return max(max(running, default=0), (sum(running) + queued) / self.num_jobs)
+
+    def _close_exit_pipe(self, proc):
+        fd = self.exit_pipes.pop(proc, None)
+        if fd is not None:
+            self.selector.unregister(fd)
+            os.close(fd)
+
+    def _wait(self, timeout):
+        """Wait until a test process may have exited, or the timeout elapsed."""
+        if self.selector is None:
+            time.sleep(timeout)
+            return
+        for key, _ in self.selector.select(timeout):
+            # The pipe was closed, which normally means that the process exited. It may also
+            # have been inherited by a forked child which is still running, so the process is
+            # polled to check. Either way, stop waiting on the pipe.
+            self._close_exit_pipe(key.data)
+
     def get_next(self):
         while len(self.jobs) < self.num_jobs and self.test_list:
             # Add tests
@@ -757,12 +858,19 @@ class TestHandler:
             test_argv = test.split()
             testdir = "{}/{}_{}".format(self.tmpdir, re.sub(".py$", "", test_argv[0]), portseed)
             tmpdir_arg = ["--tmpdir={}".format(testdir)]
+            exit_pipe_read, exit_pipe_write = os.pipe() if self.selector else (None, None)
+            proc = subprocess.Popen([sys.executable, self.tests_dir + test_argv[0]] + test_argv[1:] + self.flags + portseed_arg + tmpdir_arg,
+                                    text=True,
+                                    stdout=log_stdout,
+                                    stderr=log_stderr,
+                                    pass_fds=(exit_pipe_write,) if self.selector else ())
+            if self.selector:
+                os.close(exit_pipe_write)
+                self.selector.register(exit_pipe_read, selectors.EVENT_READ, proc)
+                self.exit_pipes[proc] = exit_pipe_read
             self.jobs.append((test,
                               time.time(),
-                              subprocess.Popen([sys.executable, self.tests_dir + test_argv[0]] + test_argv[1:] + self.flags + portseed_arg + tmpdir_arg,
-                                               text=True,
-                                               stdout=log_stdout,
-                                               stderr=log_stderr),
+                              proc,
                               testdir,
                               log_stdout,
                               log_stderr))
@@ -775,8 +883,7 @@ class TestHandler:
 
         dot_count = 0
         while True:
-            # Return all procs that have finished, if any. Otherwise sleep until there is one.
-            time.sleep(.5)
+            # Return all procs that have finished, if any. Otherwise wait until there is one.
             ret = []
             for job in self.jobs:
                 (name, start_time, proc, testdir, log_out, log_err) = job
@@ -793,23 +900,33 @@ class TestHandler:
                     else:
                         status = "Failed"
                     self.jobs.remove(job)
+                    if self.selector:
+                        self._close_exit_pipe(proc)
                     if self.use_term_control:
                         clearline = '\r' + (' ' * dot_count) + '\r'
                         print(clearline, end='', flush=True)
                     dot_count = 0
-                    ret.append((TestResult(name, status, int(time.time() - start_time)), testdir, stdout, stderr, skip_reason))
+                    ret.append((TestResult(name, status, int(time.time() - start_time), parse_wait_time(stdout)), testdir, stdout, stderr, skip_reason))
             if ret:
                 return ret
+            self._wait(.5)
             if self.use_term_control:
                 print('.', end='', flush=True)
             dot_count += 1
 
 
+def parse_wait_time(stdout):
+    """Return the seconds a test spent in wait_until(), as logged by the test framework on shutdown, or None."""
+    match = re.search(r"Waited (\d+\.\d+) s in \d+ wait_until\(\) calls", stdout)
+    return float(match.group(1)) if match else None
+
+
 class TestResult():
-    def __init__(self, name, status, time):
+    def __init__(self, name, status, time, wait_time=None):
         self.name = name
         self.status = status
         self.time = time
+        self.wait_time = wait_time
         self.padding = 0
 
     def sort_key(self):
@@ -831,7 +948,8 @@ class TestResult():
             color = DEFAULT
             glyph = CIRCLE
 
-        return color[1] + "%s | %s%s | %s s\n" % (self.name.ljust(self.padding), glyph, self.status.ljust(7), self.time) + color[0]
+        wait_time = "-" if self.wait_time is None else "%.1f s" % self.wait_time
+        return color[1] + "%s | %s%s | %s | %s\n" % (self.name.ljust(self.padding), glyph, self.status.ljust(7), ("%s s" % self.time).ljust(8), wait_time) + color[0]
 
     @property
     def was_successful(self):